@@ -0,0 +1,169 @@
+"""
+Неблокирующий доступ к StorageManager из async-обработчиков
+Все вызовы выполняются в отдельном потоке хранилища, поэтому файловый
+ввод-вывод и запросы к Google Sheets не останавливают event loop.
+Поток один, так что операции выполняются строго в порядке вызова.
+Операции переносов дополнительно захватывают KeyedLock по обеим записям
+переноса: конкурирующие обработчики одной записи ждут друг друга.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from booking_record import Booking
+from keyed_lock import KeyedLock
+
+
+class AsyncStorageManager:
+    """Awaitable-обертка над StorageManager"""
+    
+    def __init__(self, storage_manager):
+        self.sync = storage_manager
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage')
+        self.locks = KeyedLock()
+        
+        # Отложенная запись профилей клиентов тоже идет в потоке хранилища
+        storage_manager.users.submit = self._executor.submit
+    
+    @property
+    def availability_manager(self):
+        """Менеджер доступности (его методы, читающие хранилище, вызывать через run)"""
+        return self.sync.availability_manager
+    
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Выполняет блокирующую функцию в потоке хранилища"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+    
+    async def atomic(self, *calls: tuple) -> List[Any]:
+        """
+        Выполняет несколько методов StorageManager одной транзакцией
+        calls: кортежи (имя_метода, *аргументы); возвращает список результатов
+        """
+        def run_calls():
+            with self.sync.transaction():
+                return [getattr(self.sync, name)(*args) for name, *args in calls]
+        
+        return await self.run(run_calls)
+    
+    def booking_lock(self, *booking_ids: str):
+        """Блокировка записей на время нескольких связанных вызовов (async with)"""
+        return self.locks.acquire(*booking_ids)
+    
+    async def _locked(self, booking_id: str, func: Callable, *args) -> Any:
+        """Выполняет операцию переноса под блокировкой всех связанных записей"""
+        related_ids = await self.run(self.sync.get_related_booking_ids, booking_id)
+        while True:
+            async with self.locks.acquire(*related_ids):
+                # Пока ждали замок, перенос могли создать или завершить -
+                # если связи изменились, берем замки заново по новому набору
+                current_ids = await self.run(self.sync.get_related_booking_ids, booking_id)
+                if set(current_ids) == set(related_ids):
+                    return await self.run(func, *args)
+            related_ids = current_ids
+    
+    def close(self):
+        """Дожидается выполнения поставленных операций"""
+        self._executor.shutdown(wait=True)
+    
+    # === Записи ===
+    
+    async def add_booking(self, booking_data: Dict[str, Any]) -> Optional[str]:
+        return await self.run(self.sync.add_booking, booking_data)
+    
+    async def update_booking_status(self, booking_id: str, status: str,
+                                    master_comment: str = None) -> bool:
+        return await self.run(self.sync.update_booking_status, booking_id, status, master_comment)
+    
+    async def get_booking(self, booking_id: str) -> Optional[Booking]:
+        return await self.run(self.sync.get_booking, booking_id)
+    
+    async def get_user_bookings(self, telegram_id: str,
+                                status_filter: List[str] = None) -> List[Booking]:
+        return await self.run(self.sync.get_user_bookings, telegram_id, status_filter)
+    
+    async def cancel_booking_by_id(self, booking_id: str) -> bool:
+        return await self._locked(booking_id, self.sync.cancel_booking_by_id, booking_id)
+    
+    async def compare_and_set_status(self, booking_id: str, expected_version: int, status: str,
+                                     master_comment: str = None) -> Tuple[bool, str]:
+        # Блокировка не нужна: конфликт определяется по версии записи
+        return await self.run(self.sync.compare_and_set_status, booking_id, expected_version,
+                              status, master_comment)
+    
+    # === Переносы ===
+    
+    async def request_reschedule(self, original_booking_id: str, new_booking_data: Dict) -> tuple:
+        return await self._locked(original_booking_id, self.sync.request_reschedule,
+                                  original_booking_id, new_booking_data)
+    
+    async def offer_reschedule(self, original_booking_id: str, new_date: str, new_time: str) -> tuple:
+        return await self._locked(original_booking_id, self.sync.offer_reschedule,
+                                  original_booking_id, new_date, new_time)
+    
+    async def accept_reschedule(self, reschedule_booking_id: str, accepted_by: str,
+                                expected_version: int = None) -> tuple:
+        return await self._locked(reschedule_booking_id, self.sync.accept_reschedule,
+                                  reschedule_booking_id, accepted_by, expected_version)
+    
+    async def reject_reschedule(self, reschedule_booking_id: str, rejected_by: str,
+                                reason: str = "") -> tuple:
+        return await self._locked(reschedule_booking_id, self.sync.reject_reschedule,
+                                  reschedule_booking_id, rejected_by, reason)
+    
+    async def cancel_reschedule_request(self, original_booking_id: str) -> tuple:
+        return await self._locked(original_booking_id, self.sync.cancel_reschedule_request,
+                                  original_booking_id)
+    
+    async def get_reschedule_info(self, booking_id: str) -> Optional[Dict]:
+        return await self.run(self.sync.get_reschedule_info, booking_id)
+    
+    async def get_reschedule_requests(self) -> List[Dict]:
+        return await self.run(self.sync.get_reschedule_requests)
+    
+    async def get_reschedule_offers(self) -> List[Dict]:
+        return await self.run(self.sync.get_reschedule_offers)
+    
+    async def get_reschedule_requests_count(self) -> int:
+        return await self.run(self.sync.get_reschedule_requests_count)
+    
+    async def get_reschedule_offers_count(self) -> int:
+        return await self.run(self.sync.get_reschedule_offers_count)
+    
+    # === Пользователи ===
+    
+    async def save_user_phone(self, telegram_id: str, phone: str):
+        return await self.run(self.sync.save_user_phone, telegram_id, phone)
+    
+    async def get_user_phone(self, telegram_id: str) -> Optional[str]:
+        return await self.run(self.sync.get_user_phone, telegram_id)
+    
+    async def get_user_profile(self, telegram_id: str) -> Optional[Dict]:
+        return await self.run(self.sync.get_user_profile, telegram_id)
+    
+    async def touch_user(self, telegram_id: str):
+        return await self.run(self.sync.touch_user, telegram_id)
+    
+    # === Мастер ===
+    
+    async def get_bookings_by_status(self, status: str) -> List[Booking]:
+        return await self.run(self.sync.get_bookings_by_status, status)
+    
+    async def get_bookings_between(self, start: datetime, end: datetime,
+                                   statuses: List[str] = None) -> List[Booking]:
+        return await self.run(self.sync.get_bookings_between, start, end, statuses)
+    
+    async def get_statistics(self) -> Dict[str, int]:
+        return await self.run(self.sync.get_statistics)
+    
+    async def get_service_counts(self, statuses: List[str] = None) -> Dict[str, int]:
+        return await self.run(self.sync.get_service_counts, statuses)
+    
+    async def get_daily_occupancy(self, start: date, end: date) -> Dict[str, int]:
+        return await self.run(self.sync.get_daily_occupancy, start, end)
+    
+    async def get_sheets_queue_stats(self) -> Optional[Dict]:
+        return await self.run(self.sync.get_sheets_queue_stats)
@@ -2,8 +2,6 @@
 Менеджер для управления доступными временными слотами мастера
 """
 
-import json
-import os
 from datetime import datetime, timedelta, date
 from typing import Dict, List, Optional, Set
 from dataclasses import dataclass
@@ -40,10 +38,6 @@ class AvailabilityManager:
     
     def __init__(self, storage_manager):
         self.storage = storage_manager
-        self.data_dir = 'data'
-        self.availability_file = os.path.join(self.data_dir, 'availability.json')
-        
-        self._ensure_data_dir()
         self.default_work_hours = {
             'monday': {'start': '10:00', 'end': '20:00', 'enabled': True},
             'tuesday': {'start': '10:00', 'end': '20:00', 'enabled': True},
@@ -58,23 +52,13 @@ class AvailabilityManager:
         # Загружаем настройки
         self.work_hours = self._load_work_hours()
     
-    def _ensure_data_dir(self):
-        """Создает папку data если её нет"""
-        if not os.path.exists(self.data_dir):
-            os.makedirs(self.data_dir)
-    
     def _load_availability(self) -> Dict:
         """Загружает данные о доступности"""
-        try:
-            with open(self.availability_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {}
+        return self.storage.load_document('availability')
     
     def _save_availability(self, data: Dict):
         """Сохраняет данные о доступности"""
-        with open(self.availability_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        self.storage.save_document('availability', data)
     
     def _load_work_hours(self) -> Dict:
         """Загружает рабочие часы"""
@@ -144,16 +128,8 @@ class AvailabilityManager:
         available_slots = []
         
         if date_str in month_slots:
-            # Получаем существующие записи на эту дату
-            all_bookings = self.storage._load_bookings()
-            booked_times = []
-            
-            for booking in all_bookings.values():
-                if booking.get('date') == date_str:
-                    status = booking.get('status', '')
-                    # Учитываем только активные и подтвержденные записи
-                    if status in ['ожидает', 'подтверждено', 'запрос переноса']:
-                        booked_times.append(booking.get('time'))
+            # Время, занятое активными записями (из индекса хранилища)
+            booked_times = set(self.storage.get_occupied_times(date_str))
             
             # Фильтруем свободные слоты
             for slot in month_slots[date_str]:
@@ -164,8 +140,13 @@ class AvailabilityManager:
     
     def is_slot_available(self, date_str: str, time_str: str) -> bool:
         """Проверяет, доступен ли слот"""
-        available_slots = self.get_available_slots(date_str)
-        return time_str in available_slots
+        if self.storage.get_slot_booking(date_str, time_str) is not None:
+            return False
+        
+        # Время свободно - проверяем, что оно входит в рабочие часы
+        date_obj = datetime.strptime(date_str, '%d.%m.%Y')
+        month_slots = self.generate_slots_for_month(date_obj.year, date_obj.month)
+        return any(slot.time == time_str for slot in month_slots.get(date_str, []))
     
     def update_work_hours(self, weekday: str, start: str, end: str, enabled: bool = True):
         """Обновляет рабочие часы для дня недели - ИСПРАВЛЕННЫЙ МЕТОД"""
@@ -0,0 +1,154 @@
+"""
+Замеры производительности локального хранилища
+Запуск: python bench_storage.py [количество записей ...]
+По умолчанию: 10000 и 100000 записей
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta
+
+from booking_columns import BookingColumns, numpy
+from booking_ids import new_booking_id
+from booking_record import Booking
+from durable_writer import write_atomic
+from serializers import SERIALIZERS, load_file
+
+STATUSES = ['ожидает', 'подтверждено', 'выполнено', 'отменено', 'отклонено']
+SERVICES = ['💅 Маникюр - 1500₽', '👠 Педикюр - 2000₽', '🎨 Дизайн ногтей - от 500₽']
+NAMES = ['Анна', 'Мария', 'Елена', 'Ольга', 'Наталья', 'Ирина']
+
+
+def generate_bookings(count: int, seed: int = 42) -> dict:
+    """Генерирует записи, похожие на настоящие"""
+    rnd = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    bookings = {}
+    
+    for _ in range(count):
+        booking_id = new_booking_id()
+        day = start + timedelta(days=rnd.randrange(730))
+        created = day - timedelta(days=rnd.randrange(1, 14))
+        bookings[booking_id] = {
+            'timestamp': created.strftime('%Y-%m-%d %H:%M:%S'),
+            'name': rnd.choice(NAMES),
+            'phone': f"+7 9{rnd.randrange(10**9):09d}",
+            'date': day.strftime('%d.%m.%Y'),
+            'time': f"{rnd.randrange(10, 22)}:00",
+            'service': rnd.choice(SERVICES),
+            'telegram_id': rnd.randrange(10**8, 10**9),
+            'username': f"user{rnd.randrange(10**5)}",
+            'booking_id': booking_id,
+            'created_at': created.isoformat(),
+            'status': rnd.choice(STATUSES),
+            'status_updated': created.isoformat(),
+        }
+    
+    return bookings
+
+
+def bench_serializers(bookings: dict, directory: str):
+    """Время сохранения/загрузки и размер файла для каждого формата"""
+    print(f"\n📊 Форматы файлов, записей: {len(bookings)}")
+    print(f"{'формат':<10}{'сохранение, с':>16}{'загрузка, с':>14}{'размер, КБ':>13}")
+    
+    for name, serializer in SERIALIZERS.items():
+        file_path = os.path.join(directory, f'bookings_{name}.json')
+        
+        started = time.perf_counter()
+        write_atomic(file_path, bookings, serializer)
+        save_time = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        loaded = load_file(file_path)
+        load_time = time.perf_counter() - started
+        
+        assert loaded == bookings, f"{name}: данные после загрузки не совпадают"
+        size_kb = os.path.getsize(file_path) / 1024
+        print(f"{name:<10}{save_time:>16.3f}{load_time:>14.3f}{size_kb:>13.0f}")
+
+
+def bench_memory(bookings: dict, directory: str):
+    """Память на одну запись: словари из JSON против Booking"""
+    count = len(bookings)
+    file_path = os.path.join(directory, 'bookings_memory.json')
+    write_atomic(file_path, bookings, SERIALIZERS['compact'])
+    
+    print(f"\n📊 Память, записей: {count}")
+    print(f"{'представление':<16}{'байт на запись':>16}")
+    
+    for name, build in (('dict', lambda data: data),
+                        ('Booking', lambda data: {key: Booking(value, key) for key, value in data.items()})):
+        tracemalloc.start()
+        bookings = build(load_file(file_path))
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        
+        assert len(bookings) == count
+        print(f"{name:<16}{used / count:>16.0f}")
+        del bookings
+
+
+def bench_columns(bookings: dict, repeat: int = 5):
+    """Подсчеты по статусам, услугам и дням: обход записей против колонок"""
+    records = {booking_id: Booking(data, booking_id) for booking_id, data in bookings.items()}
+    active = ['ожидает', 'подтверждено']
+    start = datetime(2024, 6, 1)
+    end = start + timedelta(days=30)
+    days = {(start + timedelta(days=i)).strftime('%d.%m.%Y') for i in range(31)}
+    
+    def loops():
+        by_status = Counter(booking.get('status') for booking in records.values())
+        by_service = Counter(booking.get('service') for booking in records.values()
+                             if booking.get('status') in active)
+        by_day = Counter(booking.get('date') for booking in records.values()
+                         if booking.get('status') in active and booking.get('date') in days)
+        return by_status, by_service, by_day
+    
+    def columnar(columns):
+        return (columns.count_by_status(),
+                columns.count_by_service(active),
+                columns.occupancy_by_day(start.date(), end.date(), active))
+    
+    print(f"\n📊 Аналитика, записей: {len(bookings)}")
+    print(f"{'способ':<16}{'построение, с':>15}{'подсчет, мс':>14}")
+    
+    variants = [('обход записей', None, loops)]
+    for name, use_numpy in (('array', False), ('numpy', True)):
+        if use_numpy and numpy is None:
+            continue
+        started = time.perf_counter()
+        columns = BookingColumns(records.items(), use_numpy=use_numpy)
+        build_time = time.perf_counter() - started
+        variants.append((name, build_time, lambda columns=columns: columnar(columns)))
+    
+    expected = None
+    for name, build_time, run in variants:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            result = run()
+        run_time = (time.perf_counter() - started) / repeat * 1000
+        
+        result = [dict(counts) for counts in result]
+        if expected is None:
+            expected = result
+        assert result == expected, f"{name}: результаты подсчета не совпадают"
+        
+        build = f"{build_time:.3f}" if build_time is not None else '-'
+        print(f"{name:<16}{build:>15}{run_time:>14.1f}")
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            bookings = generate_bookings(size)
+            bench_serializers(bookings, directory)
+            bench_memory(bookings, directory)
+            bench_columns(bookings)
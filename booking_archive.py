@@ -0,0 +1,339 @@
+"""
+Архив завершенных записей
+Записи в статусах выполнено/отменено/отклонено старше ARCHIVE_AFTER_DAYS
+переносятся из основного хранилища в сжатые помесячные файлы data/archive.
+Индекс архива (месяцы клиента, счетчики по статусам) хранится отдельно,
+поэтому статистика не открывает архивы. Месяц каждой записи лежит в
+шардах ids/<месяц создания ID>.json (месяц создания читается из самого ID,
+у старых uuid4 - общий шард legacy): поиск по ID открывает один шард,
+а перенос в архив переписывает только затронутые шарды.
+Прочитанные партиции держатся в LRU-кеше с ограничением по памяти
+(ARCHIVE_CACHE_MB): старые записи находятся по ID, но память не растет
+вместе с историей.
+"""
+
+import gzip
+import os
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import serializers
+from booking_time import booking_datetime_key
+from booking_ids import booking_id_time
+from durable_writer import write_atomic, write_bytes_atomic
+
+# Статусы, после которых запись больше не меняется
+FINISHED_STATUSES = ['выполнено', 'отменено', 'отклонено']
+
+# Во сколько раз записи в памяти больше своего сериализованного вида
+MEMORY_FACTOR = 4
+
+# Сколько шардов индекса ID держать в памяти
+ID_SHARD_CACHE = 12
+
+# Шард для ID, из которых нельзя прочитать время создания (uuid4 до смены формата)
+LEGACY_SHARD = 'legacy'
+
+
+def booking_month(booking: Dict) -> Optional[str]:
+    """Месяц записи в виде YYYY-MM (по дате визита)"""
+    try:
+        return datetime.strptime(booking.get('date', ''), '%d.%m.%Y').strftime('%Y-%m')
+    except ValueError:
+        return None
+
+
+class BookingArchive:
+    """Помесячные сжатые партиции завершенных записей"""
+    
+    def __init__(self, archive_dir: str, cache_bytes: int = 8 * 1024 * 1024):
+        self.archive_dir = archive_dir
+        self.cache_bytes = cache_bytes
+        self.index_file = os.path.join(archive_dir, 'index.json')
+        self.ids_dir = os.path.join(archive_dir, 'ids')
+        self.serializer = serializers.get_serializer()
+        
+        if not os.path.exists(self.ids_dir):
+            os.makedirs(self.ids_dir)
+        
+        self._index = None
+        
+        # LRU шардов индекса ID: шард -> {booking_id: месяц}
+        self._shards = OrderedDict()
+        
+        # LRU прочитанных партиций: month -> (записи, оценка занимаемой памяти)
+        self._partition_cache = OrderedDict()
+        self._cached_bytes = 0
+    
+    # === Перенос в архив ===
+    
+    def archive(self, bookings: Dict[str, Dict]) -> int:
+        """Дописывает записи в партиции своих месяцев"""
+        index = self._load_index()
+        by_month = {}
+        for booking_id, booking in bookings.items():
+            month = booking_month(booking)
+            if month:
+                by_month.setdefault(month, {})[booking_id] = booking
+        
+        months = {}  # booking_id -> месяц для индекса ID
+        for month, month_bookings in by_month.items():
+            partition = self._load_partition(month)
+            for booking_id, booking in month_bookings.items():
+                if booking_id in partition:
+                    self._count(index, month, partition[booking_id], -1)
+                partition[booking_id] = booking
+                self._count(index, month, booking, 1)
+                months[booking_id] = month
+                
+                user_months = index['users'].setdefault(str(booking.get('telegram_id')), [])
+                if month not in user_months:
+                    user_months.append(month)
+            
+            self._save_partition(month, partition)
+        
+        # Индекс пишем после партиций: при сбое запись останется в основном хранилище
+        self._update_shards(months)
+        self._save_index()
+        return sum(len(month_bookings) for month_bookings in by_month.values())
+    
+    def restore(self, booking_id: str) -> Optional[Dict]:
+        """Забирает запись из архива (например, если ее статус снова меняют)"""
+        index = self._load_index()
+        month = self._month_of(booking_id)
+        if not month:
+            return None
+        
+        partition = self._load_partition(month)
+        booking = partition.pop(booking_id, None)
+        if booking is not None:
+            self._count(index, month, booking, -1)
+            self._save_partition(month, partition)
+        
+        self._update_shards({booking_id: None})
+        self._save_index()
+        return booking
+    
+    # === Чтение ===
+    
+    def has(self, booking_id: str) -> bool:
+        """Есть ли запись в архиве"""
+        return self._month_of(booking_id) is not None
+    
+    def get(self, booking_id: str) -> Optional[Dict]:
+        """Получает запись из архива по ID"""
+        month = self._month_of(booking_id)
+        if not month:
+            return None
+        return self._load_partition(month).get(booking_id)
+    
+    def find(self, telegram_id: str = None, statuses: List[str] = None,
+             date: str = None) -> List[Dict]:
+        """Ищет записи в архиве, открывая только подходящие партиции"""
+        index = self._load_index()
+        
+        if date is not None:
+            months = [booking_month({'date': date})]
+        elif telegram_id is not None:
+            months = index['users'].get(str(telegram_id), [])
+        else:
+            months = list(index['counts'])
+        
+        # Партиции без записей в нужных статусах не открываем
+        if statuses is not None:
+            months = [month for month in months
+                      if any(index['counts'].get(month, {}).get(status) for status in statuses)]
+        
+        result = []
+        for month in months:
+            if not month:
+                continue
+            for booking_id, booking in self._load_partition(month).items():
+                if telegram_id is not None and str(booking.get('telegram_id')) != str(telegram_id):
+                    continue
+                if statuses is not None and booking.get('status') not in statuses:
+                    continue
+                if date is not None and booking.get('date') != date:
+                    continue
+                result.append({'booking_id': booking_id, **booking})
+        return result
+    
+    def find_between(self, start_key: str, end_key: str,
+                     statuses: List[str] = None) -> List[Dict]:
+        """Ищет записи с датой и временем в диапазоне, открывая только партиции этих месяцев"""
+        index = self._load_index()
+        months = [month for month in sorted(index['counts'])
+                  if start_key[:7] <= month <= end_key[:7]]
+        
+        result = []
+        for month in months:
+            for booking_id, booking in self._load_partition(month).items():
+                if statuses is not None and booking.get('status') not in statuses:
+                    continue
+                if start_key <= booking_datetime_key(booking) <= end_key:
+                    result.append({'booking_id': booking_id, **booking})
+        
+        result.sort(key=booking_datetime_key)
+        return result
+    
+    def count_by_status(self) -> Dict[str, int]:
+        """Считает записи архива по статусам (по индексу)"""
+        counts = {}
+        for month_counts in self._load_index()['counts'].values():
+            for status, count in month_counts.items():
+                counts[status] = counts.get(status, 0) + count
+        return counts
+    
+    def count_by_service(self, statuses: List[str] = None) -> Dict[str, int]:
+        """Считает записи архива по услугам (только с указанными статусами, по индексу)"""
+        counts = {}
+        for status, service_counts in self._load_index()['services'].items():
+            if statuses is not None and status not in statuses:
+                continue
+            for service, count in service_counts.items():
+                counts[service] = counts.get(service, 0) + count
+        return counts
+    
+    def months(self) -> List[str]:
+        """Месяцы, для которых есть партиции"""
+        return sorted(self._load_index()['counts'])
+    
+    # === Файлы ===
+    
+    def _partition_file(self, month: str) -> str:
+        """Файл партиции месяца"""
+        return os.path.join(self.archive_dir, f'{month}.gz')
+    
+    def _load_partition(self, month: str) -> Dict[str, Dict]:
+        """Читает партицию месяца (из кеша или с диска)"""
+        cached = self._partition_cache.get(month)
+        if cached is not None:
+            self._partition_cache.move_to_end(month)
+            return cached[0]
+        
+        file_path = self._partition_file(month)
+        partition = {}
+        size = 0
+        if os.path.exists(file_path):
+            with gzip.open(file_path, 'rb') as f:
+                payload = f.read()
+            partition = serializers.loads(payload)
+            size = len(payload)
+        
+        self._cache_partition(month, partition, size)
+        return partition
+    
+    def _save_partition(self, month: str, partition: Dict[str, Dict]):
+        """Записывает партицию месяца (сжатой)"""
+        payload = self.serializer.dumps(partition)
+        write_bytes_atomic(self._partition_file(month), gzip.compress(payload))
+        self._cache_partition(month, partition, len(payload))
+    
+    def _cache_partition(self, month: str, partition: Dict[str, Dict], size: int):
+        """Кладет партицию в кеш и вытесняет давно не использованные (size - несжатый размер)"""
+        size *= MEMORY_FACTOR
+        previous = self._partition_cache.pop(month, None)
+        if previous is not None:
+            self._cached_bytes -= previous[1]
+        
+        self._partition_cache[month] = (partition, size)
+        self._cached_bytes += size
+        
+        # Последнюю прочитанную партицию держим всегда, даже если она больше бюджета
+        while self._cached_bytes > self.cache_bytes and len(self._partition_cache) > 1:
+            _, (_, evicted_size) = self._partition_cache.popitem(last=False)
+            self._cached_bytes -= evicted_size
+    
+    def _load_index(self) -> Dict:
+        """Загружает индекс архива"""
+        if self._index is None:
+            index = {}
+            if os.path.exists(self.index_file):
+                index = serializers.load_file(self.index_file)
+            index.setdefault('users', {})     # telegram_id -> месяцы
+            index.setdefault('counts', {})    # месяц -> статус -> количество
+            self._index = index
+            
+            # Счетчики по услугам появились позже - для старого архива считаем их один раз
+            if 'services' not in index:
+                index['services'] = {}        # статус -> услуга -> количество
+                for month in index['counts']:
+                    for booking in self._load_partition(month).values():
+                        self._count_service(index, booking, 1)
+                self._save_index()
+            
+            # Старый индекс хранил месяцы всех записей в одном файле - раскладываем по шардам
+            legacy = index.pop('bookings', None)
+            if legacy:
+                self._update_shards(legacy)
+                self._save_index()
+                print(f"✅ Индекс архива разложен по шардам: {len(legacy)} записей")
+        return self._index
+    
+    def _save_index(self):
+        """Сохраняет индекс архива"""
+        write_atomic(self.index_file, self._load_index(), self.serializer)
+    
+    @classmethod
+    def _count(cls, index: Dict, month: str, booking: Dict, delta: int):
+        """Изменяет счетчики статуса записи в месяце и ее услуги"""
+        status = booking.get('status')
+        month_counts = index['counts'].setdefault(month, {})
+        month_counts[status] = month_counts.get(status, 0) + delta
+        if month_counts[status] <= 0:
+            del month_counts[status]
+        cls._count_service(index, booking, delta)
+    
+    @staticmethod
+    def _count_service(index: Dict, booking: Dict, delta: int):
+        """Изменяет счетчик услуги записи (записи без услуги не считаются)"""
+        service = booking.get('service')
+        if service is None:
+            return
+        service_counts = index['services'].setdefault(booking.get('status'), {})
+        service_counts[service] = service_counts.get(service, 0) + delta
+        if service_counts[service] <= 0:
+            del service_counts[service]
+    
+    # === Шарды индекса ID ===
+    
+    @staticmethod
+    def _id_shard(booking_id: str) -> str:
+        """Шард ID: месяц создания записи (из ID) или legacy"""
+        created = booking_id_time(booking_id)
+        return created.strftime('%Y-%m') if created else LEGACY_SHARD
+    
+    def _load_shard(self, shard: str) -> Dict[str, str]:
+        """Шард индекса ID (из кеша или с диска)"""
+        ids = self._shards.get(shard)
+        if ids is not None:
+            self._shards.move_to_end(shard)
+            return ids
+        
+        file_path = os.path.join(self.ids_dir, f'{shard}.json')
+        ids = serializers.load_file(file_path) if os.path.exists(file_path) else {}
+        self._shards[shard] = ids
+        while len(self._shards) > ID_SHARD_CACHE:
+            self._shards.popitem(last=False)
+        return ids
+    
+    def _month_of(self, booking_id: str) -> Optional[str]:
+        """Месяц партиции, в которой лежит запись"""
+        self._load_index()  # Разложит старый индекс по шардам, если он еще не разложен
+        return self._load_shard(self._id_shard(booking_id)).get(booking_id)
+    
+    def _update_shards(self, months: Dict[str, Optional[str]]):
+        """Меняет месяцы записей (None - удаляет) и сразу пишет затронутые шарды"""
+        by_shard = {}
+        for booking_id, month in months.items():
+            by_shard.setdefault(self._id_shard(booking_id), {})[booking_id] = month
+        
+        for shard, changes in by_shard.items():
+            ids = self._load_shard(shard)
+            for booking_id, month in changes.items():
+                if month is None:
+                    ids.pop(booking_id, None)
+                else:
+                    ids[booking_id] = month
+            write_atomic(os.path.join(self.ids_dir, f'{shard}.json'), ids, self.serializer)
@@ -0,0 +1,184 @@
+"""
+Колоночное представление записей для аналитики
+Каждое поле хранится отдельным упакованным массивом (модуль array):
+код статуса, код услуги, номер дня (date.toordinal), минута начала и
+telegram_id. Подсчеты идут проходами по массивам на уровне C
+(bytes.translate, itertools.compress, Counter), а если установлен NumPy -
+векторно через numpy. Удаление строки переносит на ее место последнюю.
+"""
+
+from array import array
+from collections import Counter
+from datetime import date, datetime
+from itertools import compress
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy
+except ImportError:  # NumPy не обязателен
+    numpy = None
+
+NO_DAY = 0        # Дата не задана или не разбирается
+NO_MINUTE = -1    # Время не задано или не разбирается
+
+
+class BookingColumns:
+    """Записи в виде набора колонок-массивов"""
+    
+    def __init__(self, bookings: Iterable[Tuple[str, dict]] = (), use_numpy: bool = True):
+        self.use_numpy = use_numpy and numpy is not None
+        
+        self.ids = []
+        self._rows = {}  # booking_id -> номер строки
+        
+        self.status = array('B')
+        self.service = array('H')
+        self.day = array('l')
+        # Время и клиент - для запросов по часам и по клиентам
+        self.minute = array('h')
+        self.user = array('q')
+        
+        # Справочники кодов: значение -> код и код -> значение
+        self._status_codes = {}
+        self._statuses = []
+        self._service_codes = {}
+        self._services = []
+        self._days = {}  # строка даты -> номер дня (даты повторяются)
+        
+        for booking_id, booking in bookings:
+            self.put(booking_id, booking)
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    # === Изменения ===
+    
+    def put(self, booking_id: str, booking: dict):
+        """Добавляет запись или обновляет ее строку"""
+        values = (
+            self._code(self._status_codes, self._statuses, booking.get('status')),
+            self._code(self._service_codes, self._services, booking.get('service')),
+            self._day(booking.get('date')),
+            self._minute(booking.get('time')),
+            self._user(booking.get('telegram_id')),
+        )
+        
+        row = self._rows.get(booking_id)
+        if row is None:
+            self._rows[booking_id] = len(self.ids)
+            self.ids.append(booking_id)
+            for column, value in zip(self._columns(), values):
+                column.append(value)
+        else:
+            for column, value in zip(self._columns(), values):
+                column[row] = value
+    
+    def remove(self, booking_id: str):
+        """Удаляет строку записи (на ее место встает последняя)"""
+        row = self._rows.pop(booking_id, None)
+        if row is None:
+            return
+        
+        last_id = self.ids.pop()
+        for column in self._columns():
+            value = column.pop()
+            if last_id != booking_id:
+                column[row] = value
+        if last_id != booking_id:
+            self.ids[row] = last_id
+            self._rows[last_id] = row
+    
+    # === Подсчеты ===
+    
+    def count_by_status(self) -> Dict[str, int]:
+        """Количество записей по статусам"""
+        return self._decode(self._count(self.status), self._statuses)
+    
+    def count_by_service(self, statuses: List[str] = None) -> Dict[str, int]:
+        """Количество записей по услугам (только с указанными статусами)"""
+        return self._decode(self._count(self.service, self._status_mask(statuses)), self._services)
+    
+    def occupancy_by_day(self, start: date, end: date, statuses: List[str] = None) -> Dict[str, int]:
+        """Количество записей по дням в диапазоне [start, end]: 'ДД.ММ.ГГГГ' -> число"""
+        low, high = start.toordinal(), end.toordinal()
+        counts = self._count(self.day, self._status_mask(statuses))
+        return {
+            date.fromordinal(day).strftime('%d.%m.%Y'): count
+            for day, count in sorted(counts.items())
+            if low <= day <= high
+        }
+    
+    # === Вспомогательные методы ===
+    
+    def _columns(self) -> Tuple[array, ...]:
+        return self.status, self.service, self.day, self.minute, self.user
+    
+    def _status_mask(self, statuses: Optional[List[str]]) -> Optional[bytes]:
+        """Байтовая маска строк с нужными статусами (None - все строки)"""
+        if statuses is None:
+            return None
+        
+        table = bytearray(256)
+        for status in statuses:
+            code = self._status_codes.get(status)
+            if code is not None:
+                table[code] = 1
+        return self.status.tobytes().translate(table)
+    
+    def _count(self, column: array, mask: Optional[bytes] = None) -> Dict[int, int]:
+        """Сколько раз встречается каждое значение колонки (по маске строк)"""
+        if self.use_numpy:
+            values = numpy.frombuffer(column, dtype=column.typecode)
+            if mask is not None:
+                values = values[numpy.frombuffer(mask, dtype=numpy.bool_)]
+            if column.typecode in 'BH':
+                # Коды справочников небольшие - достаточно bincount
+                counts = numpy.bincount(values)
+                codes = numpy.nonzero(counts)[0]
+                return dict(zip(codes.tolist(), counts[codes].tolist()))
+            codes, counts = numpy.unique(values, return_counts=True)
+            return dict(zip(codes.tolist(), counts.tolist()))
+        
+        if mask is not None:
+            return Counter(compress(column, mask))
+        return Counter(column)
+    
+    @staticmethod
+    def _decode(counts: Dict[int, int], names: List[str]) -> Dict[str, int]:
+        return {names[code]: count for code, count in counts.items() if names[code] is not None}
+    
+    @staticmethod
+    def _code(codes: Dict, names: List, value) -> int:
+        """Код значения в справочнике (новые значения добавляются)"""
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(names)
+            names.append(value)
+        return code
+    
+    def _day(self, date_str: Optional[str]) -> int:
+        """Номер дня для 'ДД.ММ.ГГГГ'"""
+        day = self._days.get(date_str)
+        if day is None:
+            try:
+                day = datetime.strptime(date_str, '%d.%m.%Y').toordinal()
+            except (TypeError, ValueError):
+                day = NO_DAY
+            self._days[date_str] = day
+        return day
+    
+    @staticmethod
+    def _minute(time_str: Optional[str]) -> int:
+        """Минута от начала суток для 'ЧЧ:ММ'"""
+        try:
+            hours, minutes = time_str.split(':')
+            return int(hours) * 60 + int(minutes)
+        except (AttributeError, ValueError):
+            return NO_MINUTE
+    
+    @staticmethod
+    def _user(telegram_id) -> int:
+        try:
+            return int(telegram_id)
+        except (TypeError, ValueError):
+            return 0
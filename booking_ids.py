@@ -0,0 +1,75 @@
+"""
+Компактные идентификаторы записей, упорядоченные по времени
+48 бит - время создания в миллисекундах, 80 бит - случайная часть.
+Кодируются 26 символами base32 Крокфорда (0-9, A-Z без I, L, O, U):
+без '_' и '-', поэтому безопасны в URL и в callback_data, где части
+разделяются '_'. Строковый порядок ID совпадает с порядком создания.
+Старые записи сохраняют свои uuid4; время из ID читает только архив
+(booking_id_time), для остальных ID там None.
+"""
+
+import secrets
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+TIME_CHARS = 10    # 48 бит времени
+RANDOM_CHARS = 16  # 80 бит случайности
+RANDOM_BITS = 80
+
+_lock = threading.Lock()
+_last_ms = 0
+_last_random = 0
+
+
+def _encode(value: int, length: int) -> str:
+    """Число в base32 фиксированной длины"""
+    chars = []
+    for _ in range(length):
+        chars.append(ALPHABET[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+
+def new_booking_id() -> str:
+    """
+    Новый ID записи
+    В пределах одной миллисекунды случайная часть увеличивается на 1,
+    поэтому ID, созданные подряд, строго возрастают
+    """
+    global _last_ms, _last_random
+    
+    with _lock:
+        ms = time.time_ns() // 1_000_000
+        if ms <= _last_ms:
+            ms = _last_ms
+            random_part = _last_random + 1
+            if random_part >> RANDOM_BITS:
+                # Случайная часть переполнилась - занимаем следующую миллисекунду
+                ms += 1
+                random_part = secrets.randbits(RANDOM_BITS)
+        else:
+            random_part = secrets.randbits(RANDOM_BITS)
+        
+        _last_ms, _last_random = ms, random_part
+    
+    return _encode(ms, TIME_CHARS) + _encode(random_part, RANDOM_CHARS)
+
+
+def booking_id_time(booking_id: str) -> Optional[datetime]:
+    """Время создания из ID (None для старых uuid4 и чужих строк)"""
+    if not isinstance(booking_id, str) or len(booking_id) != TIME_CHARS + RANDOM_CHARS:
+        return None
+    
+    ms = 0
+    for char in booking_id[:TIME_CHARS]:
+        value = ALPHABET.find(char)
+        if value < 0:
+            return None
+        ms = ms * 32 + value
+    if any(char not in ALPHABET for char in booking_id[TIME_CHARS:]):
+        return None
+    return datetime.fromtimestamp(ms / 1000)
@@ -0,0 +1,159 @@
+"""
+Компактная неизменяемая запись о бронировании
+Поля хранятся в __slots__ вместо словаря, повторяющиеся строки (статусы,
+услуги, время) хранятся в одном экземпляре. Запись ведет себя как
+словарь только для чтения: booking['status'], booking.get('name'), {**booking}.
+Изменение создает новую запись (replace), поэтому хранилище может отдавать
+свои записи без копирования.
+"""
+
+import sys
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator
+
+# Поля записи (остальные ключи хранятся в дополнительном словаре)
+FIELDS = (
+    'booking_id', 'timestamp', 'name', 'phone', 'date', 'time', 'service',
+    'telegram_id', 'username', 'created_at', 'status', 'status_updated',
+    'master_comment', 'original_booking_id', 'old_status', 'reschedule_type',
+    'master_proposed', 'reschedule_id', 'version',
+)
+
+# Поля с небольшим числом разных значений: строки интернируются
+INTERNED_FIELDS = frozenset(('date', 'time', 'service', 'status', 'old_status', 'reschedule_type'))
+
+# Статусы, при которых запись занимает свое время (дату и время может занять одна запись)
+SLOT_STATUSES = ('ожидает', 'подтверждено', 'запрос переноса', 'предложение переноса')
+
+_FIELD_SET = frozenset(FIELDS)
+
+
+class _Missing:
+    """Отметка незаданного поля"""
+    
+    __slots__ = ()
+    
+    def __repr__(self):
+        return '<нет>'
+
+
+_MISSING = _Missing()  # Поле не задано (в отличие от поля со значением None)
+_set_slot = object.__setattr__
+
+
+class SlotTakenError(ValueError):
+    """Время уже занято другой активной записью"""
+    
+    def __init__(self, date: str, time: str, booking_id: str):
+        super().__init__(f"Время {date} {time} уже занято записью {booking_id[-8:]}...")
+        self.date = date
+        self.time = time
+        self.booking_id = booking_id
+
+
+def occupies_slot(booking: Mapping) -> bool:
+    """Занимает ли запись свое время"""
+    return booking.get('status') in SLOT_STATUSES and bool(booking.get('date')) and bool(booking.get('time'))
+
+
+def intern_value(field: str, value: Any) -> Any:
+    """Интернирует строку, если поле из INTERNED_FIELDS"""
+    if field in INTERNED_FIELDS and type(value) is str:
+        return sys.intern(value)
+    return value
+
+
+class Booking(Mapping):
+    """Запись о бронировании: словарь только для чтения на __slots__"""
+    
+    __slots__ = FIELDS + ('_extra',)
+    
+    def __init__(self, data: Dict[str, Any], booking_id: str = None):
+        extra = None
+        for field in FIELDS:
+            _set_slot(self, field, _MISSING)
+        
+        for key, value in data.items():
+            if key in _FIELD_SET:
+                _set_slot(self, key, intern_value(key, value))
+            else:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+        
+        if booking_id is not None:
+            _set_slot(self, 'booking_id', booking_id)
+        _set_slot(self, '_extra', extra)
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], booking_id: str = None) -> 'Booking':
+        """Запись из словаря (уже готовая запись возвращается как есть)"""
+        if isinstance(data, Booking) and (booking_id is None or data.booking_id == booking_id):
+            return data
+        return cls(data, booking_id)
+    
+    def replace(self, fields: Dict[str, Any]) -> 'Booking':
+        """Новая запись с измененными полями"""
+        data = self.to_dict()
+        data.update(fields)
+        return Booking(data)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Изменяемая копия в виде словаря (для сериализации)"""
+        data = {}
+        for field in FIELDS:
+            value = getattr(self, field)
+            if value is not _MISSING:
+                data[field] = value
+        if self._extra:
+            data.update(self._extra)
+        return data
+    
+    copy = to_dict
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("Booking только для чтения, используйте replace()")
+    
+    def __delattr__(self, name):
+        raise AttributeError("Booking только для чтения, используйте replace()")
+    
+    # === Интерфейс словаря ===
+    
+    def __getitem__(self, key: str) -> Any:
+        if key in _FIELD_SET:
+            value = getattr(self, key)
+            if value is not _MISSING:
+                return value
+        elif self._extra and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in _FIELD_SET:
+            value = getattr(self, key)
+            return default if value is _MISSING else value
+        if self._extra:
+            return self._extra.get(key, default)
+        return default
+    
+    def __contains__(self, key: object) -> bool:
+        if key in _FIELD_SET:
+            return getattr(self, key) is not _MISSING
+        return bool(self._extra) and key in self._extra
+    
+    def __iter__(self) -> Iterator[str]:
+        for field in FIELDS:
+            if getattr(self, field) is not _MISSING:
+                yield field
+        if self._extra:
+            yield from self._extra
+    
+    def __len__(self) -> int:
+        count = sum(1 for field in FIELDS if getattr(self, field) is not _MISSING)
+        return count + (len(self._extra) if self._extra else 0)
+    
+    def __repr__(self) -> str:
+        return f"Booking({self.to_dict()!r})"
+    
+    def __reduce__(self):
+        return Booking, (self.to_dict(),)
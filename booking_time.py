@@ -0,0 +1,26 @@
+"""
+Сортируемый ключ даты и времени записи
+В записях дата хранится как ДД.ММ.ГГГГ, поэтому сравнение строк
+упорядочивает по дню месяца. Ключ 'ГГГГ-ММ-ДД ЧЧ:ММ' сортируется
+как строка в хронологическом порядке.
+"""
+
+from datetime import datetime
+from typing import Dict
+
+BOOKING_FORMAT = '%d.%m.%Y %H:%M'
+KEY_FORMAT = '%Y-%m-%d %H:%M'
+
+
+def datetime_key(moment: datetime) -> str:
+    """Ключ для момента времени"""
+    return moment.strftime(KEY_FORMAT)
+
+
+def booking_datetime_key(booking: Dict) -> str:
+    """Ключ записи по ее дате и времени ('' если дата не разбирается)"""
+    try:
+        moment = datetime.strptime(f"{booking.get('date', '')} {booking.get('time', '')}", BOOKING_FORMAT)
+    except ValueError:
+        return ''
+    return datetime_key(moment)
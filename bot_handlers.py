@@ -94,11 +94,11 @@ Telegram-канал: {TELEGRAM_CHANNEL}
         ]
         return ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
     
-    def _get_date_keyboard(self, start_day=1, days=5):
+    async def _get_date_keyboard(self, start_day=1, days=5):
         """Создает клавиатуру с доступными датами"""
         # Используем availability_manager для получения доступных дат
         if hasattr(self.storage, 'availability_manager'):
-            available_dates = self.storage.availability_manager.get_available_dates(days_ahead=days)
+            available_dates = await self.storage.run(self.storage.availability_manager.get_available_dates, days_ahead=days)
             # Берем первые N дат
             available_dates = available_dates[:days]
         else:
@@ -143,11 +143,11 @@ Telegram-канал: {TELEGRAM_CHANNEL}
         days = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
         return days[weekday]
     
-    def _get_time_keyboard(self, date_str: str):
+    async def _get_time_keyboard(self, date_str: str):
         """Создает клавиатуру с доступным временем для указанной даты"""
         # Используем availability_manager для получения доступного времени
         if hasattr(self.storage, 'availability_manager'):
-            available_slots = self.storage.availability_manager.get_available_slots(date_str)
+            available_slots = await self.storage.run(self.storage.availability_manager.get_available_slots, date_str)
             
             if not available_slots:
                 keyboard = [['⏰ Нет свободного времени'], ['🔙 Назад']]
@@ -250,6 +250,8 @@ Telegram-канал: {TELEGRAM_CHANNEL}
             welcome_text,
             reply_markup=self._get_main_menu()
         )
+        
+        await self.storage.touch_user(user.id)
         return ConversationHandler.END
     
     async def handle_main_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -288,7 +290,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
         
         try:
             # Получаем активные записи и запросы переноса
-            user_bookings = self.storage.get_user_bookings(
+            user_bookings = await self.storage.get_user_bookings(
                 user_id, 
                 status_filter=['ожидает', 'подтверждено', 'запрос переноса', 'предложение переноса']
             )
@@ -399,7 +401,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
                     return ConversationHandler.END
                 
                 # Отменяем запрос переноса
-                success, message = self.storage.cancel_reschedule_request(
+                success, message = await self.storage.cancel_reschedule_request(
                     selected_booking.get('original_booking_id', selected_booking['booking_id'])
                 )
                 
@@ -435,7 +437,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
                     return ConversationHandler.END
                 
                 # Принимаем предложение
-                success, message = self.storage.accept_reschedule(
+                success, message = await self.storage.accept_reschedule(
                     selected_booking['booking_id'], 
                     'client'
                 )
@@ -479,7 +481,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
                     return ConversationHandler.END
                 
                 # Отклоняем предложение
-                success, message = self.storage.reject_reschedule(
+                success, message = await self.storage.reject_reschedule(
                     selected_booking['booking_id'], 
                     'client',
                     "Клиент отказался от предложения"
@@ -598,7 +600,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
 """
                 await update.message.reply_text(
                     message,
-                    reply_markup=self._get_date_keyboard()
+                    reply_markup=await self._get_date_keyboard()
                 )
                 return RESCHEDULE_DATE
                 
@@ -629,7 +631,12 @@ Telegram-канал: {TELEGRAM_CHANNEL}
             
             if booking_to_cancel:
                 try:
-                    success = self.storage.cancel_booking_by_id(booking_to_cancel['booking_id'])
+                    # Отмена не пройдет, если мастер успел изменить запись после показа
+                    success, error = await self.storage.compare_and_set_status(
+                        booking_to_cancel['booking_id'],
+                        booking_to_cancel.get('version', 0),
+                        'отменено'
+                    )
                     
                     if success:
                         await self._notify_master_about_cancellation(
@@ -648,7 +655,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
 Вы можете записаться на другое время через главное меню.
 """
                     else:
-                        message = "⚠️ Не удалось отменить запись. Попробуйте позже или свяжитесь с мастером."
+                        message = f"⚠️ Не удалось отменить запись. {error}.\nПроверьте список записей или свяжитесь с мастером."
                         
                 except Exception as e:
                     print(f"❌ Ошибка отмены записи: {e}")
@@ -710,7 +717,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
                     "✅ Не ранее завтрашнего дня\n"
                     "✅ Не позднее чем через 30 дней\n\n"
                     "Пожалуйста, выберите дату из списка:",
-                    reply_markup=self._get_date_keyboard()
+                    reply_markup=await self._get_date_keyboard()
                 )
                 return RESCHEDULE_DATE
                 
@@ -720,14 +727,14 @@ Telegram-канал: {TELEGRAM_CHANNEL}
                 "Пожалуйста, введите дату в формате ДД.ММ.ГГГГ\n"
                 "Например: 25.12.2024\n\n"
                 "Или выберите из предложенных вариантов:",
-                reply_markup=self._get_date_keyboard()
+                reply_markup=await self._get_date_keyboard()
             )
             return RESCHEDULE_DATE
         
         context.user_data['new_date'] = date_str
         
         # Получаем доступное время для выбранной даты
-        keyboard = self._get_time_keyboard(date_str)
+        keyboard = await self._get_time_keyboard(date_str)
         
         await update.message.reply_text(
             f"📅 Вы выбрали {date_str}\n"
@@ -745,7 +752,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
             context.user_data.pop('new_date', None)
             await update.message.reply_text(
                 "Возвращаюсь к выбору даты...",
-                reply_markup=self._get_date_keyboard()
+                reply_markup=await self._get_date_keyboard()
             )
             return RESCHEDULE_DATE
         
@@ -754,11 +761,11 @@ Telegram-канал: {TELEGRAM_CHANNEL}
         
         # Проверяем доступность времени
         if hasattr(self.storage, 'availability_manager'):
-            if not self.storage.availability_manager.is_slot_available(date_str, selected_time):
+            if not await self.storage.run(self.storage.availability_manager.is_slot_available, date_str, selected_time):
                 await update.message.reply_text(
                     f"❌ Время {selected_time} на {date_str} уже занято.\n"
                     f"Пожалуйста, выберите другое время:",
-                    reply_markup=self._get_time_keyboard(date_str)
+                    reply_markup=await self._get_time_keyboard(date_str)
                 )
                 return RESCHEDULE_TIME
         
@@ -814,7 +821,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
             context.user_data.pop('new_time', None)
             
             date_str = context.user_data.get('new_date', '')
-            keyboard = self._get_time_keyboard(date_str)
+            keyboard = await self._get_time_keyboard(date_str)
             
             await update.message.reply_text(
                 "Возвращаюсь к выбору времени...",
@@ -848,7 +855,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
                     'username': update.effective_user.username or ''
                 }
                 
-                success, new_booking_id, error_message = self.storage.request_reschedule(
+                success, new_booking_id, error_message = await self.storage.request_reschedule(
                     booking_id, 
                     new_booking_data
                 )
@@ -990,7 +997,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
             context.user_data['name'] = user_input
         
         user_id = update.effective_user.id
-        saved_phone = self.storage.get_user_phone(user_id)
+        saved_phone = await self.storage.get_user_phone(user_id)
         
         if saved_phone:
             formatted_phone = self._format_phone(saved_phone)
@@ -1036,7 +1043,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
         name = context.user_data['name']
         
         user_id = update.effective_user.id
-        saved_phone = self.storage.get_user_phone(user_id)
+        saved_phone = await self.storage.get_user_phone(user_id)
         
         if saved_phone:
             formatted_phone = self._format_phone(saved_phone)
@@ -1085,7 +1092,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
                     context.user_data['phone'] = phone
                     
                     user_id = update.effective_user.id
-                    self.storage.save_user_phone(user_id, phone)
+                    await self.storage.save_user_phone(user_id, phone)
                     
                     name = context.user_data.get('name', '')
                     formatted_phone = self._format_phone(phone)
@@ -1095,7 +1102,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
                         f"Ваш номер: {formatted_phone}\n\n"
                         f"📅 Теперь выберите дату визита:\n"
                         f"Доступные даты на ближайшие 5 дней:",
-                        reply_markup=self._get_date_keyboard()
+                        reply_markup=await self._get_date_keyboard()
                     )
                     return DATE
                 else:
@@ -1119,7 +1126,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
             context.user_data['phone'] = phone
             
             user_id = update.effective_user.id
-            self.storage.save_user_phone(user_id, phone)
+            await self.storage.save_user_phone(user_id, phone)
             
             formatted_phone = self._format_phone(phone)
             
@@ -1130,7 +1137,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
                 f"Ваш номер: {formatted_phone}\n\n"
                 f"📅 Теперь выберите дату визита:\n"
                 f"Доступные даты на ближайшие 5 дней:",
-                reply_markup=self._get_date_keyboard()
+                reply_markup=await self._get_date_keyboard()
             )
             return DATE
         else:
@@ -1156,7 +1163,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
             context.user_data.pop('phone', None)
             
             user_id = update.effective_user.id
-            saved_phone = self.storage.get_user_phone(user_id)
+            saved_phone = await self.storage.get_user_phone(user_id)
             
             if saved_phone:
                 formatted_phone = self._format_phone(saved_phone)
@@ -1205,7 +1212,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
                 context.user_data['date'] = date_str
                 
                 # Получаем доступное время для выбранной даты
-                keyboard = self._get_time_keyboard(date_str)
+                keyboard = await self._get_time_keyboard(date_str)
                 
                 name = context.user_data.get('name', '')
                 await update.message.reply_text(
@@ -1219,7 +1226,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
                     "❌ Выбрана некорректная дата.\n"
                     "Дата должна быть не ранее завтрашнего дня.\n\n"
                     "Пожалуйста, выберите дату из списка:",
-                    reply_markup=self._get_date_keyboard()
+                    reply_markup=await self._get_date_keyboard()
                 )
                 return DATE
         else:
@@ -1232,7 +1239,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
                     context.user_data['date'] = date_str
                     
                     # Получаем доступное время для выбранной даты
-                    keyboard = self._get_time_keyboard(date_str)
+                    keyboard = await self._get_time_keyboard(date_str)
                     
                     name = context.user_data.get('name', '')
                     await update.message.reply_text(
@@ -1258,7 +1265,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
                     "Пожалуйста, введите дату в формате ДД.ММ.ГГГГ\n"
                     "Например: 25.12.2024\n\n"
                     "Или выберите из предложенных вариантов:",
-                    reply_markup=self._get_date_keyboard()
+                    reply_markup=await self._get_date_keyboard()
                 )
                 return DATE
     
@@ -1271,7 +1278,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
             context.user_data.pop('date', None)
             await update.message.reply_text(
                 "Возвращаюсь к выбору даты...",
-                reply_markup=self._get_date_keyboard()
+                reply_markup=await self._get_date_keyboard()
             )
             return DATE
         
@@ -1280,11 +1287,11 @@ Telegram-канал: {TELEGRAM_CHANNEL}
         
         # Проверяем доступность времени
         if hasattr(self.storage, 'availability_manager'):
-            if not self.storage.availability_manager.is_slot_available(date_str, selected_time):
+            if not await self.storage.run(self.storage.availability_manager.is_slot_available, date_str, selected_time):
                 await update.message.reply_text(
                     f"❌ Время {selected_time} на {date_str} уже занято.\n"
                     f"Пожалуйста, выберите другое время:",
-                    reply_markup=self._get_time_keyboard(date_str)
+                    reply_markup=await self._get_time_keyboard(date_str)
                 )
                 return TIME
         
@@ -1309,7 +1316,7 @@ Telegram-канал: {TELEGRAM_CHANNEL}
             context.user_data.pop('time', None)
             
             date_str = context.user_data.get('date', '')
-            keyboard = self._get_time_keyboard(date_str)
+            keyboard = await self._get_time_keyboard(date_str)
             
             await update.message.reply_text(
                 "Возвращаюсь к выбору времени...",
@@ -1386,16 +1393,28 @@ Telegram-канал: {TELEGRAM_CHANNEL}
                 'username': update.effective_user.username or ''
             }
             
-            booking_id = self.storage.add_booking(booking_data)
+            # Запись и телефон клиента сохраняются одной транзакцией
+            user_id = update.effective_user.id
+            booking_id, _ = await self.storage.atomic(
+                ('add_booking', booking_data),
+                ('save_user_phone', user_id, context.user_data['phone'])
+            )
+            
+            if booking_id is None:
+                # Пока клиент подтверждал, время успел занять кто-то другой
+                await update.message.reply_text(
+                    f"😔 Время {booking_data['date']} {booking_data['time']} только что заняли.\n\n"
+                    "Пожалуйста, выберите другое время через главное меню.",
+                    reply_markup=self._get_main_menu()
+                )
+                context.user_data.clear()
+                return ConversationHandler.END
             
             await self.notifications.notify_master_new_booking({
                 **booking_data,
                 'booking_id': booking_id
             })
             
-            user_id = update.effective_user.id
-            self.storage.save_user_phone(user_id, context.user_data['phone'])
-            
             name = context.user_data.get('name', '')
             await update.message.reply_text(
                 f"🎉 {name}, запись успешно создана!\n\n"
@@ -20,6 +20,44 @@ MASTER_CHAT_ID = os.getenv('MASTER_CHAT_ID')
 # Путь к файлу авторизации Google
 CREDENTIALS_FILE = 'credentials.json'
 
+# Сколько раз повторять неудачное обновление Google Sheets из очереди, прежде чем отбросить его
+SHEETS_MAX_ATTEMPTS = int(os.getenv('SHEETS_MAX_ATTEMPTS', '10'))
+
+# Как часто (секунды) обновлять лист с записями, отсортированными по статусу и дате
+SHEETS_VIEW_REFRESH_SECONDS = int(os.getenv('SHEETS_VIEW_REFRESH_SECONDS', '300'))
+
+# Окно сбора изменений для Google Sheets (мс): изменения за окно отправляются одной пачкой
+SHEETS_COALESCE_MS = int(os.getenv('SHEETS_COALESCE_MS', '1000'))
+
+# =====================
+# ЛОКАЛЬНОЕ ХРАНИЛИЩЕ
+# =====================
+
+# Тип хранилища: json (файлы в data/) или sqlite
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json').lower()
+
+# Файл базы данных для STORAGE_BACKEND=sqlite
+SQLITE_DB_FILE = os.getenv('SQLITE_DB_FILE', os.path.join('data', 'bookings.sqlite3'))
+
+# Через сколько записей в журнале изменений пересобирать снимок
+STORAGE_COMPACT_EVERY = int(os.getenv('STORAGE_COMPACT_EVERY', '500'))
+
+# Формат файлов хранилища: compact (JSON без отступов), pretty (JSON с отступами) или binary
+# Файлы в другом формате переводятся автоматически при первом чтении
+STORAGE_FORMAT = os.getenv('STORAGE_FORMAT', 'compact').lower()
+
+# Через сколько дней после визита завершенные записи уходят в архив (0 - не архивировать)
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '90'))
+
+# Память под кеш прочитанных архивных месяцев (МБ): старые записи подгружаются с диска по мере надобности
+ARCHIVE_CACHE_MB = int(os.getenv('ARCHIVE_CACHE_MB', '8'))
+
+# Окно групповой записи файлов на диск (мс): изменения за окно пишутся одной пачкой
+STORAGE_COMMIT_DELAY_MS = int(os.getenv('STORAGE_COMMIT_DELAY_MS', '50'))
+
+# Задержка записи профилей клиентов (мс): изменения за это время пишутся одной пачкой
+USERS_FLUSH_DELAY_MS = int(os.getenv('USERS_FLUSH_DELAY_MS', '2000'))
+
 # =====================
 # ИНФОРМАЦИЯ О МАСТЕРЕ/САЛОНЕ
 # =====================
@@ -0,0 +1,208 @@
+"""
+Надежная запись файлов хранилища
+Данные сериализуются в формате STORAGE_FORMAT (см. serializers.py).
+Файл пишется во временный, сбрасывается на диск (fsync) и атомарно
+заменяет старый, поэтому сбой во время записи не портит данные.
+Записи, пришедшие в течение короткого окна, фиксируются одной пачкой.
+"""
+
+import atexit
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import serializers
+
+
+def write_atomic(file_path: str, data: Any, serializer=None):
+    """Атомарно записывает файл (без ожидания пачки)"""
+    serializer = serializer or serializers.get_serializer()
+    write_bytes_atomic(file_path, serializer.dumps(data))
+
+
+def write_bytes_atomic(file_path: str, payload: bytes):
+    """Атомарно записывает готовое содержимое файла"""
+    _replace_file(file_path, payload)
+    fsync_dir(os.path.dirname(os.path.abspath(file_path)))
+
+
+def _replace_file(file_path: str, payload: bytes):
+    """Пишет временный файл, сбрасывает его на диск и подменяет им старый"""
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def fsync_dir(dir_path: str):
+    """Сбрасывает на диск запись каталога (чтобы переименование пережило сбой)"""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(dir_path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class DurableWriter:
+    """Групповая фиксация: записи за окно commit_delay сбрасываются одной пачкой"""
+    
+    def __init__(self, commit_delay: float = 0.05, serializer=None):
+        self.commit_delay = commit_delay
+        self.serializer = serializer or serializers.get_serializer()
+        self.commits = 0  # Количество пачек, записанных на диск
+        self.writes = 0   # Количество запрошенных записей
+        
+        self._pending = {}   # file_path -> содержимое, ожидающее записи
+        self._inflight = {}  # file_path -> содержимое, которое пишется сейчас
+        self._condition = threading.Condition()
+        self._commit_lock = threading.Lock()
+        self._closed = False
+        self._checked = set()  # Файлы, формат которых уже проверен
+        
+        self._thread = threading.Thread(target=self._run, name='durable-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+    
+    def write(self, file_path: str, data: Any, sync: bool = False):
+        """
+        Ставит файл в очередь на запись
+        sync=True - дождаться, пока файл (и вся пачка) окажется на диске
+        """
+        # Сериализуем сразу: вызывающий код может менять data дальше
+        payload = self.serializer.dumps(data)
+        
+        with self._condition:
+            self._pending[file_path] = payload
+            self.writes += 1
+            self._condition.notify()
+        
+        if sync or self._closed:
+            self.flush()
+    
+    def read(self, file_path: str, default: Optional[Any] = None) -> Any:
+        """Читает файл с учетом еще не записанных изменений"""
+        with self._condition:
+            payload = self._pending.get(file_path) or self._inflight.get(file_path)
+        
+        try:
+            if payload is not None:
+                return self.serializer.loads(payload)
+            with open(file_path, 'rb') as f:
+                payload = f.read()
+            data = serializers.loads(payload)
+        except FileNotFoundError:
+            return default
+        except ValueError as e:
+            print(f"⚠️ Файл {file_path} поврежден ({e}), используются данные по умолчанию")
+            return default
+        
+        # Файл в другом формате переводим в текущий при первом чтении - сразу, а не
+        # фоновой записью: иначе файл изменится уже после того, как хранилище запомнило
+        # его отпечаток, и будет принят за изменение извне
+        if file_path not in self._checked:
+            self._checked.add(file_path)
+            file_format = serializers.detect_format(payload)
+            if file_format != self.serializer.name:
+                print(f"✅ Файл {file_path} переводится из формата {file_format} в {self.serializer.name}")
+                try:
+                    write_bytes_atomic(file_path, self.serializer.dumps(data))
+                except OSError as e:
+                    self._checked.discard(file_path)
+                    print(f"⚠️ Файл {file_path} не переведен в {self.serializer.name}: {e}")
+        
+        return data
+    
+    def flush(self):
+        """
+        Записывает на диск все ожидающие изменения
+        Если какой-то файл записать не удалось, бросает OSError (файл остается в очереди)
+        """
+        with self._commit_lock:
+            with self._condition:
+                batch = self._pending
+                self._pending = {}
+                self._inflight = batch
+            
+            failed = self._commit(batch) if batch else []
+        
+        if failed:
+            raise OSError(f"Не записаны на диск: {', '.join(failed)}")
+    
+    def close(self):
+        """Останавливает фоновую запись и сбрасывает очередь"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        try:
+            self.flush()
+        except OSError as e:
+            print(f"❌ {e}")
+    
+    def _run(self):
+        """Фоновый поток: ждет первую запись, выдерживает окно и фиксирует пачку"""
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+            
+            # Даем накопиться записям, пришедшим следом
+            time.sleep(self.commit_delay)
+            try:
+                self.flush()
+            except OSError:
+                pass  # Ошибка уже напечатана, файлы повторятся со следующей пачкой
+    
+    def _commit(self, batch: Dict[str, bytes]) -> List[str]:
+        """
+        Записывает пачку файлов: временный файл + fsync + переименование
+        Возвращает файлы, которые не удалось записать или сбросить на диск
+        """
+        dirs = {}  # каталог -> записанные в него файлы
+        failed = {}
+        
+        for file_path, payload in batch.items():
+            try:
+                _replace_file(file_path, payload)
+                dirs.setdefault(os.path.dirname(os.path.abspath(file_path)), []).append(file_path)
+            except OSError as e:
+                print(f"❌ Ошибка записи {file_path}: {e}")
+                failed[file_path] = payload
+        
+        for dir_path, file_paths in dirs.items():
+            try:
+                fsync_dir(dir_path)
+            except OSError as e:
+                # Переименование может не пережить сбой - считаем файлы незаписанными
+                print(f"❌ Не удалось сбросить каталог {dir_path}: {e}")
+                for file_path in file_paths:
+                    failed[file_path] = batch[file_path]
+        
+        with self._condition:
+            self._inflight = {}
+            # Неудачные записи повторим со следующей пачкой, если их не заменили новые
+            for file_path, payload in failed.items():
+                self._pending.setdefault(file_path, payload)
+        
+        self.commits += 1
+        return sorted(failed)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> DurableWriter:
+    """Общий писатель для всех хранилищ процесса"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            from config import STORAGE_COMMIT_DELAY_MS
+            _writer = DurableWriter(STORAGE_COMMIT_DELAY_MS / 1000)
+        return _writer
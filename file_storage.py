@@ -0,0 +1,555 @@
+"""
+Файловое хранилище: JSON-снимки + журнал изменений
+Используется StorageManager по умолчанию (STORAGE_BACKEND=json)
+"""
+
+import copy
+import os
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from booking_record import Booking, SlotTakenError, occupies_slot
+from booking_time import booking_datetime_key
+from durable_writer import get_writer, write_atomic
+from mutation_log import MutationLog, iter_operations
+
+try:
+    import fcntl
+except ImportError:  # Нет на Windows: блокировки между процессами не будет
+    fcntl = None
+
+# Поля, по которым строятся вторичные индексы записей
+INDEXED_FIELDS = ('telegram_id', 'status', 'date')
+
+
+class FileStorage:
+    """Хранилище записей и пользователей в JSON-файлах папки data"""
+    
+    def __init__(self, data_dir: str, compact_every: int = 500):
+        self.data_dir = data_dir
+        self.bookings_file = os.path.join(self.data_dir, 'bookings_storage.json')
+        self.users_file = os.path.join(self.data_dir, 'users_data.json')
+        self.log_file = os.path.join(self.data_dir, 'storage_log.jsonl')
+        self.lock_file = os.path.join(self.data_dir, 'storage.lock')
+        self._writer = get_writer()
+        
+        # Кеш в памяти для производительности
+        self._bookings_cache = None
+        self._users_cache = None
+        
+        # Служебные документы: name -> данные; измененные пишутся в файлы при компактификации
+        self._documents = {}
+        self._dirty_documents = set()
+        
+        # Изменения открытой транзакции (None - транзакции нет)
+        self._tx_records = None
+        
+        # Вторичные индексы: поле -> значение -> множество booking_id
+        self._indexes = {field: {} for field in INDEXED_FIELDS}
+        
+        # Упорядоченный индекс по дате и времени: отсортированный список (ключ, booking_id)
+        self._time_keys = {}
+        self._time_index = []
+        
+        # Занятое время: дата -> время -> booking_id (только записи со статусами SLOT_STATUSES)
+        self._slots = {}
+        
+        # Журнал изменений: файлы выше - снимки, изменения дописываются в журнал
+        self._log = MutationLog(self.log_file, compact_every)
+        
+        # Отпечаток файлов (mtime, размер, inode) на момент последнего чтения/записи:
+        # если файлы изменил другой процесс или администратор, кеш перечитывается
+        self._signature = None
+        self._generation = 0
+        
+        # Блокировка файла storage.lock (flock): изменения, перечитывание и
+        # компактификация в разных процессах идут по очереди
+        self._lock_handle = None
+        self._lock_depth = 0
+        
+        self._ensure_files()
+    
+    def _ensure_files(self):
+        """Создает необходимые файлы"""
+        default_files = {
+            self.bookings_file: {},
+            self.users_file: {}
+        }
+        
+        # Под блокировкой: иначе процесс, запущенный вместе с другим, затрет
+        # пустым файлом снимок, который тот уже успел записать
+        with self._process_lock():
+            for file_path, default_data in default_files.items():
+                if not os.path.exists(file_path):
+                    write_atomic(file_path, default_data)
+                    print(f"✅ Создан файл {file_path}")
+    
+    # === Актуальность кеша ===
+    
+    def generation(self) -> int:
+        """Номер поколения данных: увеличивается, когда файлы изменены извне"""
+        self._refresh_if_stale()
+        return self._generation
+    
+    def _file_signature(self) -> Tuple:
+        """Отпечаток файлов хранилища"""
+        signature = []
+        for file_path in (self.bookings_file, self.users_file, self.log_file):
+            try:
+                stat = os.stat(file_path)
+                signature.append((stat.st_mtime_ns, stat.st_size, stat.st_ino))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+    
+    def _refresh_if_stale(self):
+        """Перечитывает данные, если файлы изменились не через этот экземпляр"""
+        if self._bookings_cache is None or self._tx_records is not None:
+            return
+        if self._file_signature() == self._signature:
+            return
+        
+        print("⚠️ Файлы хранилища изменены извне, данные перечитаны")
+        # Журнал мог быть заменен - открываем его заново при следующей записи
+        self._log.close()
+        self._load_state()
+        self._generation += 1
+    
+    @contextmanager
+    def _process_lock(self):
+        """
+        Эксклюзивная блокировка хранилища между процессами (повторный вход разрешен)
+        Под ней данные сверяются с диском, поэтому изменение не строится на устаревшем состоянии
+        """
+        if fcntl is None or self._lock_depth:
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+            return
+        
+        if self._lock_handle is None:
+            self._lock_handle = open(self.lock_file, 'a')
+        fcntl.flock(self._lock_handle, fcntl.LOCK_EX)
+        self._lock_depth = 1
+        try:
+            self._refresh_if_stale()
+            yield
+        finally:
+            self._lock_depth = 0
+            fcntl.flock(self._lock_handle, fcntl.LOCK_UN)
+    
+    # === Записи ===
+    
+    def get_booking(self, booking_id: str) -> Optional[Booking]:
+        """Получает запись по ID (без копирования: Booking только для чтения)"""
+        return self._load_bookings().get(booking_id)
+    
+    def put_booking(self, booking_id: str, booking_data: Dict):
+        """Добавляет или полностью заменяет запись"""
+        with self._process_lock():
+            bookings = self._load_bookings()
+            booking = Booking.from_dict(booking_data, booking_id)
+            self._check_slot(booking_id, booking)
+            if booking_id in bookings:
+                self._unindex_booking(booking_id, bookings[booking_id])
+            bookings[booking_id] = booking
+            self._index_booking(booking_id, booking)
+            self._append_mutation({'op': 'booking_put', 'id': booking_id, 'data': booking.to_dict()})
+    
+    def update_booking(self, booking_id: str, fields: Dict) -> Optional[Booking]:
+        """Обновляет поля записи, возвращает обновленную запись"""
+        with self._process_lock():
+            bookings = self._load_bookings()
+            booking = bookings.get(booking_id)
+            if booking is None:
+                return None
+            
+            updated = booking.replace(fields)
+            self._check_slot(booking_id, updated)
+            self._unindex_booking(booking_id, booking)
+            booking = bookings[booking_id] = updated
+            self._index_booking(booking_id, booking)
+            self._append_mutation({'op': 'booking_set', 'id': booking_id, 'fields': fields})
+            return booking
+    
+    def delete_booking(self, booking_id: str):
+        """Удаляет запись"""
+        with self._process_lock():
+            bookings = self._load_bookings()
+            if booking_id not in bookings:
+                return
+            
+            self._unindex_booking(booking_id, bookings.pop(booking_id))
+            self._append_mutation({'op': 'booking_del', 'id': booking_id})
+    
+    def find_bookings(self, telegram_id: str = None, statuses: List[str] = None,
+                      date: str = None) -> List[Booking]:
+        """Находит записи по пользователю, статусам и дате (через индексы)"""
+        bookings = self._load_bookings()
+        
+        candidates = []
+        if telegram_id is not None:
+            candidates.append(self._indexes['telegram_id'].get(str(telegram_id), set()))
+        if statuses is not None:
+            ids = set()
+            for status in statuses:
+                ids |= self._indexes['status'].get(status, set())
+            candidates.append(ids)
+        if date is not None:
+            candidates.append(self._indexes['date'].get(date, set()))
+        
+        if candidates:
+            # Пересекаем начиная с самого маленького множества
+            candidates.sort(key=len)
+            booking_ids = candidates[0].intersection(*candidates[1:])
+        else:
+            booking_ids = bookings.keys()
+        
+        # Сортировка по дате и времени
+        ordered_ids = sorted(booking_ids, key=lambda booking_id: self._time_keys.get(booking_id, ''))
+        return [bookings[booking_id] for booking_id in ordered_ids]
+    
+    def find_bookings_between(self, start_key: str, end_key: str,
+                              statuses: List[str] = None) -> List[Booking]:
+        """Находит записи с датой и временем в диапазоне [start_key, end_key] (бинарным поиском)"""
+        bookings = self._load_bookings()
+        
+        low = bisect_left(self._time_index, (start_key, ''))
+        high = bisect_right(self._time_index, (end_key, '\uffff'))
+        
+        result = []
+        for _, booking_id in self._time_index[low:high]:
+            booking = bookings[booking_id]
+            if statuses is not None and booking.get('status') not in statuses:
+                continue
+            result.append(booking)
+        
+        return result
+    
+    def slot_booking(self, date: str, time: str) -> Optional[str]:
+        """ID активной записи, занимающей время, или None"""
+        self._load_bookings()
+        return self._slots.get(date, {}).get(time)
+    
+    def occupied_times(self, date: str) -> List[str]:
+        """Занятое время на дату"""
+        self._load_bookings()
+        return list(self._slots.get(date, {}))
+    
+    def count_by_status(self) -> Dict[str, int]:
+        """Считает записи по статусам"""
+        self._load_bookings()
+        return {status: len(ids) for status, ids in self._indexes['status'].items()}
+    
+    def iter_bookings(self) -> Iterator[Tuple[str, Dict]]:
+        """Перебирает все записи"""
+        return iter(list(self._load_bookings().items()))
+    
+    def check_indexes(self) -> List[str]:
+        """Сверяет вторичные индексы с записями, возвращает список расхождений"""
+        expected = {field: {} for field in INDEXED_FIELDS}
+        for booking_id, booking in self._load_bookings().items():
+            for field in INDEXED_FIELDS:
+                key = self._index_key(booking, field)
+                expected[field].setdefault(key, set()).add(booking_id)
+        
+        problems = []
+        for field in INDEXED_FIELDS:
+            actual = self._indexes[field]
+            for key in set(expected[field]) | set(actual):
+                missing = expected[field].get(key, set()) - actual.get(key, set())
+                extra = actual.get(key, set()) - expected[field].get(key, set())
+                if missing:
+                    problems.append(f"{field}={key!r}: нет в индексе {sorted(missing)}")
+                if extra:
+                    problems.append(f"{field}={key!r}: лишние в индексе {sorted(extra)}")
+        
+        expected_time_index = sorted(
+            (booking_datetime_key(booking), booking_id)
+            for booking_id, booking in self._load_bookings().items()
+        )
+        if expected_time_index != self._time_index:
+            problems.append("индекс по дате и времени не совпадает с записями")
+        
+        for booking_id, booking in self._load_bookings().items():
+            if not occupies_slot(booking):
+                continue
+            owner = self._slots.get(booking['date'], {}).get(booking['time'])
+            if owner is None:
+                problems.append(f"время {booking['date']} {booking['time']}: нет в индексе {booking_id}")
+            elif owner != booking_id:
+                problems.append(f"время {booking['date']} {booking['time']}: занято дважды ({owner}, {booking_id})")
+        for date, times in self._slots.items():
+            for time, booking_id in times.items():
+                booking = self._bookings_cache.get(booking_id)
+                if booking is None or not occupies_slot(booking) or (booking['date'], booking['time']) != (date, time):
+                    problems.append(f"время {date} {time}: лишняя запись в индексе {booking_id}")
+        return problems
+    
+    def _index_key(self, booking: Dict, field: str):
+        """Значение поля для индекса (telegram_id приводится к строке)"""
+        value = booking.get(field)
+        if field == 'telegram_id' and value is not None:
+            return str(value)
+        return value
+    
+    def _index_booking(self, booking_id: str, booking: Dict):
+        """Добавляет запись во вторичные индексы"""
+        self._index_fields(booking_id, booking)
+        
+        time_key = booking_datetime_key(booking)
+        self._time_keys[booking_id] = time_key
+        insort(self._time_index, (time_key, booking_id))
+    
+    def _index_fields(self, booking_id: str, booking: Dict):
+        """Добавляет запись в индексы по полям и в занятое время"""
+        for field in INDEXED_FIELDS:
+            key = self._index_key(booking, field)
+            self._indexes[field].setdefault(key, set()).add(booking_id)
+        
+        if occupies_slot(booking):
+            # Дубликаты из старых данных не затирают первую запись (их покажет check_indexes)
+            self._slots.setdefault(booking['date'], {}).setdefault(booking['time'], booking_id)
+    
+    def _check_slot(self, booking_id: str, booking: Dict):
+        """Проверяет, что время записи не занято другой активной записью"""
+        if not occupies_slot(booking):
+            return
+        owner = self._slots.get(booking['date'], {}).get(booking['time'])
+        if owner is not None and owner != booking_id:
+            raise SlotTakenError(booking['date'], booking['time'], owner)
+    
+    def _unindex_booking(self, booking_id: str, booking: Dict):
+        """Убирает запись из вторичных индексов"""
+        for field in INDEXED_FIELDS:
+            key = self._index_key(booking, field)
+            ids = self._indexes[field].get(key)
+            if ids is not None:
+                ids.discard(booking_id)
+                if not ids:
+                    del self._indexes[field][key]
+        
+        if occupies_slot(booking):
+            times = self._slots.get(booking['date'], {})
+            if times.get(booking['time']) == booking_id:
+                del times[booking['time']]
+                if not times:
+                    del self._slots[booking['date']]
+        
+        time_key = self._time_keys.pop(booking_id, None)
+        if time_key is not None:
+            position = bisect_left(self._time_index, (time_key, booking_id))
+            if position < len(self._time_index) and self._time_index[position] == (time_key, booking_id):
+                del self._time_index[position]
+    
+    def _rebuild_indexes(self):
+        """Строит вторичные индексы заново по всем записям"""
+        self._indexes = {field: {} for field in INDEXED_FIELDS}
+        self._slots = {}
+        self._time_keys = {}
+        for booking_id, booking in self._bookings_cache.items():
+            self._index_fields(booking_id, booking)
+            self._time_keys[booking_id] = booking_datetime_key(booking)
+        
+        self._time_index = sorted((key, booking_id) for booking_id, key in self._time_keys.items())
+    
+    # === Пользователи ===
+    
+    def get_user(self, telegram_id: str) -> Optional[Dict]:
+        """Получает данные пользователя"""
+        return self._load_users().get(str(telegram_id))
+    
+    def put_user(self, telegram_id: str, user_data: Dict):
+        """Сохраняет данные пользователя"""
+        with self._process_lock():
+            self._load_users()[str(telegram_id)] = user_data
+            self._append_mutation({'op': 'user_put', 'id': str(telegram_id), 'data': user_data})
+    
+    def iter_users(self) -> Iterator[Tuple[str, Dict]]:
+        """Перебирает всех пользователей"""
+        return iter(list(self._load_users().items()))
+    
+    # === Документы (доступность, связи переносов) ===
+    
+    def load_document(self, name: str) -> Dict:
+        """Загружает служебный документ (файл data/<name>.json + журнал)"""
+        self._load_bookings()
+        if name not in self._documents:
+            self._documents[name] = self._read_file(self._document_file(name))
+        return copy.deepcopy(self._documents[name])
+    
+    def save_document(self, name: str, data: Dict):
+        """Сохраняет служебный документ через журнал изменений"""
+        with self._process_lock():
+            self._load_bookings()
+            self._documents[name] = copy.deepcopy(data)
+            self._dirty_documents.add(name)
+            self._append_mutation({'op': 'doc_put', 'name': name, 'data': data})
+    
+    def _document_file(self, name: str) -> str:
+        return os.path.join(self.data_dir, f'{name}.json')
+    
+    # === Транзакции ===
+    
+    @contextmanager
+    def transaction(self):
+        """
+        Группирует изменения в одну запись журнала
+        Либо применяются все изменения блока, либо (при исключении) ни одно
+        """
+        if self._tx_records is not None:
+            # Вложенный блок - часть внешней транзакции
+            yield
+            return
+        
+        # Другой процесс не пишет, пока открыта транзакция: она видит актуальные данные
+        with self._process_lock():
+            self._load_bookings()
+            self._tx_records = []
+            try:
+                yield
+            except BaseException:
+                # На диск ничего не попало - восстанавливаем состояние из файлов
+                self._tx_records = None
+                self._load_state()
+                raise
+            
+            records, self._tx_records = self._tx_records, None
+            if len(records) == 1:
+                self._append_mutation(records[0])
+            elif records:
+                self._append_mutation({'op': 'tx', 'ops': records})
+    
+    # === Журнал изменений ===
+    
+    def compact(self):
+        """Записывает свежие снимки и очищает журнал изменений"""
+        with self._process_lock():
+            # Сначала читаем оба снимка: запись первого меняет отпечаток файлов
+            bookings, users = self._load_bookings(), self._load_users()
+            self._save_bookings(bookings)
+            self._save_users(users)
+            for name in self._dirty_documents:
+                self._writer.write(self._document_file(name), self._documents[name])
+            # Журнал можно очищать только когда все снимки уже на диске
+            try:
+                self._writer.flush()
+            except OSError as e:
+                # Изменения остаются в журнале (его повтор поверх новых снимков безопасен),
+                # компактификация повторится при следующей записи
+                self._signature = self._file_signature()
+                print(f"❌ Снимок хранилища не записан, журнал сохранен: {e}")
+                return
+            self._dirty_documents = set()
+            self._log.reset()
+            self._signature = self._file_signature()
+            print("✅ Снимок хранилища обновлен, журнал очищен")
+    
+    def close(self):
+        """Сбрасывает накопленный журнал в снимки"""
+        if self._log.pending:
+            self.compact()
+        self._log.close()
+        if self._lock_handle is not None:
+            self._lock_handle.close()
+            self._lock_handle = None
+    
+    def _append_mutation(self, record: Dict):
+        """Дописывает изменение в журнал и при необходимости компактифицирует его"""
+        if self._tx_records is not None:
+            self._tx_records.append(record)
+            return
+        
+        self._log.append(record)
+        self._signature = self._file_signature()
+        if self._log.needs_compaction():
+            self.compact()
+    
+    def _load_state(self):
+        """Восстанавливает состояние: снимки + хвост журнала"""
+        with self._process_lock():
+            self._bookings_cache = {
+                booking_id: Booking(data, booking_id)
+                for booking_id, data in self._read_file(self.bookings_file).items()
+            }
+            self._users_cache = self._read_file(self.users_file)
+            self._documents = {}
+            self._dirty_documents = set()
+            
+            records = self._log.replay()
+            for record in iter_operations(records):
+                self._apply_mutation(record)
+            
+            self._rebuild_indexes()
+            self._signature = self._file_signature()
+            
+            if records:
+                print(f"✅ Из журнала восстановлено изменений: {len(records)}")
+            
+            # Индексы только что построены - расхождения здесь означают дубликаты в данных
+            for problem in self.check_indexes():
+                print(f"❌ Индекс хранилища: {problem}")
+            
+            if self._log.needs_compaction():
+                self.compact()
+    
+    def _apply_mutation(self, record: Dict):
+        """Применяет одну запись журнала к состоянию в памяти"""
+        op = record.get('op')
+        record_id = record.get('id')
+        
+        if op == 'booking_put':
+            self._bookings_cache[record_id] = Booking(record['data'], record_id)
+        elif op == 'booking_set':
+            if record_id in self._bookings_cache:
+                self._bookings_cache[record_id] = self._bookings_cache[record_id].replace(record['fields'])
+        elif op == 'booking_del':
+            self._bookings_cache.pop(record_id, None)
+        elif op == 'user_put':
+            self._users_cache[record_id] = record['data']
+        elif op == 'doc_put':
+            self._documents[record['name']] = record['data']
+            self._dirty_documents.add(record['name'])
+        else:
+            print(f"⚠️ Неизвестная операция в журнале: {op}")
+    
+    # === Вспомогательные методы ===
+    
+    def _read_file(self, file_path: str) -> Dict:
+        """Читает файл хранилища (с учетом изменений, еще не записанных на диск)"""
+        return self._writer.read(file_path, {})
+    
+    def _load_bookings(self) -> Dict:
+        """Загружает записи (снимок + журнал)"""
+        if self._bookings_cache is None:
+            self._load_state()
+        else:
+            self._refresh_if_stale()
+        
+        return self._bookings_cache
+    
+    def _save_bookings(self, data: Dict[str, Booking]):
+        """Сохраняет снимок записей в файл """
+        self._writer.write(self.bookings_file, {
+            booking_id: booking.to_dict() for booking_id, booking in data.items()
+        })
+        
+        self._bookings_cache = data
+    
+    def _load_users(self) -> Dict:
+        """Загружает данные пользователей (снимок + журнал)"""
+        if self._users_cache is None:
+            self._load_state()
+        else:
+            self._refresh_if_stale()
+        
+        return self._users_cache
+    
+    def _save_users(self, data: Dict):
+        """Сохраняет снимок пользователей в файл """
+        self._writer.write(self.users_file, data)
+        
+        self._users_cache = data
@@ -1,9 +1,19 @@
 import gspread
 from google.oauth2.service_account import Credentials
-from config import CREDENTIALS_FILE, SPREADSHEET_ID, COLUMNS, STATUS_COLORS, STATUS_PRIORITY
+from config import CREDENTIALS_FILE, SPREADSHEET_ID, COLUMNS, STATUS_COLORS, STATUS_PRIORITY, SHEETS_VIEW_REFRESH_SECONDS
 from datetime import datetime
 import re
 
+# Скрытая служебная колонка N с полным ID записи (ключ для поиска строки)
+ID_COLUMN = 14
+ID_HEADER = 'ID (служебный)'
+
+# Формула статуса строки в правилах условного форматирования
+STATUS_RULE_MARKER = 'LOWER($J2)'
+
+# Лист с записями, отсортированными по статусу и дате (основной лист не пересортировывается)
+VIEW_TITLE = 'Сортировка'
+
 class GoogleSheets:
     def __init__(self):
         # Настраиваем доступ к Google API
@@ -19,7 +29,22 @@ class GoogleSheets:
             )
             
             self.client = gspread.authorize(credentials)
-            self.sheet = self.client.open_by_key(SPREADSHEET_ID).sheet1
+            self.spreadsheet = self.client.open_by_key(SPREADSHEET_ID)
+            self.sheet = self.spreadsheet.sheet1
+            
+            # Отсортированный лист обновляется не чаще SHEETS_VIEW_REFRESH_SECONDS
+            self.view_refresh_interval = SHEETS_VIEW_REFRESH_SECONDS
+            self._view = None
+            self._view_dirty = True
+            
+            # Карта booking_id -> номер строки; None - нужно перечитать таблицу
+            self._rows = None
+            self._legacy_rows = []  # Строки без полного ID: (префикс ID, имя, дата, время, номер строки)
+            
+            # Сколько запросов к API сэкономила пакетная запись
+            self.api_calls_saved = 0
+            # Сколько запросов ушло на поиск строк (чтение карты, сверка колонки N)
+            self.lookup_calls = 0
             
             # Создаем заголовки, если их нет
             self._setup_headers()
@@ -34,13 +59,22 @@ class GoogleSheets:
         try:
             current_data = self.sheet.get_all_values()
             if not current_data or len(current_data) == 0:
-                headers = list(COLUMNS.values())
+                headers = list(COLUMNS.values()) + [ID_HEADER]
                 self.sheet.append_row(headers)
                 print("✅ Заголовки таблицы созданы")
+            elif len(current_data[0]) < ID_COLUMN or current_data[0][ID_COLUMN - 1] != ID_HEADER:
+                # Таблица создана до появления служебной колонки
+                self.sheet.update_cell(1, ID_COLUMN, ID_HEADER)
+            
+            # Служебную колонку с полным ID мастеру видеть не нужно
+            self.sheet.hide_columns(ID_COLUMN - 1, ID_COLUMN)
             
             # Применяем форматирование к заголовкам
             self._format_headers()
             
+            # Цвета строк по статусу задаются правилами условного форматирования
+            self._install_status_rules(self.sheet)
+            
         except Exception as e:
             print(f"⚠️ Ошибка при создании заголовков: {e}")
     
@@ -124,167 +158,368 @@ class GoogleSheets:
             print(f"❌ Ошибка сортировки записей: {e}")
             return all_bookings
     
-    def _apply_color_coding(self, all_bookings):
-        """Применяет цветовое кодирование к строкам"""
+    # === Цвета статусов ===
+    
+    def _install_status_rules(self, worksheet):
+        """
+        Устанавливает правила условного форматирования: строка красится по статусу
+        Правила ставятся один раз; если на листе уже те же правила, запросов на запись нет
+        """
         try:
-            for i, record in enumerate(all_bookings):
-                if i == 0:  # Пропускаем заголовки
-                    continue
-                
-                if len(record) >= 10:  # Проверяем наличие колонки статуса
-                    status = record[9].lower() if record[9] else 'ожидает'
-                    color = self._get_status_color(status)
-                    
-                    # Применяем цвет ко всей строке (колонки A-M)
-                    row_range = f"A{i+1}:M{i+1}"
-                    self.sheet.format(row_range, {
-                        "backgroundColor": color,
-                        "horizontalAlignment": "LEFT",
-                        "verticalAlignment": "MIDDLE"
-                    })
+            metadata = self.spreadsheet.fetch_sheet_metadata(
+                {'fields': 'sheets(properties.sheetId,conditionalFormats)'}
+            )
+            existing = []
+            for sheet in metadata.get('sheets', []):
+                if sheet['properties']['sheetId'] == worksheet.id:
+                    existing = sheet.get('conditionalFormats', [])
+            
+            # Наши правила узнаем по формуле со статусом из колонки J
+            ours = [i for i, rule in enumerate(existing) if STATUS_RULE_MARKER in self._rule_formula(rule)]
+            rules = self._status_rules(worksheet.id)
+            if [self._rule_key(existing[i]) for i in ours] == [self._rule_key(rule) for rule in rules]:
+                return
+            
+            requests = [
+                {'deleteConditionalFormatRule': {'sheetId': worksheet.id, 'index': i}}
+                for i in reversed(ours)
+            ]
+            requests += [
+                {'addConditionalFormatRule': {'rule': rule, 'index': i}}
+                for i, rule in enumerate(rules)
+            ]
+            # Выравнивание строк данных задается один раз вместе с правилами
+            requests.append({'repeatCell': {
+                'range': self._data_range(worksheet.id),
+                'cell': {'userEnteredFormat': {'horizontalAlignment': 'LEFT', 'verticalAlignment': 'MIDDLE'}},
+                'fields': 'userEnteredFormat(horizontalAlignment,verticalAlignment)'
+            }})
             
-            print(f"✅ Цветовое кодирование применено к {len(all_bookings)-1} записям")
+            self.spreadsheet.batch_update({'requests': requests})
+            print(f"✅ Цвета статусов установлены на листе «{worksheet.title}»")
             
         except Exception as e:
-            print(f"⚠️ Ошибка применения цветового кодирования: {e}")
+            print(f"⚠️ Ошибка установки цветов статусов: {e}")
+    
+    def _status_rules(self, sheet_id):
+        """Правила условного форматирования для всех статусов из STATUS_COLORS"""
+        rules = []
+        for status in STATUS_COLORS:
+            formula = f'={STATUS_RULE_MARKER}="{status}"'
+            if status == 'ожидает':
+                # Строки без статуса считаются ожидающими
+                formula = f'=OR({STATUS_RULE_MARKER}="{status}",AND($A2<>"",$J2=""))'
+            
+            rules.append({
+                'ranges': [self._data_range(sheet_id)],
+                'booleanRule': {
+                    'condition': {'type': 'CUSTOM_FORMULA', 'values': [{'userEnteredValue': formula}]},
+                    'format': {'backgroundColor': self._get_status_color(status)}
+                }
+            })
+        return rules
+    
+    def _data_range(self, sheet_id):
+        """Строки данных A2:M (без заголовка, до конца листа)"""
+        return {'sheetId': sheet_id, 'startRowIndex': 1, 'startColumnIndex': 0,
+                'endColumnIndex': len(COLUMNS)}
+    
+    def _rule_formula(self, rule):
+        values = rule.get('booleanRule', {}).get('condition', {}).get('values', [])
+        return values[0].get('userEnteredValue', '') if values else ''
+    
+    def _rule_key(self, rule):
+        """Формула и цвет правила (цвета API возвращает с точностью 1/255)"""
+        color = rule.get('booleanRule', {}).get('format', {}).get('backgroundColor', {})
+        return (self._rule_formula(rule),
+                tuple(round(color.get(part, 0) * 255) for part in ('red', 'green', 'blue')))
+    
+    def _booking_row(self, booking_data):
+        """Строка таблицы для записи (колонки A-M и скрытая N)"""
+        return [
+            booking_data.get('booking_id', ''),  # ID записи
+            booking_data.get('timestamp', ''),
+            booking_data.get('name', ''),
+            booking_data.get('phone', ''),
+            booking_data.get('date', ''),
+            booking_data.get('time', ''),
+            booking_data.get('service', ''),
+            booking_data.get('telegram_id', ''),
+            booking_data.get('username', ''),
+            booking_data.get('status', 'ожидает'),
+            booking_data.get('status_updated', ''),
+            booking_data.get('reschedule_id', ''),
+            booking_data.get('original_booking_id', ''),
+            booking_data.get('booking_id', '')  # Полный ID в скрытой колонке N
+        ]
     
     def add_booking(self, booking_data):
-        """Добавляет запись в таблицу и сортирует"""
+        """Добавляет запись в таблицу"""
         try:
-            # Формируем строку с учетом всех колонок
-            row = [
-                booking_data.get('booking_id', '')[:8] + '...',  # ID записи (усеченный)
-                booking_data.get('timestamp', ''),
-                booking_data.get('name', ''),
-                booking_data.get('phone', ''),
-                booking_data.get('date', ''),
-                booking_data.get('time', ''),
-                booking_data.get('service', ''),
-                booking_data.get('telegram_id', ''),
-                booking_data.get('username', ''),
-                booking_data.get('status', 'ожидает'),
-                booking_data.get('status_updated', ''),
-                booking_data.get('reschedule_id', ''),
-                booking_data.get('original_booking_id', '')
-            ]
-            
             # Добавляем запись
-            self.sheet.append_row(row)
+            response = self.sheet.append_row(self._booking_row(booking_data))
+            self._remember_rows([booking_data.get('booking_id', '')], response)
             print(f"✅ Запись добавлена в Google Sheets")
-            
-            # Сортируем все записи и применяем цвета
-            self._sort_and_update_all()
+            self._view_dirty = True
             
             return True
         except Exception as e:
             print(f"❌ Ошибка при добавлении записи в Google Sheets: {e}")
             return False
     
-    def _sort_and_update_all(self):
-        """Сортирует все записи и обновляет таблицу"""
+    def apply_batch(self, changes):
+        """
+        Применяет пачку изменений: одно добавление строк и один values.batchUpdate
+        changes - список (ключ, 'add' или 'status', данные, статус)
+        Повторные изменения одной записи объединяются (побеждает последнее), статус
+        записи, добавляемой в этой же пачке, сразу пишется в новую строку.
+        Возвращает ключи примененных изменений и ключи изменений, которые применить нельзя
+        (строка не найдена, неизвестное изменение) - их повтор не поможет
+        """
+        done = []
+        undeliverable = []
+        adds = {}     # booking_id -> [строка, ключи]
+        updates = {}  # booking_id -> [данные, статус, ключи]
+        requested = 0
+        applied = 0
+        
+        for key, op, data, status in changes:
+            booking_id = data.get('booking_id', '') if data else ''
+            if op == 'add':
+                requested += 1
+                adds[booking_id] = [self._booking_row(data), [key]]
+            elif op == 'status':
+                requested += 1
+                update_time = data.get('status_updated') or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                if booking_id in adds:
+                    row, keys = adds[booking_id]
+                    row[9], row[10] = status, update_time
+                    keys.append(key)
+                else:
+                    keys = updates[booking_id][2] + [key] if booking_id in updates else [key]
+                    updates[booking_id] = [dict(data, status_updated=update_time), status, keys]
+            else:
+                print(f"⚠️ Неизвестное изменение для Google Sheets: {op}")
+                undeliverable.append(key)
+        
+        calls = 0
         try:
-            # Получаем все записи
-            all_bookings = self.sheet.get_all_values()
-            
-            if len(all_bookings) <= 1:  # Только заголовки или пусто
-                return
-            
-            # Сортируем записи
-            sorted_bookings = self._sort_bookings(all_bookings)
-            
-            # Обновляем всю таблицу
-            self._update_entire_sheet(sorted_bookings)
-            
-            # Применяем цветовое кодирование
-            self._apply_color_coding(sorted_bookings)
-            
-            print(f"✅ Таблица отсортирована по статусу и дате")
-            
+            if adds:
+                response = self.sheet.append_rows([row for row, _ in adds.values()])
+                calls += 1
+                self._remember_rows(list(adds), response)
+                for _, keys in adds.values():
+                    done.extend(keys)
+                    applied += len(keys)
+                self._view_dirty = True
+            
+            ranges = []
+            lookups = self.lookup_calls
+            try:
+                found = self._find_rows([data for data, _, _ in updates.values()]) if updates else []
+            finally:
+                calls += self.lookup_calls - lookups
+            for (data, status, keys), row in zip(updates.values(), found):
+                if row is None:
+                    print(f"⚠️ Запись {data.get('booking_id', '')[-8:]}... не найдена для обновления статуса")
+                    undeliverable.extend(keys)
+                    continue
+                ranges.append((f"J{row}:K{row}", [[status, data['status_updated']]], keys))
+            
+            if ranges:
+                self.sheet.batch_update([{'range': cells, 'values': values} for cells, values, _ in ranges])
+                calls += 1
+                for _, _, keys in ranges:
+                    done.extend(keys)
+                    applied += len(keys)
+                self._view_dirty = True
+                
         except Exception as e:
-            print(f"❌ Ошибка при сортировке таблицы: {e}")
+            print(f"❌ Ошибка пакетной записи в Google Sheets: {e}")
+        
+        # Без пачек каждое изменение было бы отдельным запросом записи; запросы поиска
+        # строк учтены в calls, поэтому это нижняя оценка экономии
+        self.api_calls_saved += max(applied - calls, 0)
+        print(f"✅ Google Sheets: {applied} из {requested} изменений за {calls} запросов "
+              f"(сэкономлено запросов: {self.api_calls_saved})")
+        return done, undeliverable
+    
+    # === Отсортированный лист ===
     
-    def _update_entire_sheet(self, bookings):
-        """Обновляет всю таблицу новыми данными"""
+    def refresh_sorted_view(self, force=False):
+        """
+        Переписывает лист VIEW_TITLE записями, отсортированными по статусу и дате
+        Вызывается из фоновой очереди; без изменений с прошлого раза ничего не делает
+        """
+        if not (self._view_dirty or force):
+            return
+        
         try:
-            # Очищаем таблицу
-            self.sheet.clear()
+            # Сбрасываем флаг до чтения: изменения во время обновления попадут в следующее
+            self._view_dirty = False
+            all_bookings = self.sheet.get_all_values()
+            sorted_bookings = self._sort_bookings([record[:len(COLUMNS)] for record in all_bookings])
             
-            # Добавляем заголовки и данные
-            if bookings:
-                self.sheet.append_rows(bookings)
+            view = self._get_view()
+            view.clear()
+            if sorted_bookings:
+                view.update(sorted_bookings, 'A1')
+            
+            print(f"✅ Лист «{VIEW_TITLE}» обновлен: {max(len(sorted_bookings) - 1, 0)} записей")
             
         except Exception as e:
-            print(f"❌ Ошибка обновления таблицы: {e}")
+            self._view_dirty = True
+            print(f"❌ Ошибка обновления листа «{VIEW_TITLE}»: {e}")
+    
+    def _get_view(self):
+        """Лист с отсортированными записями (создается при первом обращении)"""
+        if self._view is None:
+            try:
+                self._view = self.spreadsheet.worksheet(VIEW_TITLE)
+            except gspread.WorksheetNotFound:
+                self._view = self.spreadsheet.add_worksheet(VIEW_TITLE, rows=1000, cols=len(COLUMNS))
+                self._view.format("A1:M1", {
+                    "textFormat": {"bold": True},
+                    "horizontalAlignment": "CENTER",
+                    "backgroundColor": {"red": 0.9, "green": 0.9, "blue": 0.9}
+                })
+                print(f"✅ Создан лист «{VIEW_TITLE}»")
+            self._install_status_rules(self._view)
+        return self._view
     
     def add_status(self, booking_data, status):
-        """Обновляет статус записи в таблице"""
+        """
+        Обновляет статус записи в таблице (одним запросом по номеру строки)
+        Возвращает None, если записи нет в таблице, и False при ошибке
+        """
         try:
-            # Находим строку с записью по ID (колонка A)
-            all_records = self.sheet.get_all_values()
+            row = self._find_row(booking_data)
             
-            for i, record in enumerate(all_records):
-                if i == 0:  # Пропускаем заголовки
-                    continue
-                
-                if (len(record) > 0 and 
-                    booking_data.get('booking_id', '').startswith(record[0].replace('...', ''))):
-                    
-                    # Обновляем статус и время изменения
-                    update_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    
-                    if len(record) >= 10:
-                        self.sheet.update_cell(i + 1, 10, status)  # Статус (колонка J)
-                    if len(record) >= 11:
-                        self.sheet.update_cell(i + 1, 11, update_time)  # Время изменения (колонка K)
-                    
-                    print(f"✅ Статус обновлен в строке {i + 1}: {status}")
-                    
-                    # Обновляем сортировку
-                    self._sort_and_update_all()
-                    
-                    return True
-            
-            print(f"⚠️ Запись не найдена для обновления статуса")
-            
-            # Пробуем найти по другим полям (старый метод для обратной совместимости)
-            for i, record in enumerate(all_records):
-                if i == 0:
-                    continue
-                
-                if (len(record) >= 5 and
-                    record[2] == booking_data.get('name') and
-                    record[4] == booking_data.get('date') and
-                    record[5] == booking_data.get('time')):
-                    
-                    update_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    
-                    if len(record) >= 10:
-                        self.sheet.update_cell(i + 1, 10, status)
-                    if len(record) >= 11:
-                        self.sheet.update_cell(i + 1, 11, update_time)
-                    
-                    print(f"✅ Статус обновлен в строке {i + 1} (поиск по имени): {status}")
-                    
-                    self._sort_and_update_all()
-                    return True
+            if row is None:
+                print(f"⚠️ Запись не найдена для обновления статуса")
+                return None
             
-            return False
+            # Обновляем статус и время изменения (из очереди приходит время самого изменения)
+            update_time = booking_data.get('status_updated') or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self._update_status_cells(row, status, update_time)
+            self._view_dirty = True
+            print(f"✅ Статус обновлен в строке {row}: {status}")
+            
+            return True
             
         except Exception as e:
             print(f"❌ Ошибка при обновлении статуса в Google Sheets: {e}")
             return False
     
+    def _update_status_cells(self, row, status, update_time):
+        """Записывает статус и время изменения (колонки J:K) одним запросом"""
+        self.sheet.update([[status, update_time]], f"J{row}:K{row}")
+    
+    # === Карта строк ===
+    
+    def _find_row(self, booking_data):
+        """Номер строки записи в таблице или None"""
+        return self._find_rows([booking_data])[0]
+    
+    def _find_rows(self, items):
+        """
+        Номера строк записей (None - запись не найдена)
+        Номера из карты перед записью сверяются со скрытой колонкой N одним запросом:
+        строки могли переставить, вставить или удалить вручную
+        """
+        fresh = self._rows is None
+        if fresh:
+            self._load_rows()
+        rows = [self._rows.get(item.get('booking_id', '')) for item in items]
+        
+        if not fresh:
+            # Промах - строку могли добавить вручную (или это старая строка без полного ID)
+            stale = None in rows
+            if not stale:
+                cells = self.sheet.batch_get([f"N{row}" for row in rows])
+                self.lookup_calls += 1
+                stale = any(self._cell_value(cell) != item.get('booking_id')
+                            for cell, item in zip(cells, items))
+            if stale:
+                self._load_rows()
+                rows = [self._rows.get(item.get('booking_id', '')) for item in items]
+        
+        # Старые строки ищем только по свежей карте
+        return [row if row is not None else self._find_legacy_row(item) for row, item in zip(rows, items)]
+    
+    @staticmethod
+    def _cell_value(value_range):
+        """Значение единственной ячейки из ответа batch_get"""
+        return value_range[0][0] if value_range and value_range[0] else ''
+    
+    def _load_rows(self):
+        """Перечитывает таблицу и строит карту booking_id -> номер строки"""
+        self._rows = {}
+        self._legacy_rows = []
+        
+        self.lookup_calls += 1
+        for i, record in enumerate(self.sheet.get_all_values()):
+            if i == 0:  # Пропускаем заголовки
+                continue
+            
+            full_id = record[ID_COLUMN - 1] if len(record) >= ID_COLUMN else ''
+            if not full_id and record and record[0] and not record[0].endswith('...'):
+                full_id = record[0]
+            
+            if full_id:
+                self._rows[full_id] = i + 1
+            elif len(record) >= 6:
+                # Старые строки: усеченный ID или поиск по имени, дате и времени
+                prefix = record[0][:-3] if record[0].endswith('...') else ''
+                self._legacy_rows.append((prefix, record[2], record[4], record[5], i + 1))
+    
+    def _find_legacy_row(self, booking_data):
+        """Ищет старую строку без полного ID и дописывает ей полный ID"""
+        booking_id = booking_data.get('booking_id', '')
+        key = (booking_data.get('name'), booking_data.get('date'), booking_data.get('time'))
+        
+        found = None
+        for entry in self._legacy_rows:
+            prefix = entry[0]
+            if booking_id and prefix and booking_id.startswith(prefix):
+                found = entry
+                break
+            if found is None and entry[1:4] == key:
+                found = entry  # Запасной вариант, если не найдется строка по ID
+        
+        if found is None:
+            return None
+        
+        row = found[-1]
+        if booking_id:
+            self.sheet.update_cell(row, ID_COLUMN, booking_id)
+            self.lookup_calls += 1
+            self._legacy_rows.remove(found)
+            self._rows[booking_id] = row
+        return row
+    
+    def _remember_rows(self, booking_ids, response):
+        """Добавляет в карту строки, только что дописанные append_row/append_rows"""
+        # Ответ API содержит диапазон вида "Лист1!A15:N17"
+        updated_range = (response or {}).get('updates', {}).get('updatedRange', '')
+        match = re.search(r'![A-Z]+(\d+)', updated_range)
+        if not match:
+            self._rows = None
+            return
+        
+        if self._rows is not None:
+            first_row = int(match.group(1))
+            for offset, booking_id in enumerate(booking_ids):
+                if booking_id:
+                    self._rows[booking_id] = first_row + offset
+    
     def update_booking_status_by_index(self, row_index, status):
         """Обновляет статус записи по индексу строки"""
         try:
             # Обновляем статус и время изменения
             update_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            
-            self.sheet.update_cell(row_index + 1, 10, status)  # Статус (колонка J)
-            self.sheet.update_cell(row_index + 1, 11, update_time)  # Время изменения (колонка K)
-            
-            # Обновляем сортировку
-            self._sort_and_update_all()
+            self._update_status_cells(row_index + 1, status, update_time)
+            self._view_dirty = True
             
             print(f"✅ Статус обновлен в строке {row_index + 1}: {status}")
             return True
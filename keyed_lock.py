@@ -0,0 +1,67 @@
+"""
+Блокировки по ключу для async-обработчиков
+Ключ (например, booking_id) отображается на одну из STRIPES полос.
+Замок полосы создается при первом обращении и удаляется, когда его
+больше никто не держит и не ждет (счетчик ссылок), поэтому два
+обработчика одной записи всегда получают один и тот же замок.
+Несколько ключей захватываются в порядке номеров полос - без взаимных
+блокировок, даже если ключи попали в одну полосу.
+"""
+
+import asyncio
+import zlib
+from contextlib import asynccontextmanager
+
+
+class KeyedLock:
+    """asyncio-блокировки по ключам с разбиением на полосы"""
+    
+    def __init__(self, stripes: int = 64):
+        self.stripes = stripes
+        self._locks = {}  # полоса -> asyncio.Lock
+        self._refs = {}   # полоса -> сколько обработчиков держат или ждут замок
+    
+    def stripe(self, key) -> int:
+        """Номер полосы для ключа (стабилен между запусками)"""
+        return zlib.crc32(str(key).encode('utf-8')) % self.stripes
+    
+    @asynccontextmanager
+    async def acquire(self, *keys):
+        """Захватывает замки всех ключей (пустые ключи пропускаются)"""
+        stripes = sorted({self.stripe(key) for key in keys if key})
+        
+        # Ссылки берем до ожидания, чтобы замок не удалили, пока его ждут
+        locks = [self._ref(stripe) for stripe in stripes]
+        acquired = []
+        try:
+            for lock in locks:
+                await lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+            for stripe in stripes:
+                self._unref(stripe)
+    
+    def locked(self, key) -> bool:
+        """Занят ли замок полосы ключа"""
+        lock = self._locks.get(self.stripe(key))
+        return lock is not None and lock.locked()
+    
+    def __len__(self) -> int:
+        """Сколько замков сейчас существует"""
+        return len(self._locks)
+    
+    def _ref(self, stripe: int) -> asyncio.Lock:
+        lock = self._locks.get(stripe)
+        if lock is None:
+            lock = self._locks[stripe] = asyncio.Lock()
+        self._refs[stripe] = self._refs.get(stripe, 0) + 1
+        return lock
+    
+    def _unref(self, stripe: int):
+        self._refs[stripe] -= 1
+        if self._refs[stripe] == 0:
+            del self._refs[stripe]
+            del self._locks[stripe]
@@ -30,6 +30,7 @@ async def main():
     
     # Инициализация менеджеров
     from storage_manager import StorageManager
+    from async_storage import AsyncStorageManager
     from notification_service import NotificationService
     from master_panel import MasterPanel
     from availability_manager import AvailabilityManager
@@ -39,19 +40,22 @@ async def main():
     from bot_handlers import BookingHandlers
     
     storage_manager = StorageManager(google_sheets)
-    notification_service = NotificationService(storage_manager)
+    
+    # Обработчики работают с хранилищем через неблокирующую обертку
+    async_storage = AsyncStorageManager(storage_manager)
+    notification_service = NotificationService(async_storage)
     
     # Инициализируем сервис напоминаний
-    reminder_service = ReminderService(storage_manager)
+    reminder_service = ReminderService(async_storage)
     
     # Инициализируем менеджер доступности
     availability_manager = AvailabilityManager(storage_manager)
     storage_manager.availability_manager = availability_manager
     
-    master_panel = MasterPanel(storage_manager, notification_service)
+    master_panel = MasterPanel(async_storage, notification_service)
     master_panel.set_availability_manager(availability_manager)
     
-    booking_handlers = BookingHandlers(storage_manager, notification_service)
+    booking_handlers = BookingHandlers(async_storage, notification_service)
     
     # Определяем состояния (ВАЖНО: должно совпадать с bot_handlers.py)
     (
@@ -498,6 +502,8 @@ async def main():
     async def shutdown(application):
         print("🛑 Остановка сервисов...")
         await reminder_service.stop()
+        async_storage.close()
+        storage_manager.close()
         print("✅ Все сервисы остановлены")
     
     # Запускаем бота
@@ -7,6 +7,7 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Bot, Re
 from telegram.ext import ContextTypes, ConversationHandler
 from datetime import datetime, timedelta
 import re
+from typing import Optional
 from config import MASTER_CHAT_ID
 
 class MasterPanel:
@@ -88,11 +89,12 @@ class MasterPanel:
             if len(parts) >= 4:
                 action = parts[2]
                 booking_id = parts[3]
+                version = self._parse_version(parts, 4)
                 
                 print(f"📞 Callback от клиента {user_id}, action: {action}, booking_id: {booking_id}")
                 
                 if action == 'accept':
-                    await self._handle_client_accept_reschedule(update, booking_id)
+                    await self._handle_client_accept_reschedule(update, booking_id, version)
                 elif action == 'reject':
                     await self._handle_client_reject_reschedule(update, booking_id)
                 return
@@ -109,7 +111,8 @@ class MasterPanel:
             if len(parts) >= 3:
                 action = parts[1]
                 booking_id = parts[2]
-                await self._handle_booking_action(update, context, action, booking_id)
+                version = self._parse_version(parts, 3)
+                await self._handle_booking_action(update, context, action, booking_id, version)
         
         elif data.startswith('reschedule_master_'):
             parts = data.split('_')
@@ -159,7 +162,7 @@ class MasterPanel:
             if len(parts) >= 4:
                 date_str = '_'.join(parts[3:])  # На случай даты с разделителями
                 if self.availability_manager:
-                    success = self.availability_manager.set_day_off(date_str)
+                    success = await self.storage.run(self.availability_manager.set_day_off, date_str)
                     if success:
                         await query.edit_message_text(
                             f"✅ {date_str} установлен как выходной день",
@@ -172,7 +175,7 @@ class MasterPanel:
             if len(parts) >= 4:
                 date_str = '_'.join(parts[3:])
                 if self.availability_manager:
-                    success = self.availability_manager.remove_day_off(date_str)
+                    success = await self.storage.run(self.availability_manager.remove_day_off, date_str)
                     if success:
                         await query.edit_message_text(
                             f"✅ {date_str} удален из выходных дней",
@@ -181,23 +184,37 @@ class MasterPanel:
                             ]])
                         )
     
+    @staticmethod
+    def _parse_version(parts: list, index: int) -> Optional[int]:
+        """Версия записи из callback (кнопки без версии -> None)"""
+        if len(parts) > index and parts[index].isdigit():
+            return int(parts[index])
+        return None
+    
     async def _handle_booking_action(self, update: Update, context: ContextTypes.DEFAULT_TYPE, 
-                                   action: str, booking_id: str):
-        """Обрабатывает действие с записью"""
-        booking = self.storage.get_booking(booking_id)
+                                   action: str, booking_id: str, version: int = None):
+        """
+        Обрабатывает действие с записью
+        version - версия записи на момент показа кнопки: если запись с тех пор
+        изменилась (например, клиент ее отменил), действие не выполняется
+        """
+        booking = await self.storage.get_booking(booking_id)
         
         if not booking:
             await update.callback_query.edit_message_text("❌ Запись не найдена")
             return
         
+        if version is None:
+            version = booking.get('version', 0)
+        
         if action == 'confirm':
-            await self._confirm_booking(update, booking_id, booking)
+            await self._confirm_booking(update, booking_id, booking, version)
         elif action == 'reject':
-            await self._reject_booking(update, booking_id, booking)
+            await self._reject_booking(update, booking_id, booking, version)
         elif action == 'complete':
-            await self._complete_booking(update, booking_id, booking)
+            await self._complete_booking(update, booking_id, booking, version)
         elif action == 'cancel':
-            await self._cancel_booking(update, booking_id, booking)
+            await self._cancel_booking(update, booking_id, booking, version)
         elif action == 'reschedule':
             await self._start_master_reschedule_offer(update, context, booking_id)
         elif action == 'accept':
@@ -210,7 +227,7 @@ class MasterPanel:
     async def _start_master_reschedule_offer(self, update: Update, context: ContextTypes.DEFAULT_TYPE, 
                                            booking_id: str):
         """Начинает процесс предложения переноса мастером"""
-        booking = self.storage.get_booking(booking_id)
+        booking = await self.storage.get_booking(booking_id)
         
         if not booking:
             await update.callback_query.edit_message_text("❌ Запись не найдена")
@@ -366,15 +383,16 @@ class MasterPanel:
             new_time = reschedule_data.get('new_time', '')
             
             # Используем централизованный менеджер
-            success, new_booking_id, error_message = self.storage.offer_reschedule(
+            success, new_booking_id, error_message = await self.storage.offer_reschedule(
                 booking_id, new_date, new_time
             )
             
             if success:
                 # Отправляем предложение клиенту
+                # Запись предложения только что создана - ее версия 1
                 await self.notifications.notify_client_reschedule_offer(
                     new_booking_id, new_date, new_time,
-                    booking.get('telegram_id'), booking.get('name')
+                    booking.get('telegram_id'), booking.get('name'), version=1
                 )
                 
                 message = f"""
@@ -443,11 +461,11 @@ class MasterPanel:
         query = update.callback_query
         
         # Используем централизованный менеджер
-        success, message = self.storage.accept_reschedule(booking_id, 'master')
+        success, message = await self.storage.accept_reschedule(booking_id, 'master')
         
         if success:
             # Получаем информацию о переносе
-            reschedule_info = self.storage.get_reschedule_info(booking_id)
+            reschedule_info = await self.storage.get_reschedule_info(booking_id)
             if reschedule_info:
                 client_id = reschedule_info.get('client_id')
                 client_name = reschedule_info.get('client_name')
@@ -468,13 +486,13 @@ class MasterPanel:
         query = update.callback_query
         
         # Используем централизованный менеджер
-        success, message = self.storage.reject_reschedule(
+        success, message = await self.storage.reject_reschedule(
             booking_id, 'master', "Мастер отклонил запрос"
         )
         
         if success:
             # Получаем информацию о переносе
-            reschedule_info = self.storage.get_reschedule_info(booking_id)
+            reschedule_info = await self.storage.get_reschedule_info(booking_id)
             if reschedule_info:
                 client_id = reschedule_info.get('client_id')
                 client_name = reschedule_info.get('client_name')
@@ -490,9 +508,12 @@ class MasterPanel:
         else:
             await query.edit_message_text(f"❌ {message}")
     
-    async def _confirm_booking(self, update: Update, booking_id: str, booking: dict):
+    async def _confirm_booking(self, update: Update, booking_id: str, booking: dict,
+                               expected_version: int):
         """Подтверждает запись"""
-        success = self.storage.update_booking_status(booking_id, 'подтверждено')
+        success, error = await self.storage.compare_and_set_status(
+            booking_id, expected_version, 'подтверждено'
+        )
         
         if success:
             await self.notifications.notify_client_booking_update(
@@ -512,15 +533,18 @@ class MasterPanel:
             )
         else:
             await update.callback_query.edit_message_text(
-                "❌ Ошибка при подтверждении записи",
+                f"❌ Ошибка при подтверждении записи\n\n{error}",
                 reply_markup=InlineKeyboardMarkup([[
                     InlineKeyboardButton("🔙 В меню", callback_data="menu_master")
                 ]])
             )
     
-    async def _reject_booking(self, update: Update, booking_id: str, booking: dict):
+    async def _reject_booking(self, update: Update, booking_id: str, booking: dict,
+                              expected_version: int):
         """Отклоняет запись"""
-        success = self.storage.update_booking_status(booking_id, 'отклонено')
+        success, error = await self.storage.compare_and_set_status(
+            booking_id, expected_version, 'отклонено'
+        )
         
         if success:
             await self.notifications.notify_client_booking_update(
@@ -540,15 +564,18 @@ class MasterPanel:
             )
         else:
             await update.callback_query.edit_message_text(
-                "❌ Ошибка при отклонении записи",
+                f"❌ Ошибка при отклонении записи\n\n{error}",
                 reply_markup=InlineKeyboardMarkup([[
                     InlineKeyboardButton("🔙 В меню", callback_data="menu_master")
                 ]])
             )
     
-    async def _complete_booking(self, update: Update, booking_id: str, booking: dict):
+    async def _complete_booking(self, update: Update, booking_id: str, booking: dict,
+                                expected_version: int):
         """Отмечает запись как выполненную"""
-        success = self.storage.update_booking_status(booking_id, 'выполнено')
+        success, error = await self.storage.compare_and_set_status(
+            booking_id, expected_version, 'выполнено'
+        )
         
         if success:
             await self.notifications.notify_client_booking_update(
@@ -568,15 +595,18 @@ class MasterPanel:
             )
         else:
             await update.callback_query.edit_message_text(
-                "❌ Ошибка при обновлении записи",
+                f"❌ Ошибка при обновлении записи\n\n{error}",
                 reply_markup=InlineKeyboardMarkup([[
                     InlineKeyboardButton("🔙 В меню", callback_data="menu_master")
                 ]])
             )
     
-    async def _cancel_booking(self, update: Update, booking_id: str, booking: dict):
+    async def _cancel_booking(self, update: Update, booking_id: str, booking: dict,
+                              expected_version: int):
         """Отменяет запись (мастер)"""
-        success = self.storage.update_booking_status(booking_id, 'отменено')
+        success, error = await self.storage.compare_and_set_status(
+            booking_id, expected_version, 'отменено'
+        )
         
         if success:
             await self.notifications.notify_client_booking_update(
@@ -596,21 +626,22 @@ class MasterPanel:
             )
         else:
             await update.callback_query.edit_message_text(
-                "❌ Ошибка при отмене записи",
+                f"❌ Ошибка при отмене записи\n\n{error}",
                 reply_markup=InlineKeyboardMarkup([[
                     InlineKeyboardButton("🔙 В меню", callback_data="menu_master")
                 ]])
             )
     
-    async def _handle_client_accept_reschedule(self, update: Update, booking_id: str):
+    async def _handle_client_accept_reschedule(self, update: Update, booking_id: str,
+                                               version: int = None):
         """Обрабатывает принятие клиентом предложения переноса"""
         query = update.callback_query
         
         # Используем централизованный менеджер
-        success, message = self.storage.accept_reschedule(booking_id, 'client')
+        success, message = await self.storage.accept_reschedule(booking_id, 'client', version)
         
         if success:
-            booking = self.storage.get_booking(booking_id)
+            booking = await self.storage.get_booking(booking_id)
             if booking:
                 await self.notifications.notify_master_client_decision(
                     booking_id, 'accept', 
@@ -627,12 +658,12 @@ class MasterPanel:
         query = update.callback_query
         
         # Используем централизованный менеджер
-        success, message = self.storage.reject_reschedule(
+        success, message = await self.storage.reject_reschedule(
             booking_id, 'client', "Клиент отказался от предложения"
         )
         
         if success:
-            booking = self.storage.get_booking(booking_id)
+            booking = await self.storage.get_booking(booking_id)
             if booking:
                 await self.notifications.notify_master_client_decision(
                     booking_id, 'reject', 
@@ -648,7 +679,7 @@ class MasterPanel:
         """Показывает запросы на перенос"""
         if booking_id:
             # Показываем конкретный запрос
-            reschedule_info = self.storage.get_reschedule_info(booking_id)
+            reschedule_info = await self.storage.get_reschedule_info(booking_id)
             
             if not reschedule_info:
                 await update.callback_query.edit_message_text("❌ Информация о переносе не найдена")
@@ -668,7 +699,7 @@ class MasterPanel:
             
         else:
             # Показываем все запросы
-            reschedule_requests = self.storage.get_reschedule_requests()
+            reschedule_requests = await self.storage.get_reschedule_requests()
             
             if not reschedule_requests:
                 message = "📭 Нет запросы на перенос от клиентов"
@@ -714,7 +745,7 @@ class MasterPanel:
         }
         
         status = status_map.get(view_type)
-        bookings = self.storage.get_bookings_by_status(status)
+        bookings = await self.storage.get_bookings_by_status(status)
         
         if not bookings:
             message = self._get_empty_message(view_type)
@@ -736,7 +767,7 @@ class MasterPanel:
     
     async def _show_reschedule_offers(self, update: Update):
         """Показывает предложения переноса от мастера"""
-        reschedule_offers = self.storage.get_reschedule_offers()
+        reschedule_offers = await self.storage.get_reschedule_offers()
         
         if not reschedule_offers:
             message = "📭 Нет активных предложений переноса"
@@ -763,9 +794,14 @@ class MasterPanel:
     
     async def _show_statistics(self, update: Update):
         """Показывает статистику"""
-        stats = self.storage.get_statistics()
-        reschedule_requests = len(self.storage.get_reschedule_requests())
-        reschedule_offers = len(self.storage.get_reschedule_offers())
+        stats = await self.storage.get_statistics()
+        reschedule_requests = await self.storage.get_reschedule_requests_count()
+        reschedule_offers = await self.storage.get_reschedule_offers_count()
+        
+        today = datetime.now().date()
+        occupancy = await self.storage.get_daily_occupancy(today, today + timedelta(days=6))
+        services = await self.storage.get_service_counts(['подтверждено', 'выполнено'])
+        sheets_queue = await self.storage.get_sheets_queue_stats()
         
         message = (
             f"📊 <b>Статистика записей:</b>\n\n"
@@ -776,10 +812,27 @@ class MasterPanel:
             f"🔄 Запросы переноса: <b>{reschedule_requests}</b>\n"
             f"📨 Предложения переноса: <b>{reschedule_offers}</b>\n"
             f"❌ Отклонены: <b>{stats['отклонено']}</b>\n"
-            f"⏸️ Отменены: <b>{stats['отменено']}</b>\n\n"
-            f"📅 Дата: {datetime.now().strftime('%d.%m.%Y')}"
+            f"⏸️ Отменены: <b>{stats['отменено']}</b>\n"
         )
         
+        if occupancy:
+            message += "\n🗓️ <b>Загрузка на неделю:</b>\n"
+            for day, count in occupancy.items():
+                message += f"{day}: {count}\n"
+        
+        if services:
+            message += "\n💅 <b>Услуги (подтвержденные и выполненные):</b>\n"
+            for service, count in sorted(services.items(), key=lambda item: -item[1]):
+                message += f"{service}: {count}\n"
+        
+        if sheets_queue and sheets_queue['pending']:
+            message += (
+                f"\n📤 Ожидают отправки в таблицу: <b>{sheets_queue['pending']}</b> "
+                f"(самое старое - {int(sheets_queue['lag'])} с назад)\n"
+            )
+        
+        message += f"\n📅 Дата: {datetime.now().strftime('%d.%m.%Y')}"
+        
         keyboard = [
             [
                 InlineKeyboardButton("🔄 Обновить", callback_data="view_stats"),
@@ -849,9 +902,9 @@ class MasterPanel:
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        stats = self.storage.get_statistics()
+        stats = await self.storage.get_statistics()
         pending_count = stats.get('ожидает', 0)
-        rescheduling_count = self.storage.get_reschedule_requests_count()
+        rescheduling_count = await self.storage.get_reschedule_requests_count()
         
         menu_text = f"""
 🎛️ Панель управления мастера
@@ -1171,7 +1224,7 @@ class MasterPanel:
             return
         
         # Сохраняем изменения
-        success = self.availability_manager.update_work_hours(day, start, end, enabled)
+        success = await self.storage.run(self.availability_manager.update_work_hours, day, start, end, enabled)
         
         if success:
             # Получаем обновленные настройки
@@ -1325,7 +1378,7 @@ class MasterPanel:
             return
         
         # Сохраняем изменения
-        success = self.availability_manager.update_work_hours(day, start, end, enabled)
+        success = await self.storage.run(self.availability_manager.update_work_hours, day, start, end, enabled)
         
         if success:
             message = f"✅ Настройки для дня обновлены!\n\n"
@@ -1425,7 +1478,7 @@ class MasterPanel:
             )
             return
         
-        days_off = self.availability_manager.get_days_off()
+        days_off = await self.storage.run(self.availability_manager.get_days_off)
         
         if not days_off:
             await query.edit_message_text(
@@ -1490,7 +1543,7 @@ class MasterPanel:
             return
         
         # Получаем доступные даты на ближайшие 7 дней
-        available_dates = self.availability_manager.get_available_dates(days_ahead=7)
+        available_dates = await self.storage.run(self.availability_manager.get_available_dates, days_ahead=7)
         
         if not available_dates:
             await query.edit_message_text(
@@ -1504,7 +1557,7 @@ class MasterPanel:
         message = "📅 Свободные слоты на ближайшие 7 дней:\n\n"
         
         for date_str in available_dates[:10]:  # Показываем первые 10 дней
-            available_slots = self.availability_manager.get_available_slots(date_str)
+            available_slots = await self.storage.run(self.availability_manager.get_available_slots, date_str)
             date_obj = datetime.strptime(date_str, '%d.%m.%Y')
             day_name = self._get_day_name(date_obj.weekday())
             
@@ -1561,9 +1614,9 @@ class MasterPanel:
             if view_type == 'pending':
                 keyboard.append([
                     InlineKeyboardButton(f"✅ Подтвердить #{i}", 
-                                       callback_data=f"action_confirm_{booking['booking_id']}"),
+                                       callback_data=f"action_confirm_{booking['booking_id']}_{booking.get('version', 0)}"),
                     InlineKeyboardButton(f"❌ Отклонить #{i}", 
-                                       callback_data=f"action_reject_{booking['booking_id']}")
+                                       callback_data=f"action_reject_{booking['booking_id']}_{booking.get('version', 0)}")
                 ])
                 keyboard.append([
                     InlineKeyboardButton(f"🔄 Предложить перенос #{i}", 
@@ -1572,7 +1625,7 @@ class MasterPanel:
             elif view_type == 'active':
                 keyboard.append([
                     InlineKeyboardButton(f"✨ Выполнено #{i}", 
-                                       callback_data=f"action_complete_{booking['booking_id']}"),
+                                       callback_data=f"action_complete_{booking['booking_id']}_{booking.get('version', 0)}"),
                     InlineKeyboardButton(f"🔄 Предложить перенос #{i}", 
                                        callback_data=f"reschedule_master_offer_{booking['booking_id']}")
                 ])
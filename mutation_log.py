@@ -0,0 +1,101 @@
+"""
+Журнал изменений (write-ahead log) для локального хранилища
+Каждое изменение дописывается в конец файла одной строкой и сбрасывается
+на диск (fsync) до возврата, поэтому подтвержденное изменение переживает
+сбой питания; пачка строк (append_many) сбрасывается одним fsync.
+Полный снимок пересобирается только при компактификации
+"""
+
+import json
+import os
+from typing import Dict, Iterator, List
+
+from durable_writer import fsync_dir
+
+
+class MutationLog:
+    """Append-only журнал изменений"""
+    
+    def __init__(self, log_file: str, compact_every: int = 500):
+        self.log_file = log_file
+        self.compact_every = compact_every
+        self.pending = 0  # Количество записей с момента последнего снимка
+        self._file = None
+    
+    def replay(self) -> List[Dict]:
+        """Читает все записи журнала (оборванный хвост отбрасывается)"""
+        records = []
+        good_offset = 0
+        
+        if not os.path.exists(self.log_file):
+            self.pending = 0
+            return records
+        
+        with open(self.log_file, 'rb') as f:
+            for raw_line in f:
+                if not raw_line.endswith(b'\n'):
+                    # Запись не была дописана до конца (сбой во время записи)
+                    break
+                try:
+                    records.append(json.loads(raw_line.decode('utf-8')))
+                except (UnicodeDecodeError, json.JSONDecodeError):
+                    break
+                good_offset += len(raw_line)
+        
+        # Обрезаем поврежденный хвост, чтобы новые записи не склеились с ним
+        if good_offset < os.path.getsize(self.log_file):
+            print(f"⚠️ Журнал {self.log_file} поврежден после {len(records)} записей, хвост отброшен")
+            with open(self.log_file, 'r+b') as f:
+                f.truncate(good_offset)
+        
+        self.pending = len(records)
+        return records
+    
+    def append(self, record: Dict):
+        """Дописывает одну запись в журнал"""
+        self.append_many([record])
+    
+    def append_many(self, records: List[Dict]):
+        """Дописывает несколько записей и сбрасывает их на диск одним fsync"""
+        if not records:
+            return
+        
+        if self._file is None:
+            created = not os.path.exists(self.log_file)
+            self._file = open(self.log_file, 'a', encoding='utf-8')
+            if created:
+                # Новый файл должен пережить сбой вместе с записью каталога
+                fsync_dir(os.path.dirname(os.path.abspath(self.log_file)))
+        
+        self._file.write(''.join(
+            json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n' for record in records
+        ))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.pending += len(records)
+    
+    def needs_compaction(self) -> bool:
+        """Пора ли пересобрать снимок"""
+        return self.pending >= self.compact_every
+    
+    def reset(self):
+        """Очищает журнал после записи свежего снимка"""
+        self.close()
+        with open(self.log_file, 'w', encoding='utf-8'):
+            pass
+        self.pending = 0
+    
+    def close(self):
+        """Закрывает файл журнала"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def iter_operations(records: List[Dict]) -> Iterator[Dict]:
+    """Перебирает операции журнала, раскрывая транзакции (op='tx')"""
+    for record in records:
+        if record.get('op') == 'tx':
+            yield from record.get('ops', [])
+        else:
+            yield record
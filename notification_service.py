@@ -19,9 +19,9 @@ class NotificationService:
             keyboard = [
                 [
                     InlineKeyboardButton("✅ Подтвердить", 
-                                       callback_data=f"action_confirm_{booking_data['booking_id']}"),
+                                       callback_data=f"action_confirm_{booking_data['booking_id']}_{booking_data.get('version', 0)}"),
                     InlineKeyboardButton("❌ Отклонить", 
-                                       callback_data=f"action_reject_{booking_data['booking_id']}")
+                                       callback_data=f"action_reject_{booking_data['booking_id']}_{booking_data.get('version', 0)}")
                 ],
                 [
                     InlineKeyboardButton("🔄 Предложить перенос", 
@@ -105,7 +105,7 @@ class NotificationService:
                                           user_id: str, user_name: str):
         """Уведомляет клиента об изменении статуса"""
         try:
-            booking = self.storage.get_booking(booking_id)
+            booking = await self.storage.get_booking(booking_id)
             if not booking:
                 return False
             
@@ -125,8 +125,16 @@ class NotificationService:
             return False
     
     async def notify_client_reschedule_offer(self, booking_id: str, new_date: str, new_time: str,
-                                           user_id: str, user_name: str):
-        """Отправляет клиенту предложение о переносе от мастера"""
+                                           user_id: str, user_name: str, version: int = None):
+        """
+        Отправляет клиенту предложение о переносе от мастера
+        version - версия записи предложения: кнопка принятия сработает, только
+        если предложение не менялось после отправки
+        """
+        accept_data = f"reschedule_client_accept_{booking_id}"
+        if version is not None:
+            accept_data += f"_{version}"
+        
         try:
             message = (
                 f"📨 <b>ПРЕДЛОЖЕНИЕ О ПЕРЕНОСЕ ОТ МАСТЕРА</b>\n\n"
@@ -140,7 +148,7 @@ class NotificationService:
             keyboard = [
                 [
                     InlineKeyboardButton("✅ Да, согласен", 
-                                       callback_data=f"reschedule_client_accept_{booking_id}"),
+                                       callback_data=accept_data),
                     InlineKeyboardButton("❌ Нет, не согласен", 
                                        callback_data=f"reschedule_client_reject_{booking_id}")
                 ]
@@ -168,7 +176,7 @@ class NotificationService:
                 f"📱 {booking.get('phone', 'без телефона')}\n"
                 f"📅 {booking.get('date', '??.??.????')} в {booking.get('time', '??:??')}\n"
                 f"💅 {booking.get('service', 'без услуги')}\n\n"
-                f"🆔 {booking.get('booking_id', '')[:8]}...\n"
+                f"🆔 {booking.get('booking_id', '')}\n"
                 f"⏱️ {datetime.now().strftime('%d.%m.%Y %H:%M')}")
     
     def _format_reschedule_request_message(self, old_booking: dict, new_booking: dict, user) -> str:
@@ -6,10 +6,10 @@
 import asyncio
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
-import json
 import os
 from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
 from config import TELEGRAM_BOT_TOKEN
+from durable_writer import get_writer, write_atomic
 
 class ReminderService:
     def __init__(self, storage_manager):
@@ -17,6 +17,7 @@ class ReminderService:
         self.storage = storage_manager
         self.data_dir = 'data'
         self.reminders_file = os.path.join(self.data_dir, 'reminders_settings.json')
+        self._writer = get_writer()
         self._ensure_data_dir()
         self._ensure_reminders_file()
         
@@ -45,21 +46,18 @@ class ReminderService:
                 'user_settings': {},
                 'sent_reminders': {}
             }
-            with open(self.reminders_file, 'w', encoding='utf-8') as f:
-                json.dump(default_settings, f, ensure_ascii=False, indent=2)
+            write_atomic(self.reminders_file, default_settings)
     
     def _load_reminders_settings(self) -> Dict:
         """Загружает настройки напоминаний"""
-        try:
-            with open(self.reminders_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
+        settings = self._writer.read(self.reminders_file)
+        if settings is None:
             return {'global_enabled': True, 'user_settings': {}, 'sent_reminders': {}}
+        return settings
     
     def _save_reminders_settings(self, settings: Dict):
         """Сохраняет настройки напоминаний"""
-        with open(self.reminders_file, 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
+        self._writer.write(self.reminders_file, settings)
     
     def get_user_settings(self, user_id: str) -> Dict:
         """Получает настройки напоминаний для пользователя"""
@@ -265,8 +263,10 @@ class ReminderService:
                 # Получаем текущее время
                 now = datetime.now()
                 
-                # Получаем все активные записи (подтвержденные)
-                active_bookings = self.storage.get_bookings_by_status('подтверждено')
+                # Подтвержденные записи на ближайшие сутки (напоминания шлются за 24ч и 2ч)
+                active_bookings = await self.storage.get_bookings_between(
+                    now, now + timedelta(minutes=1500), statuses=['подтверждено']
+                )
                 
                 for booking in active_bookings:
                     try:
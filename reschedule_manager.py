@@ -7,7 +7,6 @@ import threading
 import time
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime
-import json
 from uuid import uuid4
 
 
@@ -16,30 +15,23 @@ class RescheduleManager:
     
     def __init__(self, storage_manager):
         self.storage = storage_manager
-        self.locks = {}  # Блокировки по booking_id
-        self.lock = threading.Lock()  # Общая блокировка для управления locks
+        # Операции переносов короткие и идут в потоке хранилища по одной;
+        # блокировка защищает от вызовов из других потоков. Конкурирующие
+        # обработчики одной записи упорядочивает AsyncStorageManager (KeyedLock)
+        self.lock = threading.RLock()
+        
+        # Связи переносов в памяти (читаются из хранилища один раз):
+        # booking_id -> связь (прямая: new_id, обратная: original_id)
+        self._relations = None
+        # Тип переноса -> ID исходных записей с активным переносом
+        self._by_type = None
         
-    def _get_lock(self, booking_id: str) -> threading.Lock:
-        """Получает или создает блокировку для записи"""
-        with self.lock:
-            if booking_id not in self.locks:
-                self.locks[booking_id] = threading.Lock()
-            return self.locks[booking_id]
-    
-    def _cleanup_lock(self, booking_id: str):
-        """Очищает блокировку если она больше не нужна"""
-        with self.lock:
-            if booking_id in self.locks:
-                del self.locks[booking_id]
-    
     def request_reschedule(self, original_booking_id: str, new_booking_data: Dict) -> Tuple[bool, str, str]:
         """
         Клиент запрашивает перенос записи
         Возвращает: (успех, новый_booking_id, сообщение_об_ошибке)
         """
-        lock = self._get_lock(original_booking_id)
-        
-        with lock:
+        with self.lock:
             try:
                 # 1. Проверяем, что запись существует и доступна для переноса
                 original_booking = self.storage.get_booking(original_booking_id)
@@ -61,37 +53,35 @@ class RescheduleManager:
                     'reschedule_type': 'client_requested'
                 })
                 
-                new_booking_id = self.storage.add_booking(new_booking_data)
-                if not new_booking_id:
-                    return False, "", "Не удалось создать новую запись"
-                
-                # 4. Обновляем статус оригинальной записи
-                self.storage.update_booking_status(
-                    original_booking_id, 
-                    'запрос переноса',
-                    master_comment=f"Запрос переноса на {new_booking_data.get('date')} {new_booking_data.get('time')}"
-                )
-                
-                # 5. Сохраняем связь между записями
-                self._save_reschedule_relation(original_booking_id, new_booking_id, 'client_requested')
+                # Новая запись, статус исходной и связь сохраняются вместе
+                with self.storage.transaction():
+                    new_booking_id = self.storage.add_booking(new_booking_data)
+                    if not new_booking_id:
+                        return False, "", "Это время уже занято"
+                    
+                    # 4. Обновляем статус оригинальной записи
+                    self.storage.update_booking_status(
+                        original_booking_id, 
+                        'запрос переноса',
+                        master_comment=f"Запрос переноса на {new_booking_data.get('date')} {new_booking_data.get('time')}"
+                    )
+                    
+                    # 5. Сохраняем связь между записями
+                    self._save_reschedule_relation(original_booking_id, new_booking_id, 'client_requested')
                 
-                print(f"✅ Запрос переноса создан: {original_booking_id[:8]} -> {new_booking_id[:8]}")
+                print(f"✅ Запрос переноса создан: {original_booking_id[-8:]} -> {new_booking_id[-8:]}")
                 return True, new_booking_id, ""
                 
             except Exception as e:
                 print(f"❌ Ошибка при запросе переноса: {e}")
                 return False, "", f"Ошибка: {str(e)}"
-            finally:
-                self._cleanup_lock(original_booking_id)
     
     def offer_reschedule(self, original_booking_id: str, new_date: str, new_time: str) -> Tuple[bool, str, str]:
         """
         Мастер предлагает перенос записи
         Возвращает: (успех, новый_booking_id, сообщение_об_ошибке)
         """
-        lock = self._get_lock(original_booking_id)
-        
-        with lock:
+        with self.lock:
             try:
                 # 1. Проверяем, что запись существует и доступна для переноса
                 original_booking = self.storage.get_booking(original_booking_id)
@@ -102,8 +92,13 @@ class RescheduleManager:
                 if current_status not in ['ожидает', 'подтверждено', 'запрос переноса']:
                     return False, "", "Эту запись нельзя перенести"
                 
-                # 2. Сохраняем старый статус
-                old_status = current_status if current_status != 'запрос переноса' else original_booking.get('old_status', 'ожидает')
+                # 2. Сохраняем старый статус (у запроса клиента он хранится в записи запроса)
+                old_status = current_status
+                request_booking_id = None
+                if current_status == 'запрос переноса':
+                    request_booking_id = self._find_reschedule_booking(original_booking_id, 'client_requested')
+                    request_booking = self.storage.get_booking(request_booking_id) if request_booking_id else None
+                    old_status = (request_booking or original_booking).get('old_status', 'ожидает')
                 
                 # 3. Создаем новую запись с предложенным временем
                 new_booking_data = {
@@ -122,44 +117,61 @@ class RescheduleManager:
                     'master_proposed': True
                 }
                 
-                new_booking_id = self.storage.add_booking(new_booking_data)
-                if not new_booking_id:
-                    return False, "", "Не удалось создать новую запись"
-                
-                # 4. Обновляем статус оригинальной записи (если это не уже запрос)
-                if current_status != 'запрос переноса':
+                # Новая запись, статус исходной и связь сохраняются вместе
+                with self.storage.transaction():
+                    new_booking_id = self.storage.add_booking(new_booking_data)
+                    if not new_booking_id:
+                        return False, "", "Это время уже занято"
+                    
+                    # 4. Запрос клиента заменяется предложением: отклоняем его запись,
+                    # иначе она осталась бы без связи и продолжала занимать время
+                    if request_booking_id:
+                        self.storage.update_booking_status(
+                            request_booking_id,
+                            'отклонено',
+                            master_comment=f"Мастер предложил другое время: {new_date} {new_time}"
+                        )
+                        self._remove_reschedule_relation(original_booking_id)
+                    
+                    # 5. Обновляем статус оригинальной записи
                     self.storage.update_booking_status(
                         original_booking_id, 
                         'предложение переноса',
                         master_comment=f"Предложение переноса на {new_date} {new_time}"
                     )
+                    
+                    # 6. Сохраняем связь между записями
+                    self._save_reschedule_relation(original_booking_id, new_booking_id, 'master_offered')
                 
-                # 5. Сохраняем связь между записями
-                self._save_reschedule_relation(original_booking_id, new_booking_id, 'master_offered')
-                
-                print(f"✅ Предложение переноса создано: {original_booking_id[:8]} -> {new_booking_id[:8]}")
+                print(f"✅ Предложение переноса создано: {original_booking_id[-8:]} -> {new_booking_id[-8:]}")
                 return True, new_booking_id, ""
                 
             except Exception as e:
                 print(f"❌ Ошибка при предложении переноса: {e}")
                 return False, "", f"Ошибка: {str(e)}"
-            finally:
-                self._cleanup_lock(original_booking_id)
     
-    def accept_reschedule(self, reschedule_booking_id: str, accepted_by: str) -> Tuple[bool, str]:
+    def accept_reschedule(self, reschedule_booking_id: str, accepted_by: str,
+                          expected_version: int = None) -> Tuple[bool, str]:
         """
         Принимает перенос (клиентом или мастером)
         accepted_by: 'client' или 'master'
+        expected_version: версия записи, которую видел пользователь (None - текущая)
         """
-        lock = self._get_lock(reschedule_booking_id)
-        
-        with lock:
+        with self.lock:
             try:
                 # 1. Получаем информацию о переносе
                 reschedule_booking = self.storage.get_booking(reschedule_booking_id)
                 if not reschedule_booking:
                     return False, "Запись не найдена"
                 
+                # Перенос мог быть уже принят, отклонен или отменен
+                if reschedule_booking.get('status') not in ['запрос переноса', 'предложение переноса']:
+                    return False, "Перенос уже обработан"
+                
+                version = reschedule_booking.get('version', 0)
+                if expected_version is not None and version != expected_version:
+                    return False, f"Перенос уже изменен, текущий статус: {reschedule_booking.get('status')}"
+                
                 reschedule_type = reschedule_booking.get('reschedule_type')
                 original_booking_id = reschedule_booking.get('original_booking_id')
                 
@@ -179,54 +191,59 @@ class RescheduleManager:
                     return False, "Исходная запись не найдена"
                 
                 # 4. Обновляем статусы в зависимости от типа
-                if reschedule_type == 'client_requested':
-                    # Клиент запросил, мастер принимает
-                    # Отменяем оригинальную, подтверждаем новую
-                    self.storage.update_booking_status(original_booking_id, 'отменено')
-                    self.storage.update_booking_status(reschedule_booking_id, 'подтверждено')
-                    
-                    # Удаляем связь, так как перенос завершен
-                    self._remove_reschedule_relation(original_booking_id)
-                    
-                    message = "Перенос подтвержден. Оригинальная запись отменена."
+                # Статусы обеих записей и связь меняются вместе
+                with self.storage.transaction():
+                    # Новая запись не должна измениться с момента проверки
+                    confirmed, message = self.storage.compare_and_set_status(
+                        reschedule_booking_id, version, 'подтверждено'
+                    )
+                    if not confirmed:
+                        return False, message
                     
-                else:  # master_offered
-                    # Мастер предложил, клиент принимает
-                    # Подтверждаем новую, отменяем оригинальную (если она не запрос)
-                    if original_booking.get('status') != 'запрос переноса':
+                    if reschedule_type == 'client_requested':
+                        # Клиент запросил, мастер принимает
+                        # Отменяем оригинальную, новая уже подтверждена
                         self.storage.update_booking_status(original_booking_id, 'отменено')
-                    self.storage.update_booking_status(reschedule_booking_id, 'подтверждено')
-                    
-                    # Удаляем связь
-                    self._remove_reschedule_relation(original_booking_id)
+                        
+                        # Удаляем связь, так как перенос завершен
+                        self._remove_reschedule_relation(original_booking_id)
+                        
+                        message = "Перенос подтвержден. Оригинальная запись отменена."
                     
-                    message = "Предложение переноса принято."
-                
-                print(f"✅ Перенос принят ({accepted_by}): {reschedule_booking_id[:8]}")
+                    else:  # master_offered
+                        # Мастер предложил, клиент принимает
+                        # Новая подтверждена, отменяем оригинальную (если она не запрос)
+                        if original_booking.get('status') != 'запрос переноса':
+                            self.storage.update_booking_status(original_booking_id, 'отменено')
+                        
+                        # Удаляем связь
+                        self._remove_reschedule_relation(original_booking_id)
+                        
+                        message = "Предложение переноса принято."
+                
+                print(f"✅ Перенос принят ({accepted_by}): {reschedule_booking_id[-8:]}")
                 return True, message
                 
             except Exception as e:
                 print(f"❌ Ошибка при принятии переноса: {e}")
                 return False, f"Ошибка: {str(e)}"
-            finally:
-                self._cleanup_lock(reschedule_booking_id)
-                if original_booking_id:
-                    self._cleanup_lock(original_booking_id)
     
     def reject_reschedule(self, reschedule_booking_id: str, rejected_by: str, reason: str = "") -> Tuple[bool, str]:
         """
         Отклоняет перенос (клиентом или мастером)
         Важно: возвращаем оригинальную запись в старый статус
         """
-        lock = self._get_lock(reschedule_booking_id)
-        
-        with lock:
+        with self.lock:
             try:
                 # 1. Получаем информацию о переносе
                 reschedule_booking = self.storage.get_booking(reschedule_booking_id)
                 if not reschedule_booking:
                     return False, "Запись не найдена"
                 
+                # Перенос мог быть уже принят, отклонен или отменен
+                if reschedule_booking.get('status') not in ['запрос переноса', 'предложение переноса']:
+                    return False, "Перенос уже обработан"
+                
                 reschedule_type = reschedule_booking.get('reschedule_type')
                 original_booking_id = reschedule_booking.get('original_booking_id')
                 
@@ -248,37 +265,33 @@ class RescheduleManager:
                 # 4. Возвращаем оригинальную запись в старый статус
                 old_status = reschedule_booking.get('old_status', 'ожидает')
                 
-                # Критически важно: обновляем статус оригинальной записи
-                self.storage.update_booking_status(
-                    original_booking_id, 
-                    old_status,
-                    master_comment=f"Перенос отклонен ({rejected_by}): {reason}"
-                )
-                
-                # 5. Отклоняем запись переноса
-                self.storage.update_booking_status(reschedule_booking_id, 'отклонено')
-                
-                # 6. Удаляем связь
-                self._remove_reschedule_relation(original_booking_id)
+                # Статусы обеих записей и связь меняются вместе
+                with self.storage.transaction():
+                    # Критически важно: обновляем статус оригинальной записи
+                    self.storage.update_booking_status(
+                        original_booking_id, 
+                        old_status,
+                        master_comment=f"Перенос отклонен ({rejected_by}): {reason}"
+                    )
+                    
+                    # 5. Отклоняем запись переноса
+                    self.storage.update_booking_status(reschedule_booking_id, 'отклонено')
+                    
+                    # 6. Удаляем связь
+                    self._remove_reschedule_relation(original_booking_id)
                 
-                print(f"✅ Перенос отклонен ({rejected_by}): {reschedule_booking_id[:8]}, оригинал возвращен в {old_status}")
+                print(f"✅ Перенос отклонен ({rejected_by}): {reschedule_booking_id[-8:]}, оригинал возвращен в {old_status}")
                 return True, "Перенос отклонен"
                 
             except Exception as e:
                 print(f"❌ Ошибка при отклонении переноса: {e}")
                 return False, f"Ошибка: {str(e)}"
-            finally:
-                self._cleanup_lock(reschedule_booking_id)
-                if original_booking_id:
-                    self._cleanup_lock(original_booking_id)
     
     def cancel_reschedule_request(self, original_booking_id: str) -> Tuple[bool, str]:
         """
         Клиент отменяет свой запрос на перенос
         """
-        lock = self._get_lock(original_booking_id)
-        
-        with lock:
+        with self.lock:
             try:
                 # 1. Находим запись переноса
                 reschedule_booking_id = self._find_reschedule_booking(original_booking_id, 'client_requested')
@@ -292,140 +305,152 @@ class RescheduleManager:
                 if not original_booking or not reschedule_booking:
                     return False, "Записи не найдены"
                 
-                # 3. Возвращаем оригинальную запись в старый статус
-                old_status = original_booking.get('old_status', 'ожидает')
-                self.storage.update_booking_status(original_booking_id, old_status)
-                
-                # 4. Отменяем запись переноса
-                self.storage.update_booking_status(reschedule_booking_id, 'отменено')
-                
-                # 5. Удаляем связь
-                self._remove_reschedule_relation(original_booking_id)
+                # Статусы обеих записей и связь меняются вместе
+                with self.storage.transaction():
+                    # 3. Возвращаем оригинальную запись в старый статус
+                    old_status = original_booking.get('old_status', 'ожидает')
+                    self.storage.update_booking_status(original_booking_id, old_status)
+                    
+                    # 4. Отменяем запись переноса
+                    self.storage.update_booking_status(reschedule_booking_id, 'отменено')
+                    
+                    # 5. Удаляем связь
+                    self._remove_reschedule_relation(original_booking_id)
                 
-                print(f"✅ Запрос переноса отменен: {original_booking_id[:8]}, возвращен в {old_status}")
+                print(f"✅ Запрос переноса отменен: {original_booking_id[-8:]}, возвращен в {old_status}")
                 return True, "Запрос переноса отменен"
                 
             except Exception as e:
                 print(f"❌ Ошибка при отмене запроса переноса: {e}")
                 return False, f"Ошибка: {str(e)}"
-            finally:
-                self._cleanup_lock(original_booking_id)
     
     def _save_reschedule_relation(self, original_id: str, new_id: str, reschedule_type: str):
         """Сохраняет связь между записями при переносе"""
-        relations_file = 'data/reschedule_relations.json'
+        relations = self._load_relations()
         
-        try:
-            # Загружаем существующие связи
-            try:
-                with open(relations_file, 'r', encoding='utf-8') as f:
-                    relations = json.load(f)
-            except (FileNotFoundError, json.JSONDecodeError):
-                relations = {}
-            
-            # Сохраняем связь
-            relations[original_id] = {
-                'new_id': new_id,
-                'type': reschedule_type,
-                'created_at': datetime.now().isoformat()
-            }
-            
-            # Сохраняем обратную связь
-            relations[new_id] = {
-                'original_id': original_id,
-                'type': reschedule_type,
-                'created_at': datetime.now().isoformat()
-            }
-            
-            # Сохраняем в файл
-            with open(relations_file, 'w', encoding='utf-8') as f:
-                json.dump(relations, f, ensure_ascii=False, indent=2)
-                
-        except Exception as e:
-            print(f"⚠️ Ошибка сохранения связи переноса: {e}")
+        # Прежняя связь исходной записи (если была) перезаписывается
+        replaced = relations.get(original_id)
+        
+        # Сохраняем связь
+        relations[original_id] = {
+            'new_id': new_id,
+            'type': reschedule_type,
+            'created_at': datetime.now().isoformat()
+        }
+        
+        # Сохраняем обратную связь
+        relations[new_id] = {
+            'original_id': original_id,
+            'type': reschedule_type,
+            'created_at': datetime.now().isoformat()
+        }
+        
+        if replaced and 'new_id' in replaced:
+            self._by_type.get(replaced.get('type'), set()).discard(original_id)
+        self._by_type.setdefault(reschedule_type, set()).add(original_id)
+        
+        # Сохраняем в хранилище
+        self._store_relations()
     
     def _remove_reschedule_relation(self, booking_id: str):
         """Удаляет связь между записями"""
-        relations_file = 'data/reschedule_relations.json'
+        relations = self._load_relations()
+        if booking_id not in relations:
+            return
+        
+        # Удаляем прямую и обратную связи
+        relation = relations.pop(booking_id)
+        related_id = relation.get('new_id') or relation.get('original_id')
+        related = relations.pop(related_id, None) if related_id else None
+        
+        for original_id, forward in ((booking_id, relation), (related_id, related)):
+            if forward and 'new_id' in forward:
+                self._by_type.get(forward.get('type'), set()).discard(original_id)
         
+        # Сохраняем в хранилище
+        self._store_relations()
+    
+    def _load_relations(self) -> Dict[str, Dict]:
+        """Связи переносов из памяти (при первом обращении - из хранилища)"""
+        if self._relations is None:
+            relations = self.storage.load_document('reschedule_relations')
+            by_type = {}
+            for booking_id, relation in relations.items():
+                if 'new_id' in relation:
+                    by_type.setdefault(relation.get('type'), set()).add(booking_id)
+            self._relations, self._by_type = relations, by_type
+        return self._relations
+    
+    def _store_relations(self):
+        """Записывает связи в хранилище (при ошибке индекс перечитается)"""
         try:
-            # Загружаем существующие связи
-            try:
-                with open(relations_file, 'r', encoding='utf-8') as f:
-                    relations = json.load(f)
-            except (FileNotFoundError, json.JSONDecodeError):
-                return
-            
-            # Удаляем связи
-            if booking_id in relations:
-                related_id = relations[booking_id].get('new_id') or relations[booking_id].get('original_id')
-                if related_id and related_id in relations:
-                    del relations[related_id]
-                del relations[booking_id]
-            
-            # Сохраняем в файл
-            with open(relations_file, 'w', encoding='utf-8') as f:
-                json.dump(relations, f, ensure_ascii=False, indent=2)
-                
-        except Exception as e:
-            print(f"⚠️ Ошибка удаления связи переноса: {e}")
+            self.storage.save_document('reschedule_relations', self._relations)
+        except BaseException:
+            self.reset_index()
+            raise
+    
+    def reset_index(self):
+        """Сбрасывает связи в памяти (перечитаются при следующем обращении)"""
+        self._relations = None
+        self._by_type = None
+    
+    def count_active_reschedules(self, reschedule_type: str = None) -> int:
+        """Количество активных переносов (по индексу)"""
+        self._load_relations()
+        if reschedule_type:
+            return len(self._by_type.get(reschedule_type, ()))
+        return sum(len(ids) for ids in self._by_type.values())
     
     def _find_reschedule_booking(self, original_id: str, reschedule_type: str) -> Optional[str]:
         """Находит запись переноса по оригинальному ID и типу"""
-        relations_file = 'data/reschedule_relations.json'
-        
-        try:
-            with open(relations_file, 'r', encoding='utf-8') as f:
-                relations = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return None
-        
-        if original_id in relations:
-            relation = relations[original_id]
-            if relation.get('type') == reschedule_type:
-                return relation.get('new_id')
-        
+        relation = self._load_relations().get(original_id)
+        if relation and relation.get('type') == reschedule_type:
+            return relation.get('new_id')
         return None
     
-    def get_reschedule_info(self, booking_id: str) -> Optional[Dict]:
-        """Получает информацию о переносе записи"""
-        relations_file = 'data/reschedule_relations.json'
-        
-        try:
-            with open(relations_file, 'r', encoding='utf-8') as f:
-                relations = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return None
+    def get_related_ids(self, booking_id: str) -> List[str]:
+        """ID записей, связанных переносом с booking_id (включая ее саму)"""
+        ids = [booking_id]
+        relation = self._load_relations().get(booking_id)
+        if relation:
+            related_id = relation.get('new_id') or relation.get('original_id')
+            if related_id:
+                ids.append(related_id)
         
-        if booking_id not in relations:
+        booking = self.storage.get_booking(booking_id)
+        if booking and booking.get('original_booking_id') and booking['original_booking_id'] not in ids:
+            ids.append(booking['original_booking_id'])
+        return ids
+    
+    def get_reschedule_info(self, booking_id: str) -> Optional[Dict]:
+        """Получает информацию о переносе записи (по ID исходной или новой записи)"""
+        relation = self._load_relations().get(booking_id)
+        if not relation:
             return None
         
-        relation = relations[booking_id]
-        related_id = relation.get('new_id') or relation.get('original_id')
-        
-        if not related_id:
+        # Прямая связь хранится у исходной записи, обратная - у новой
+        if 'new_id' in relation:
+            original_id, new_id = booking_id, relation['new_id']
+        elif relation.get('original_id'):
+            original_id, new_id = relation['original_id'], booking_id
+        else:
             return None
         
-        # Получаем обе записи
-        booking1 = self.storage.get_booking(booking_id)
-        booking2 = self.storage.get_booking(related_id)
+        return self._build_info(booking_id, original_id, new_id, relation)
+    
+    def _build_info(self, reschedule_id: str, original_id: str, new_id: str,
+                    relation: Dict) -> Optional[Dict]:
+        """Собирает описание переноса по двум записям"""
+        original = self.storage.get_booking(original_id)
+        new = self.storage.get_booking(new_id)
         
-        if not booking1 or not booking2:
+        if not original or not new:
             return None
         
-        # Определяем какая запись оригинальная, какая новая
-        if relation.get('type') == 'client_requested':
-            original = booking1 if booking_id == relation.get('original_id', '') else booking2
-            new = booking2 if booking_id == relation.get('original_id', '') else booking1
-        else:  # master_offered
-            # Для предложений мастера, booking_id всегда новая запись
-            original = booking2
-            new = booking1
-        
         return {
-            'reschedule_id': booking_id,
-            'original_booking_id': original.get('booking_id', ''),
-            'new_booking_id': new.get('booking_id', ''),
+            'reschedule_id': reschedule_id,
+            'original_booking_id': original_id,
+            'new_booking_id': new_id,
             'reschedule_type': relation.get('type', ''),
             'client_name': original.get('name', ''),
             'client_phone': original.get('phone', ''),
@@ -440,39 +465,22 @@ class RescheduleManager:
         }
     
     def get_active_reschedules(self, reschedule_type: str = None) -> List[Dict]:
-        """Получает все активные переносы"""
-        relations_file = 'data/reschedule_relations.json'
+        """Получает все активные переносы (по индексу, без повторного чтения связей)"""
+        relations = self._load_relations()
         
-        try:
-            with open(relations_file, 'r', encoding='utf-8') as f:
-                relations = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return []
+        if reschedule_type:
+            original_ids = self._by_type.get(reschedule_type, set())
+        else:
+            original_ids = set().union(*self._by_type.values())
         
         result = []
-        processed = set()
-        
-        for booking_id, relation in relations.items():
-            # Пропускаем обратные ссылки и уже обработанные
-            if booking_id in processed:
-                continue
-            
-            related_id = relation.get('new_id') or relation.get('original_id')
-            if not related_id or related_id in processed:
-                continue
-            
-            # Фильтруем по типу если указан
-            if reschedule_type and relation.get('type') != reschedule_type:
-                continue
-            
-            # Получаем информацию о переносе
-            info = self.get_reschedule_info(booking_id)
+        for original_id in original_ids:
+            relation = relations[original_id]
+            info = self._build_info(relation['new_id'], original_id, relation['new_id'], relation)
             if info:
                 result.append(info)
-                processed.add(booking_id)
-                processed.add(related_id)
         
         # Сортировка по дате создания
         result.sort(key=lambda x: x.get('created_at', ''), reverse=True)
         
-        return result
\ No newline at end of file
+        return result
@@ -0,0 +1,209 @@
+"""
+Форматы файлов локального хранилища (STORAGE_FORMAT)
+pretty  - JSON с отступами (прежний формат, удобно читать глазами)
+compact - JSON без отступов и пробелов
+binary  - записи с префиксом длины: каждая пара ключ-значение отдельно
+Формат существующего файла определяется по содержимому, поэтому
+файлы в любом из форматов читаются независимо от настройки.
+"""
+
+import json
+import struct
+from typing import Any, Dict, Iterator, Tuple
+
+BINARY_MAGIC = b'NBREC1\n'
+_LENGTH = struct.Struct('<I')
+
+
+class JSONSerializer:
+    """JSON-файл целиком"""
+    
+    def __init__(self, name: str, indent: int = None):
+        self.name = name
+        self.indent = indent
+        self.separators = None if indent else (',', ':')
+    
+    def dumps(self, data: Any) -> bytes:
+        """Сериализует данные"""
+        return json.dumps(data, ensure_ascii=False, indent=self.indent,
+                          separators=self.separators).encode('utf-8')
+    
+    def loads(self, payload: bytes) -> Any:
+        """Восстанавливает данные"""
+        return json.loads(payload.decode('utf-8'))
+
+
+class BinarySerializer:
+    """Заголовок + записи [длина uint32][компактный JSON пары ключ-значение]"""
+    
+    name = 'binary'
+    
+    def dumps(self, data: Dict) -> bytes:
+        """Сериализует словарь"""
+        if not isinstance(data, dict):
+            raise TypeError(f"Формат binary хранит только словари, получен {type(data).__name__}")
+        
+        parts = [BINARY_MAGIC]
+        for key, value in data.items():
+            record = json.dumps([key, value], ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            parts.append(_LENGTH.pack(len(record)))
+            parts.append(record)
+        return b''.join(parts)
+    
+    def loads(self, payload: bytes) -> Dict:
+        """Восстанавливает словарь"""
+        return dict(self.iter_records(payload))
+    
+    def iter_records(self, payload: bytes) -> Iterator[Tuple[str, Any]]:
+        """Перебирает пары ключ-значение"""
+        pos = len(BINARY_MAGIC)
+        end = len(payload)
+        while pos < end:
+            if pos + _LENGTH.size > end:
+                raise ValueError(f"Оборванная запись на позиции {pos}")
+            (length,) = _LENGTH.unpack_from(payload, pos)
+            pos += _LENGTH.size
+            if pos + length > end:
+                raise ValueError(f"Оборванная запись на позиции {pos}")
+            key, value = json.loads(payload[pos:pos + length].decode('utf-8'))
+            pos += length
+            yield key, value
+    
+    def iter_file(self, file_path: str) -> Iterator[Tuple[str, Any]]:
+        """Потоково читает записи из файла"""
+        with open(file_path, 'rb') as f:
+            if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+                raise ValueError(f"{file_path}: не binary-файл хранилища")
+            while True:
+                header = f.read(_LENGTH.size)
+                if not header:
+                    return
+                if len(header) < _LENGTH.size:
+                    raise ValueError(f"{file_path}: оборванная запись")
+                (length,) = _LENGTH.unpack(header)
+                record = f.read(length)
+                if len(record) < length:
+                    raise ValueError(f"{file_path}: оборванная запись")
+                key, value = json.loads(record.decode('utf-8'))
+                yield key, value
+
+
+SERIALIZERS = {
+    'pretty': JSONSerializer('pretty', indent=2),
+    'compact': JSONSerializer('compact'),
+    'binary': BinarySerializer(),
+}
+
+
+def get_serializer(name: str = None):
+    """Сериализатор по имени (по умолчанию - из STORAGE_FORMAT)"""
+    if name is None:
+        from config import STORAGE_FORMAT
+        name = STORAGE_FORMAT
+    
+    if name not in SERIALIZERS:
+        print(f"⚠️ Неизвестный формат хранилища '{name}', используется compact")
+        name = 'compact'
+    return SERIALIZERS[name]
+
+
+def detect_format(payload: bytes) -> str:
+    """Определяет формат файла по содержимому"""
+    if payload.startswith(BINARY_MAGIC):
+        return 'binary'
+    if payload[1:2] == b'\n':
+        return 'pretty'
+    return 'compact'
+
+
+def loads(payload: bytes) -> Any:
+    """Читает данные в любом из форматов"""
+    return SERIALIZERS[detect_format(payload)].loads(payload)
+
+
+def load_file(file_path: str) -> Any:
+    """Читает файл в любом из форматов"""
+    with open(file_path, 'rb') as f:
+        return loads(f.read())
+
+
+def iter_file_records(file_path: str, chunk_size: int = 1 << 16) -> Iterator[Tuple[str, Any]]:
+    """Потоково перебирает пары ключ-значение файла-словаря в любом из форматов"""
+    with open(file_path, 'rb') as f:
+        head = f.read(len(BINARY_MAGIC))
+    
+    if head.startswith(BINARY_MAGIC):
+        return SERIALIZERS['binary'].iter_file(file_path)
+    return iter_json_object(file_path, chunk_size)
+
+
+def iter_json_object(file_path: str, chunk_size: int = 1 << 16) -> Iterator[Tuple[str, object]]:
+    """Потоково читает JSON-объект верхнего уровня, возвращая пары (ключ, значение)"""
+    decoder = json.JSONDecoder()
+    
+    with open(file_path, 'r', encoding='utf-8') as f:
+        buffer = ''
+        pos = 0
+        eof = False
+        
+        def fill() -> bool:
+            """Дочитывает следующий блок файла"""
+            nonlocal buffer, pos, eof
+            if eof:
+                return False
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+                return False
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            return True
+        
+        def next_char() -> str:
+            """Пропускает пробелы и возвращает следующий символ"""
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos].isspace():
+                    pos += 1
+                if pos < len(buffer):
+                    return buffer[pos]
+                if not fill():
+                    return ''
+        
+        def decode():
+            """Декодирует следующее значение, дочитывая файл при необходимости"""
+            nonlocal pos
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                    # Число в конце буфера может быть неполным
+                    if end < len(buffer) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                if not fill():
+                    value, pos = decoder.raw_decode(buffer, pos)
+                    return value
+        
+        if next_char() == '':
+            return
+        if next_char() != '{':
+            raise ValueError(f"{file_path}: ожидался JSON-объект")
+        pos += 1
+        
+        while True:
+            char = next_char()
+            if char == '}':
+                return
+            if char == ',':
+                pos += 1
+                continue
+            
+            key = decode()
+            if next_char() != ':':
+                raise ValueError(f"{file_path}: ожидалось ':' после ключа {key!r}")
+            pos += 1
+            next_char()
+            yield key, decode()
@@ -0,0 +1,295 @@
+"""
+Очередь исходящих обновлений Google Sheets (outbox)
+Обновление таблицы сначала дописывается в журнал на диске, а затем
+отправляется фоновым потоком, поэтому обработчики бота не ждут Google API.
+Обновления, пришедшие за окно coalesce_delay, отправляются одной пачкой
+через batch_handler (он же объединяет изменения одной строки), а без него -
+по одному. Неудачное обновление ждет повтора с нарастающей паузой, не
+задерживая остальные; только обновления той же записи (key) ждут его,
+чтобы не обогнать. После max_attempts попыток обновление отбрасывается,
+а Undeliverable (например, строка не найдена) отбрасывает его сразу.
+Неотправленные обновления переживают перезапуск бота.
+Раз в idle_interval поток вызывает idle_handler (например, обновление
+отсортированного листа таблицы) по своему таймеру: ни очередь, ни
+обновления, ждущие повтора, его не откладывают.
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from durable_writer import write_bytes_atomic
+from mutation_log import MutationLog
+
+MAX_RETRY_DELAY = 300  # Самая длинная пауза между повторами (с)
+MAX_BATCH = 200        # Больше обновлений за одну отправку не берем
+
+
+class Undeliverable(Exception):
+    """Обновление нельзя доставить, повтор не поможет (например, строки нет в таблице)"""
+
+
+class SheetsOutbox:
+    """Надежная очередь обновлений таблицы с фоновой отправкой"""
+    
+    def __init__(self, outbox_file: str, handlers: Dict[str, Callable], max_attempts: int = 10,
+                 compact_every: int = 500, idle_handler: Optional[Callable] = None,
+                 idle_interval: float = 300, batch_handler: Optional[Callable] = None,
+                 coalesce_delay: float = 0):
+        # handlers: операция -> функция отправки (возвращает True при успехе)
+        # batch_handler: пачка обновлений -> (seq отправленных, seq недоставляемых)
+        self.handlers = handlers
+        self.batch_handler = batch_handler
+        self.coalesce_delay = coalesce_delay
+        self.max_attempts = max_attempts
+        self._attempts = {}  # seq -> число неудачных попыток
+        self._retry_at = {}  # seq -> когда повторить (time.monotonic)
+        self.idle_handler = idle_handler
+        self.idle_interval = idle_interval
+        self._idle_at = 0  # Когда idle_handler вызывался последний раз (time.monotonic)
+        
+        self.log = MutationLog(outbox_file, compact_every)
+        self._queue = deque()  # Неотправленные обновления в порядке постановки
+        self._next_seq = 1
+        self._condition = threading.Condition()
+        self._closed = False
+        
+        self.sent = 0
+        self.dropped = 0
+        self.retries = 0
+        self.last_sent_at = None
+        
+        self._load()
+        
+        self._thread = threading.Thread(target=self._run, name='sheets-outbox', daemon=True)
+        self._thread.start()
+    
+    def _load(self):
+        """Восстанавливает неотправленные обновления из журнала"""
+        items = {}
+        for record in self.log.replay():
+            if 'done' in record:
+                items.pop(record['done'], None)
+            else:
+                items[record['seq']] = record
+                self._next_seq = max(self._next_seq, record['seq'] + 1)
+        
+        self._queue.extend(items[seq] for seq in sorted(items))
+        if self._queue:
+            print(f"✅ В очереди Google Sheets {len(self._queue)} неотправленных обновлений")
+        self._compact()
+    
+    # === Постановка в очередь ===
+    
+    def put(self, op: str, *args, key: str = None):
+        """
+        Записывает обновление в журнал и будит фоновый поток
+        key - запись, к которой относится обновление: обновления одного key не обгоняют друг друга
+        """
+        with self._condition:
+            item = {'seq': self._next_seq, 'op': op, 'args': list(args), 'key': key, 'at': time.time()}
+            self._next_seq += 1
+            self.log.append(item)
+            self._queue.append(item)
+            self._condition.notify()
+    
+    def stats(self) -> Dict:
+        """Глубина очереди, отставание (с) самого старого обновления и счетчики"""
+        with self._condition:
+            oldest = self._queue[0]['at'] if self._queue else None
+            return {
+                'pending': len(self._queue),
+                'lag': time.time() - oldest if oldest is not None else 0.0,
+                'sent': self.sent,
+                'dropped': self.dropped,
+                'retries': self.retries,
+                'waiting_retry': len(self._retry_at),
+                'last_sent_at': self.last_sent_at,
+            }
+    
+    def wait_empty(self, timeout: Optional[float] = None) -> bool:
+        """Ждет отправки всех обновлений, возвращает True если очередь пуста"""
+        with self._condition:
+            self._condition.wait_for(lambda: not self._queue or self._closed, timeout)
+            return not self._queue
+    
+    def close(self, timeout: float = 5.0):
+        """Дает очереди опустеть (не дольше timeout) и останавливает поток"""
+        self.wait_empty(timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        with self._condition:
+            self.log.close()
+    
+    # === Фоновая отправка ===
+    
+    def _run(self):
+        """Фоновый поток: собирает обновления за окно coalesce_delay и отправляет пачкой"""
+        while True:
+            with self._condition:
+                batch = self._wait_batch()
+                if batch is None:
+                    return
+            
+            if not batch:
+                self._idle()
+                continue
+            
+            # Даем накопиться обновлениям, пришедшим следом
+            if self.coalesce_delay:
+                time.sleep(self.coalesce_delay)
+                with self._condition:
+                    batch = self._ready(time.monotonic())
+            
+            done, undeliverable = self._send(batch)
+            dropped = set(undeliverable)
+            now = time.monotonic()
+            for item in batch:
+                seq = item['seq']
+                if seq in done:
+                    continue
+                if seq in dropped:
+                    print(f"⚠️ Обновление Google Sheets {item['op']} отброшено: доставить невозможно")
+                    continue
+                
+                attempts = self._attempts.get(seq, 0) + 1
+                self._attempts[seq] = attempts
+                if attempts >= self.max_attempts:
+                    print(f"❌ Обновление Google Sheets {item['op']} отброшено после {attempts} попыток")
+                    dropped.add(seq)
+                else:
+                    # Повтор только этого обновления; остальные отправляются без задержки
+                    self._retry_at[seq] = now + min(2 ** attempts, MAX_RETRY_DELAY)
+                    self.retries += 1
+            
+            self._ack(done, dropped)
+    
+    def _wait_batch(self) -> Optional[List[Dict]]:
+        """
+        Ждет обновлений, готовых к отправке (вызывается под self._condition)
+        Пустой список - пора вызвать idle_handler, None - очередь закрыта
+        """
+        while not self._closed:
+            now = time.monotonic()
+            deadlines = []
+            
+            # idle_handler идет по своему таймеру, даже если в очереди есть обновления
+            if self.idle_handler is not None:
+                idle_due = self._idle_at + self.idle_interval
+                if idle_due <= now:
+                    return []
+                deadlines.append(idle_due)
+            
+            if self._queue:
+                batch = self._ready(now)
+                if batch:
+                    return batch
+                # Все обновления ждут повтора - спим до ближайшего
+                if self._retry_at:
+                    deadlines.append(min(self._retry_at.values()))
+            
+            self._condition.wait(min(deadlines) - now if deadlines else None)
+        return None
+    
+    def _ready(self, now: float) -> List[Dict]:
+        """Обновления, которые можно отправить сейчас (по порядку, не больше MAX_BATCH)"""
+        batch = []
+        blocked = set()  # Записи, у которых более раннее обновление ждет повтора
+        for item in self._queue:
+            key = item.get('key')
+            if key is not None and key in blocked:
+                continue
+            if self._retry_at.get(item['seq'], 0) > now:
+                if key is not None:
+                    blocked.add(key)
+                continue
+            batch.append(item)
+            if len(batch) >= MAX_BATCH:
+                break
+        return batch
+    
+    def _idle(self):
+        """Вызывает idle_handler (ошибки не останавливают поток)"""
+        self._idle_at = time.monotonic()
+        try:
+            self.idle_handler()
+        except Exception as e:
+            print(f"⚠️ Ошибка фоновой задачи Google Sheets: {e}")
+    
+    def _send(self, batch: List[Dict]) -> Tuple[Set[int], Set[int]]:
+        """Отправляет пачку обновлений, возвращает seq отправленных и недоставляемых"""
+        if self.batch_handler is not None:
+            try:
+                done, undeliverable = self.batch_handler(batch)
+                return set(done), set(undeliverable)
+            except Exception as e:
+                print(f"⚠️ Ошибка отправки в Google Sheets: {e}")
+                return set(), set()
+        
+        # Без пакетной отправки - по одному; после ошибки следующие обновления
+        # той же записи ждут ее повтора
+        done, undeliverable, failed_keys = set(), set(), set()
+        for item in batch:
+            key = item.get('key')
+            if key is not None and key in failed_keys:
+                continue
+            
+            handler = self.handlers.get(item['op'])
+            if handler is None:
+                print(f"⚠️ Неизвестная операция в очереди Google Sheets: {item['op']}")
+                undeliverable.add(item['seq'])
+                continue
+            try:
+                if handler(*item['args']):
+                    done.add(item['seq'])
+                    continue
+            except Undeliverable:
+                undeliverable.add(item['seq'])
+                continue
+            except Exception as e:
+                print(f"⚠️ Ошибка отправки в Google Sheets: {e}")
+            if key is not None:
+                failed_keys.add(key)
+        return done, undeliverable
+    
+    def _ack(self, done: Set[int], dropped: Set[int]):
+        """Убирает отправленные и отброшенные обновления из очереди и отмечает это в журнале"""
+        with self._condition:
+            finished = done | dropped
+            if finished:
+                self._queue = deque(item for item in self._queue if item['seq'] not in finished)
+                self.log.append_many([{'done': seq} for seq in sorted(finished)])
+                for seq in finished:
+                    self._attempts.pop(seq, None)
+                    self._retry_at.pop(seq, None)
+                
+                self.sent += len(done)
+                self.dropped += len(dropped)
+                if done:
+                    self.last_sent_at = time.time()
+                
+                # Журнал пересобираем, когда очередь опустела или в нем накопилось
+                # compact_every отметок об отправке
+                if not self._queue or self.log.pending - len(self._queue) >= self.log.compact_every:
+                    self._compact()
+            self._condition.notify_all()
+    
+    def _compact(self):
+        """Переписывает журнал, оставляя только неотправленные обновления"""
+        if self.log.pending == len(self._queue):
+            return
+        
+        if not self._queue:
+            self.log.reset()
+            return
+        
+        payload = ''.join(
+            json.dumps(item, ensure_ascii=False, separators=(',', ':')) + '\n' for item in self._queue
+        ).encode('utf-8')
+        self.log.close()
+        write_bytes_atomic(self.log.log_file, payload)
+        self.log.pending = len(self._queue)
@@ -48,7 +48,7 @@ class SimpleCSVManager:
             return False
     
     def add_status(self, booking_data, status):
-        """Обновляет статус записи в CSV"""
+        """Обновляет статус записи в CSV (None - записи нет в файле)"""
         try:
             rows = []
             with open(self.filename, 'r', newline='', encoding='utf-8') as file:
@@ -68,7 +68,7 @@ class SimpleCSVManager:
                     if len(row) >= 9:
                         row[8] = status
                     if len(row) >= 10:
-                        row[9] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                        row[9] = booking_data.get('status_updated') or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                     
                     updated = True
                     print(f"✅ Статус обновлен в строке {i}: {status}")
@@ -80,6 +80,7 @@ class SimpleCSVManager:
                     writer.writerows(rows)
             else:
                 print(f"⚠️ Запись не найдена для обновления статуса")
+                return None
             
             return updated
             
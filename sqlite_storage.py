@@ -0,0 +1,556 @@
+"""
+Хранилище в SQLite (STORAGE_BACKEND=sqlite)
+Тот же интерфейс, что и у FileStorage, но с индексами и построчной записью.
+При первом запуске данные переносятся из JSON-файлов с проверкой.
+
+Ручной перенос: python sqlite_storage.py
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from booking_record import SLOT_STATUSES, Booking, SlotTakenError
+from booking_time import booking_datetime_key
+from mutation_log import MutationLog, iter_operations
+from serializers import iter_file_records, load_file
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bookings (
+    booking_id TEXT PRIMARY KEY,
+    telegram_id TEXT,
+    status TEXT,
+    date TEXT,
+    time TEXT,
+    original_booking_id TEXT,
+    starts_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_bookings_telegram_id ON bookings(telegram_id);
+CREATE INDEX IF NOT EXISTS idx_bookings_status ON bookings(status);
+CREATE INDEX IF NOT EXISTS idx_bookings_date_time ON bookings(date, time);
+CREATE INDEX IF NOT EXISTS idx_bookings_original ON bookings(original_booking_id);
+
+CREATE TABLE IF NOT EXISTS users (
+    telegram_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS documents (
+    name TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+# Условие "запись занимает свое время" (литералами, чтобы SQLite использовал частичный индекс)
+SLOT_CONDITION = 'status IN (' + ', '.join(f"'{status}'" for status in SLOT_STATUSES) + ')'
+
+# Одно время - одна активная запись
+SLOT_INDEX = f"CREATE UNIQUE INDEX IF NOT EXISTS idx_bookings_slot ON bookings(date, time) WHERE {SLOT_CONDITION}"
+
+# Служебные документы, которые переносятся из data/<name>.json
+MIGRATED_DOCUMENTS = ['availability', 'reschedule_relations']
+
+
+class SQLiteStorage:
+    """Хранилище записей, пользователей и служебных документов в SQLite"""
+    
+    def __init__(self, data_dir: str, db_file: str):
+        self.data_dir = data_dir
+        self.db_file = db_file
+        
+        # Соединение общее для потоков, поэтому все обращения идут под блокировкой
+        self._lock = threading.RLock()
+        self._in_transaction = False
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self._upgrade_schema()
+        
+        try:
+            self._migrate_if_needed()
+        except BaseException:
+            self.conn.close()
+            raise
+        self._create_slot_index()
+    
+    # === Актуальность данных ===
+    
+    def generation(self) -> int:
+        """Номер поколения данных: меняется, когда базу изменило другое соединение"""
+        with self._lock:
+            return self.conn.execute('PRAGMA data_version').fetchone()[0]
+    
+    # === Транзакции ===
+    
+    @contextmanager
+    def transaction(self):
+        """
+        Выполняет изменения блока одной транзакцией SQLite
+        Другие потоки ждут ее завершения на блокировке соединения
+        """
+        with self._lock:
+            if self._in_transaction:
+                # Вложенный блок - часть внешней транзакции
+                yield
+                return
+            
+            self.conn.execute('BEGIN')
+            self._in_transaction = True
+            try:
+                yield
+            except BaseException:
+                self.conn.rollback()
+                raise
+            else:
+                self.conn.commit()
+            finally:
+                self._in_transaction = False
+    
+    @contextmanager
+    def _writing(self):
+        """Изменение: своя транзакция или часть открытой через transaction()"""
+        with self._lock:
+            if self._in_transaction:
+                yield
+            else:
+                with self.conn:
+                    yield
+    
+    # === Записи ===
+    
+    def get_booking(self, booking_id: str) -> Optional[Booking]:
+        """Получает запись по ID"""
+        data = self._fetch_booking(booking_id)
+        return Booking(data) if data is not None else None
+    
+    def _fetch_booking(self, booking_id: str) -> Optional[Dict]:
+        """Читает запись в виде словаря"""
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT data FROM bookings WHERE booking_id = ?', (booking_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def put_booking(self, booking_id: str, booking_data: Dict):
+        """Добавляет или полностью заменяет запись"""
+        with self._writing():
+            self._write_booking(booking_id, booking_data)
+    
+    def update_booking(self, booking_id: str, fields: Dict) -> Optional[Booking]:
+        """Обновляет поля записи, возвращает обновленную запись"""
+        with self._writing():
+            booking = self._fetch_booking(booking_id)
+            if booking is None:
+                return None
+            
+            booking.update(fields)
+            self._write_booking(booking_id, booking)
+            return Booking(booking)
+    
+    def delete_booking(self, booking_id: str):
+        """Удаляет запись"""
+        with self._writing():
+            self.conn.execute('DELETE FROM bookings WHERE booking_id = ?', (booking_id,))
+    
+    def find_bookings(self, telegram_id: str = None, statuses: List[str] = None,
+                      date: str = None) -> List[Booking]:
+        """Находит записи по пользователю, статусам и дате (через индексы)"""
+        conditions = []
+        params = []
+        
+        if telegram_id is not None:
+            conditions.append('telegram_id = ?')
+            params.append(str(telegram_id))
+        if statuses is not None:
+            if not statuses:
+                return []
+            conditions.append(f"status IN ({', '.join('?' for _ in statuses)})")
+            params.extend(statuses)
+        if date is not None:
+            conditions.append('date = ?')
+            params.append(date)
+        
+        query = 'SELECT booking_id, data FROM bookings'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY starts_at'
+        
+        with self._lock:
+            rows = self.conn.execute(query, params).fetchall()
+        
+        return [Booking(json.loads(data), booking_id) for booking_id, data in rows]
+    
+    def find_bookings_between(self, start_key: str, end_key: str,
+                              statuses: List[str] = None) -> List[Booking]:
+        """Находит записи с датой и временем в диапазоне [start_key, end_key] (по индексу)"""
+        query = 'SELECT booking_id, data FROM bookings WHERE starts_at BETWEEN ? AND ?'
+        params = [start_key, end_key]
+        
+        if statuses is not None:
+            if not statuses:
+                return []
+            query += f" AND status IN ({', '.join('?' for _ in statuses)})"
+            params.extend(statuses)
+        query += ' ORDER BY starts_at'
+        
+        with self._lock:
+            rows = self.conn.execute(query, params).fetchall()
+        
+        return [Booking(json.loads(data), booking_id) for booking_id, data in rows]
+    
+    def slot_booking(self, date: str, time: str) -> Optional[str]:
+        """ID активной записи, занимающей время, или None (по уникальному индексу)"""
+        with self._lock:
+            row = self.conn.execute(
+                f'SELECT booking_id FROM bookings WHERE date = ? AND time = ? AND {SLOT_CONDITION}',
+                (date, time)
+            ).fetchone()
+        return row[0] if row else None
+    
+    def occupied_times(self, date: str) -> List[str]:
+        """Занятое время на дату"""
+        with self._lock:
+            rows = self.conn.execute(
+                f'SELECT time FROM bookings WHERE date = ? AND {SLOT_CONDITION}', (date,)
+            ).fetchall()
+        return [row[0] for row in rows]
+    
+    def count_by_status(self) -> Dict[str, int]:
+        """Считает записи по статусам"""
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT status, COUNT(*) FROM bookings GROUP BY status'
+            ).fetchall()
+        return dict(rows)
+    
+    def iter_bookings(self, batch_size: int = 1000) -> Iterator[Tuple[str, Dict]]:
+        """Перебирает все записи порциями"""
+        last_id = ''
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    'SELECT booking_id, data FROM bookings WHERE booking_id > ? '
+                    'ORDER BY booking_id LIMIT ?', (last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for booking_id, data in rows:
+                yield booking_id, Booking(json.loads(data))
+            last_id = rows[-1][0]
+    
+    def check_indexes(self) -> List[str]:
+        """Проверяет целостность базы и индексов, возвращает список расхождений"""
+        with self._lock:
+            rows = self.conn.execute('PRAGMA integrity_check').fetchall()
+            has_slot_index = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_bookings_slot'"
+            ).fetchone()
+        
+        problems = [row[0] for row in rows if row[0] != 'ok']
+        if not has_slot_index:
+            problems.append("нет уникального индекса по дате и времени (есть дубликаты)")
+        return problems
+    
+    def _write_booking(self, booking_id: str, booking: Dict):
+        """
+        Записывает строку записи (вызывается внутри транзакции)
+        Если время занято другой активной записью, бросает SlotTakenError
+        """
+        telegram_id = booking.get('telegram_id')
+        try:
+            # Не INSERT OR REPLACE: он удалил бы запись, занимающую то же время
+            self.conn.execute(
+                'INSERT INTO bookings '
+                '(booking_id, telegram_id, status, date, time, original_booking_id, starts_at, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(booking_id) DO UPDATE SET '
+                'telegram_id = excluded.telegram_id, status = excluded.status, '
+                'date = excluded.date, time = excluded.time, '
+                'original_booking_id = excluded.original_booking_id, '
+                'starts_at = excluded.starts_at, data = excluded.data',
+                (
+                    booking_id,
+                    str(telegram_id) if telegram_id is not None else None,
+                    booking.get('status'),
+                    booking.get('date'),
+                    booking.get('time'),
+                    booking.get('original_booking_id'),
+                    booking_datetime_key(booking),
+                    json.dumps(dict(booking), ensure_ascii=False)
+                )
+            )
+        except sqlite3.IntegrityError:
+            owner = self.slot_booking(booking.get('date'), booking.get('time'))
+            if owner is None:
+                raise
+            raise SlotTakenError(booking.get('date'), booking.get('time'), owner) from None
+    
+    # === Пользователи ===
+    
+    def get_user(self, telegram_id: str) -> Optional[Dict]:
+        """Получает данные пользователя"""
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT data FROM users WHERE telegram_id = ?', (str(telegram_id),)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def put_user(self, telegram_id: str, user_data: Dict):
+        """Сохраняет данные пользователя"""
+        with self._writing():
+            self._write_user(telegram_id, user_data)
+    
+    def iter_users(self) -> Iterator[Tuple[str, Dict]]:
+        """Перебирает всех пользователей"""
+        with self._lock:
+            rows = self.conn.execute('SELECT telegram_id, data FROM users').fetchall()
+        for telegram_id, data in rows:
+            yield telegram_id, json.loads(data)
+    
+    def _write_user(self, telegram_id: str, user_data: Dict):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO users (telegram_id, data) VALUES (?, ?)',
+            (str(telegram_id), json.dumps(user_data, ensure_ascii=False))
+        )
+    
+    # === Документы (доступность, связи переносов) ===
+    
+    def load_document(self, name: str) -> Dict:
+        """Загружает служебный документ"""
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT data FROM documents WHERE name = ?', (name,)
+            ).fetchone()
+        return json.loads(row[0]) if row else {}
+    
+    def save_document(self, name: str, data: Dict):
+        """Сохраняет служебный документ"""
+        with self._writing():
+            self.conn.execute(
+                'INSERT OR REPLACE INTO documents (name, data) VALUES (?, ?)',
+                (name, json.dumps(data, ensure_ascii=False))
+            )
+    
+    # === Обслуживание ===
+    
+    def compact(self):
+        """Переносит WAL в основной файл базы"""
+        with self._lock:
+            self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    
+    def close(self):
+        """Закрывает соединение"""
+        with self._lock:
+            self.conn.close()
+    
+    def _upgrade_schema(self):
+        """Добавляет колонки, появившиеся после создания базы"""
+        with self._writing():
+            columns = [row[1] for row in self.conn.execute('PRAGMA table_info(bookings)')]
+            if 'starts_at' not in columns:
+                self.conn.execute('ALTER TABLE bookings ADD COLUMN starts_at TEXT')
+                rows = self.conn.execute('SELECT booking_id, data FROM bookings').fetchall()
+                self.conn.executemany(
+                    'UPDATE bookings SET starts_at = ? WHERE booking_id = ?',
+                    [(booking_datetime_key(json.loads(data)), booking_id) for booking_id, data in rows]
+                )
+                print(f"✅ База обновлена: добавлен ключ даты и времени для {len(rows)} записей")
+            
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_bookings_starts_at ON bookings(starts_at)')
+    
+    def _create_slot_index(self):
+        """Создает уникальный индекс времени (после переноса: в старых данных бывают дубликаты)"""
+        try:
+            with self._writing():
+                self.conn.execute(SLOT_INDEX)
+        except sqlite3.IntegrityError:
+            with self._lock:
+                duplicates = self.conn.execute(
+                    f'SELECT date, time, COUNT(*) FROM bookings WHERE {SLOT_CONDITION} '
+                    'GROUP BY date, time HAVING COUNT(*) > 1'
+                ).fetchall()
+            for date, time, count in duplicates[:20]:
+                print(f"⚠️ Время {date} {time} занято {count} активными записями")
+            print("⚠️ Уникальность времени не проверяется, пока дубликаты не исправлены")
+    
+    # === Перенос из JSON-файлов ===
+    
+    def _migrate_if_needed(self):
+        """Переносит данные из JSON-файлов при первом запуске"""
+        if self.load_document('_migration'):
+            return
+        
+        with self._lock:
+            has_bookings = self.conn.execute('SELECT 1 FROM bookings LIMIT 1').fetchone()
+        if has_bookings:
+            return
+        
+        if not os.path.exists(os.path.join(self.data_dir, 'bookings_storage.json')):
+            self.save_document('_migration', {'migrated_at': datetime.now().isoformat(), 'source': None})
+            return
+        
+        # Перенос, проверка и отметка о переносе - одна транзакция: при расхождениях
+        # или сбое база остается пустой, и следующий запуск перенесет данные заново
+        with self.transaction():
+            stats = self.migrate_from_files(self.data_dir)
+            errors = self.verify_against_files(self.data_dir)
+            if errors:
+                for error in errors[:20]:
+                    print(f"❌ {error}")
+                raise RuntimeError(f"Перенос в SQLite не прошел проверку: {len(errors)} расхождений "
+                                   f"(база не изменена, JSON-файлы не тронуты)")
+            
+            self.save_document('_migration', {
+                'migrated_at': datetime.now().isoformat(),
+                'source': os.path.abspath(self.data_dir),
+                **stats
+            })
+        
+        print(f"✅ Данные перенесены в SQLite: записей {stats['bookings']}, пользователей {stats['users']}")
+    
+    def migrate_from_files(self, data_dir: str, batch_size: int = 1000) -> Dict[str, int]:
+        """
+        Потоково переносит снимки, журнал изменений и служебные документы
+        Отметку о переносе не ставит: ее пишет _migrate_if_needed после проверки
+        """
+        stats = {'bookings': 0, 'users': 0, 'log_records': 0}
+        
+        sources = [
+            (os.path.join(data_dir, 'bookings_storage.json'), self._write_booking, 'bookings'),
+            (os.path.join(data_dir, 'users_data.json'), self._write_user, 'users'),
+        ]
+        
+        for file_path, write, counter in sources:
+            if not os.path.exists(file_path):
+                continue
+            
+            batch = []
+            for record_id, record in iter_file_records(file_path):
+                batch.append((record_id, record))
+                if len(batch) >= batch_size:
+                    self._write_batch(write, batch)
+                    stats[counter] += len(batch)
+                    batch = []
+            if batch:
+                self._write_batch(write, batch)
+                stats[counter] += len(batch)
+        
+        for name in MIGRATED_DOCUMENTS:
+            file_path = os.path.join(data_dir, f'{name}.json')
+            if os.path.exists(file_path):
+                try:
+                    self.save_document(name, load_file(file_path))
+                except ValueError as e:
+                    print(f"⚠️ Не удалось перенести {file_path}: {e}")
+        
+        # Изменения из журнала, еще не попавшие в снимки (документы в журнале новее файлов)
+        log_records = self._read_log(data_dir)
+        with self._writing():
+            for record in log_records:
+                op = record.get('op')
+                if op == 'booking_put':
+                    self._write_booking(record['id'], record['data'])
+                elif op == 'booking_set':
+                    booking = self._fetch_booking(record['id'])
+                    if booking is not None:
+                        booking.update(record['fields'])
+                        self._write_booking(record['id'], booking)
+                elif op == 'booking_del':
+                    self.conn.execute('DELETE FROM bookings WHERE booking_id = ?', (record['id'],))
+                elif op == 'user_put':
+                    self._write_user(record['id'], record['data'])
+                elif op == 'doc_put':
+                    self.save_document(record['name'], record['data'])
+        stats['log_records'] = len(log_records)
+        return stats
+    
+    def verify_against_files(self, data_dir: str) -> List[str]:
+        """Сверяет содержимое базы с файлами хранилища, возвращает список расхождений"""
+        errors = []
+        
+        # Журнал ограничен порогом компактификации, поэтому держим его в памяти
+        log_ops = {}
+        for record in self._read_log(data_dir):
+            if record.get('op') == 'doc_put':
+                continue
+            key = ('user' if record.get('op') == 'user_put' else 'booking', record.get('id'))
+            log_ops.setdefault(key, []).append(record)
+        
+        sources = [
+            (os.path.join(data_dir, 'bookings_storage.json'), 'booking', self.get_booking, 'bookings'),
+            (os.path.join(data_dir, 'users_data.json'), 'user', self.get_user, 'users'),
+        ]
+        
+        for file_path, kind, fetch, table in sources:
+            expected_count = 0
+            seen = set()
+            
+            if os.path.exists(file_path):
+                for record_id, record in iter_file_records(file_path):
+                    key = (kind, record_id)
+                    if key in log_ops:
+                        seen.add(key)
+                    expected = self._apply_log_ops(record, log_ops.get(key, []))
+                    if expected is not None:
+                        expected_count += 1
+                    if fetch(record_id) != expected:
+                        errors.append(f"{kind} {record_id}: данные не совпадают")
+            
+            # Записи, которые есть только в журнале
+            for key, ops in log_ops.items():
+                if key[0] != kind or key in seen:
+                    continue
+                expected = self._apply_log_ops(None, ops)
+                if expected is None:
+                    continue
+                expected_count += 1
+                if fetch(key[1]) != expected:
+                    errors.append(f"{kind} {key[1]}: данные из журнала не совпадают")
+            
+            with self._lock:
+                actual_count = self.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            if actual_count != expected_count:
+                errors.append(f"{table}: в базе {actual_count}, в файлах {expected_count}")
+        
+        return errors
+    
+    def _write_batch(self, write, batch: List[Tuple[str, Dict]]):
+        with self._writing():
+            for record_id, record in batch:
+                write(record_id, record)
+    
+    def _read_log(self, data_dir: str) -> List[Dict]:
+        """Операции журнала изменений (транзакции раскрыты)"""
+        log_file = os.path.join(data_dir, 'storage_log.jsonl')
+        return list(iter_operations(MutationLog(log_file).replay()))
+    
+    @staticmethod
+    def _apply_log_ops(record: Optional[Dict], ops: List[Dict]) -> Optional[Dict]:
+        for op in ops:
+            if op['op'] in ('booking_put', 'user_put'):
+                record = op['data']
+            elif op['op'] == 'booking_set' and record is not None:
+                record = {**record, **op['fields']}
+            elif op['op'] == 'booking_del':
+                record = None
+        return record
+
+
+if __name__ == '__main__':
+    from config import SQLITE_DB_FILE
+    
+    storage = SQLiteStorage('data', SQLITE_DB_FILE)
+    problems = storage.verify_against_files('data')
+    if problems:
+        print(f"❌ Найдено расхождений: {len(problems)}")
+        for problem in problems[:20]:
+            print(f"   {problem}")
+    else:
+        print(f"✅ База {SQLITE_DB_FILE} совпадает с JSON-файлами")
+    storage.close()
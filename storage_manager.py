@@ -1,26 +1,69 @@
 """
 Упрощенный StorageManager с поддержкой нового менеджера переносов
+Проверка индексов хранилища: python storage_manager.py
 """
 
-import json
 import os
-from datetime import datetime
-from typing import Dict, List, Optional, Any
-from uuid import uuid4
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Any, Tuple
+from config import (STORAGE_BACKEND, STORAGE_COMPACT_EVERY, SQLITE_DB_FILE, ARCHIVE_AFTER_DAYS,
+                    ARCHIVE_CACHE_MB, USERS_FLUSH_DELAY_MS, SHEETS_MAX_ATTEMPTS,
+                    SHEETS_VIEW_REFRESH_SECONDS, SHEETS_COALESCE_MS)
+from booking_archive import BookingArchive, FINISHED_STATUSES
+from booking_columns import BookingColumns
+from booking_ids import new_booking_id
+from booking_record import SLOT_STATUSES, Booking, SlotTakenError
+from booking_time import booking_datetime_key, datetime_key
+from durable_writer import get_writer
+from sheets_outbox import SheetsOutbox, Undeliverable
+from user_profiles import UserProfileStore
 
 class StorageManager:
     def __init__(self, google_sheets=None):
         self.google_sheets = google_sheets
         self.data_dir = 'data'
-        self.bookings_file = os.path.join(self.data_dir, 'bookings_storage.json')
-        self.users_file = os.path.join(self.data_dir, 'users_data.json')
         
         self._ensure_data_dir()
-        self._ensure_files()
         
-        # Кеш в памяти для производительности
-        self._bookings_cache = None
-        self._users_cache = None
+        # Обновления Google Sheets отправляются фоновым потоком из очереди на диске
+        self.sheets_outbox = None
+        if google_sheets:
+            self.sheets_outbox = SheetsOutbox(
+                os.path.join(self.data_dir, 'sheets_outbox.log'),
+                {'add_booking': self._sheets_add_booking, 'update_status': self._sheets_update_status},
+                SHEETS_MAX_ATTEMPTS,
+                # Отсортированный лист таблицы обновляется в том же потоке, пока очередь пуста
+                idle_handler=getattr(google_sheets, 'refresh_sorted_view', None),
+                idle_interval=SHEETS_VIEW_REFRESH_SECONDS,
+                # Изменения за окно SHEETS_COALESCE_MS уходят в таблицу одной пачкой
+                batch_handler=self._sheets_apply_batch if hasattr(google_sheets, 'apply_batch') else None,
+                coalesce_delay=SHEETS_COALESCE_MS / 1000
+            )
+        
+        # Локальное хранилище: JSON-файлы с журналом или SQLite
+        self.backend = self._create_backend()
+        
+        # Профили клиентов: изменения пишутся в хранилище пачками
+        self.users = UserProfileStore(self.backend, USERS_FLUSH_DELAY_MS / 1000)
+        
+        # Колоночное представление записей для аналитики (строится при первом запросе)
+        self._columns = None
+        
+        # Открытая транзакция: отложенные обновления Google Sheets и записи, поднятые из архива
+        self._tx_sheets = None
+        self._tx_restored = None
+        
+        # Архив завершенных записей (помесячные сжатые файлы): в памяти хранилища
+        # остаются только актуальные записи, архивные читаются через LRU-кеш
+        self.archive = BookingArchive(os.path.join(self.data_dir, 'archive'),
+                                      ARCHIVE_CACHE_MB * 1024 * 1024)
+        self._archived_on = None
+        self._archive_if_due()
+        
+        # Счетчики записей по статусам (обновляются при каждом изменении статуса)
+        self._status_counts = None
+        self._generation = None
         
         # Инициализируем менеджер переносов
         from reschedule_manager import RescheduleManager
@@ -35,129 +78,264 @@ class StorageManager:
             os.makedirs(self.data_dir)
             print(f"✅ Создана папка {self.data_dir}")
     
-    def _ensure_files(self):
-        """Создает необходимые файлы"""
-        default_files = {
-            self.bookings_file: {},
-            self.users_file: {}
-        }
+    def _create_backend(self):
+        """Создает хранилище, выбранное в STORAGE_BACKEND"""
+        if STORAGE_BACKEND == 'sqlite':
+            from sqlite_storage import SQLiteStorage
+            print(f"✅ Локальное хранилище: SQLite ({SQLITE_DB_FILE})")
+            return SQLiteStorage(self.data_dir, SQLITE_DB_FILE)
         
-        for file_path, default_data in default_files.items():
-            if not os.path.exists(file_path):
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(default_data, f, ensure_ascii=False, indent=2)
-                print(f"✅ Создан файл {file_path}")
+        from file_storage import FileStorage
+        return FileStorage(self.data_dir, STORAGE_COMPACT_EVERY)
     
     # === Основные методы ===
     
-    def add_booking(self, booking_data: Dict[str, Any]) -> str:
-        """Добавляет запись во все хранилища"""
-        # Генерируем booking_id
-        booking_id = str(uuid4())
+    def add_booking(self, booking_data: Dict[str, Any]) -> Optional[str]:
+        """
+        Добавляет запись во все хранилища
+        Возвращает None, если время уже занято другой активной записью
+        """
+        self._archive_if_due()
+        
+        # Генерируем booking_id (упорядочен по времени создания)
+        booking_id = new_booking_id()
         booking_data['booking_id'] = booking_id
         booking_data['created_at'] = datetime.now().isoformat()
+        booking_data['version'] = 1
         
         # Устанавливаем статус по умолчанию, если не указан
         if 'status' not in booking_data:
             booking_data['status'] = 'ожидает'
         
-        # Сохраняем в локальное JSON хранилище
-        bookings = self._load_bookings()
-        bookings[booking_id] = booking_data
-        self._save_bookings(bookings)
-        print(f"✅ Запись {booking_id[:8]}... сохранена в JSON")
+        # Сохраняем в локальное хранилище (оно же проверяет, что время свободно)
+        try:
+            self.backend.put_booking(booking_id, booking_data)
+        except SlotTakenError as e:
+            print(f"⚠️ Запись не создана: {e}")
+            return None
+        self._count_status(None, booking_data['status'])
+        self._columns_put(booking_id, booking_data)
+        print(f"✅ Запись {booking_id[-8:]}... сохранена в локальном хранилище")
+        
+        if booking_data.get('telegram_id') is not None:
+            self.users.record_booking(booking_data['telegram_id'], booking_data)
         
         # Сохраняем в Google Sheets/CSV
-        if self.google_sheets:
-            try:
-                # Копируем данные для Google Sheets с ID
-                gs_data = booking_data.copy()
-                
-                # Убедимся, что есть все необходимые поля
-                gs_data.setdefault('status_updated', '')
-                gs_data.setdefault('reschedule_id', '')
-                gs_data.setdefault('original_booking_id', '')
-                
-                self.google_sheets.add_booking(gs_data)
-                print(f"✅ Запись {booking_id[:8]}... сохранена в Google Sheets/CSV")
-            except Exception as e:
-                print(f"⚠️ Ошибка сохранения в Google Sheets/CSV: {e}")
+        self._sync_sheets(booking_id, 'add_booking', dict(booking_data))
         
         return booking_id
     
     def update_booking_status(self, booking_id: str, status: str, 
                              master_comment: str = None) -> bool:
         """Обновляет статус записи во всех хранилищах"""
-        bookings = self._load_bookings()
+        try:
+            return self._set_status(booking_id, status, master_comment)
+        except SlotTakenError as e:
+            print(f"⚠️ Статус записи {booking_id[-8:]}... не изменен: {e}")
+            return False
+    
+    def _set_status(self, booking_id: str, status: str, master_comment: str = None) -> bool:
+        """Меняет статус; если запись займет уже занятое время, бросает SlotTakenError"""
+        booking = self.backend.get_booking(booking_id)
         
-        if booking_id not in bookings:
+        if booking is None:
+            booking = self._restore_from_archive(booking_id)
+        
+        if booking is None:
             print(f"❌ Запись {booking_id} не найдена в хранилище")
             return False
         
-        # Обновляем в JSON хранилище
-        old_status = bookings[booking_id].get('status')
-        bookings[booking_id]['status'] = status
-        bookings[booking_id]['status_updated'] = datetime.now().isoformat()
+        # Обновляем в локальном хранилище
+        old_status = booking.get('status')
+        fields = {
+            'status': status,
+            'status_updated': datetime.now().isoformat(),
+            'version': booking.get('version', 0) + 1
+        }
         if master_comment:
-            bookings[booking_id]['master_comment'] = master_comment
+            fields['master_comment'] = master_comment
         
-        self._save_bookings(bookings)
-        print(f"✅ Статус записи {booking_id[:8]}... изменен: {old_status} -> {status}")
+        booking = self.backend.update_booking(booking_id, fields)
+        self._count_status(old_status, status)
+        self._columns_put(booking_id, booking)
+        print(f"✅ Статус записи {booking_id[-8:]}... изменен: {old_status} -> {status}")
         
-        # Обновляем в Google Sheets/CSV
-        if self.google_sheets:
-            try:
-                booking = bookings[booking_id]
-                
-                # Собираем данные для поиска записи в таблице
-                gs_data = {
-                    'booking_id': booking_id,
-                    'name': booking.get('name', ''),
-                    'date': booking.get('date', ''),
-                    'time': booking.get('time', ''),
-                    'phone': booking.get('phone', '')
-                }
-                
-                success = self.google_sheets.add_status(gs_data, status)
-                if not success:
-                    print(f"⚠️ Не удалось обновить статус в Google Sheets")
-                
-            except Exception as e:
-                print(f"⚠️ Ошибка обновления в Google Sheets/CSV: {e}")
+        # Обновляем в Google Sheets/CSV (в очереди только поля для поиска строки)
+        lookup = {field: booking.get(field, '') for field in ('name', 'date', 'time', 'phone')}
+        updated_at = datetime.fromisoformat(fields['status_updated']).strftime('%Y-%m-%d %H:%M:%S')
+        self._sync_sheets(booking_id, 'update_status', booking_id, lookup, status, updated_at)
         
         return True
     
-    def get_booking(self, booking_id: str) -> Optional[Dict]:
-        """Получает запись по ID"""
-        bookings = self._load_bookings()
-        return bookings.get(booking_id)
+    def get_booking(self, booking_id: str) -> Optional[Booking]:
+        """Получает запись по ID (в том числе из архива), только для чтения"""
+        booking = self.backend.get_booking(booking_id)
+        if booking is None:
+            archived = self.archive.get(booking_id)
+            if archived is not None:
+                booking = Booking(archived, booking_id)
+        return booking
     
     def get_user_bookings(self, telegram_id: str, 
-                         status_filter: List[str] = None) -> List[Dict]:
+                         status_filter: List[str] = None) -> List[Booking]:
         """Получает записи пользователя"""
-        bookings = self._load_bookings()
-        
-        user_bookings = []
-        for booking_id, booking in bookings.items():
-            if str(booking.get('telegram_id')) == str(telegram_id):
-                if status_filter is None or booking.get('status') in status_filter:
-                    user_bookings.append({
-                        'booking_id': booking_id,
-                        **booking
-                    })
-        
-        # Сортировка по дате
-        user_bookings.sort(key=lambda x: (
-            x.get('date', ''),
-            x.get('time', '')
-        ))
-        
-        return user_bookings
+        return self._find_bookings(telegram_id=telegram_id, statuses=status_filter)
     
     def cancel_booking_by_id(self, booking_id: str) -> bool:
         """Отменяет запись по ID"""
         return self.update_booking_status(booking_id, 'отменено')
     
+    def compare_and_set_status(self, booking_id: str, expected_version: int, status: str,
+                               master_comment: str = None) -> Tuple[bool, str]:
+        """
+        Меняет статус, только если запись не менялась с версии expected_version
+        Если запись успели изменить, возвращает (False, описание конфликта)
+        """
+        with self.transaction():
+            booking = self.get_booking(booking_id)
+            if booking is None:
+                return False, "Запись не найдена"
+            
+            if booking.get('version', 0) != expected_version:
+                print(f"⚠️ Конфликт версий записи {booking_id[-8:]}...: "
+                      f"ожидалась {expected_version}, текущая {booking.get('version', 0)}")
+                return False, f"Запись уже изменена, текущий статус: {booking.get('status')}"
+            
+            try:
+                if not self._set_status(booking_id, status, master_comment):
+                    return False, "Не удалось обновить запись"
+            except SlotTakenError:
+                return False, "Это время уже занято другой записью"
+        
+        return True, ""
+    
+    # === Транзакции ===
+    
+    @contextmanager
+    def transaction(self):
+        """
+        Выполняет изменения блока атомарно: при исключении не сохраняется ни одно
+        Google Sheets обновляется только после успешного завершения транзакции
+        """
+        if self._tx_sheets is not None:
+            # Вложенный блок - часть внешней транзакции
+            yield
+            return
+        
+        self._archive_if_due()
+        self._tx_sheets = []
+        self._tx_restored = set()
+        self.users.begin()
+        try:
+            with self.backend.transaction():
+                yield
+                # Профили клиентов фиксируются той же транзакцией, что и записи
+                self.users.commit()
+        except BaseException:
+            # Записи, поднятые из архива в отмененной транзакции, остались в архиве
+            self._tx_sheets = None
+            self._tx_restored = None
+            
+            # Счетчики могли учесть отмененные изменения
+            self._status_counts = None
+            self._columns = None
+            self.reschedule_manager.reset_index()
+            self.users.rollback()
+            raise
+        
+        self.users.end()
+        pending = self._tx_sheets
+        restored = self._tx_restored
+        self._tx_sheets = None
+        self._tx_restored = None
+        
+        # Поднятые из архива записи уже сохранены в хранилище - убираем их из архива
+        for booking_id in restored:
+            self.archive.restore(booking_id)
+        for key, op, args in pending:
+            self.sheets_outbox.put(op, *args, key=key)
+    
+    # === Google Sheets ===
+    
+    def _sync_sheets(self, booking_id: str, op: str, *args):
+        """Ставит обновление Google Sheets в очередь сразу или после завершения транзакции"""
+        if not self.sheets_outbox:
+            return
+        
+        if self._tx_sheets is not None:
+            self._tx_sheets.append((booking_id, op, args))
+        else:
+            self.sheets_outbox.put(op, *args, key=booking_id)
+    
+    def get_sheets_queue_stats(self) -> Optional[Dict]:
+        """
+        Глубина и отставание очереди Google Sheets и сколько запросов к API сэкономили пачки
+        None - таблица не подключена
+        """
+        if not self.sheets_outbox:
+            return None
+        
+        stats = self.sheets_outbox.stats()
+        stats['api_calls_saved'] = getattr(self.google_sheets, 'api_calls_saved', 0)
+        return stats
+    
+    def _sheets_add_booking(self, booking_data: Dict) -> bool:
+        """Добавляет запись в Google Sheets/CSV (вызывается из очереди)"""
+        if not self.google_sheets.add_booking(self._sheets_booking_data(booking_data)):
+            return False
+        print(f"✅ Запись {booking_data['booking_id'][-8:]}... сохранена в Google Sheets/CSV")
+        return True
+    
+    def _sheets_update_status(self, booking_id: str, booking: Dict, status: str,
+                              status_updated: str = None) -> bool:
+        """Обновляет статус записи в Google Sheets/CSV (вызывается из очереди)"""
+        gs_data = self._sheets_status_data(booking_id, booking, status_updated)
+        success = self.google_sheets.add_status(gs_data, status)
+        if success is None:
+            # Строки нет в таблице - повтор не поможет
+            raise Undeliverable(f"запись {booking_id} не найдена в таблице")
+        if not success:
+            print(f"⚠️ Не удалось обновить статус в Google Sheets")
+        return success
+    
+    def _sheets_apply_batch(self, items: List[Dict]) -> Tuple[List[int], List[int]]:
+        """Отправляет пачку обновлений из очереди одним обращением к таблице"""
+        changes = []
+        for item in items:
+            if item['op'] == 'add_booking':
+                changes.append((item['seq'], 'add', self._sheets_booking_data(*item['args']), None))
+            elif item['op'] == 'update_status':
+                booking_id, booking, status = item['args'][:3]
+                status_updated = item['args'][3] if len(item['args']) > 3 else None
+                changes.append((item['seq'], 'status',
+                                self._sheets_status_data(booking_id, booking, status_updated), status))
+            else:
+                changes.append((item['seq'], item['op'], None, None))
+        
+        return self.google_sheets.apply_batch(changes)
+    
+    def _sheets_booking_data(self, booking_data: Dict) -> Dict:
+        """Данные новой записи для Google Sheets"""
+        # Копируем данные для Google Sheets с ID
+        gs_data = booking_data.copy()
+        
+        # Убедимся, что есть все необходимые поля
+        gs_data.setdefault('status_updated', '')
+        gs_data.setdefault('reschedule_id', '')
+        gs_data.setdefault('original_booking_id', '')
+        return gs_data
+    
+    def _sheets_status_data(self, booking_id: str, booking: Dict, status_updated: str = None) -> Dict:
+        """Данные для поиска записи в таблице при смене статуса"""
+        return {
+            'booking_id': booking_id,
+            'name': booking.get('name', ''),
+            'date': booking.get('date', ''),
+            'time': booking.get('time', ''),
+            'phone': booking.get('phone', ''),
+            'status_updated': status_updated
+        }
+    
     # === Методы для работы с переносами (делегируем RescheduleManager) ===
     
     def request_reschedule(self, original_booking_id: str, new_booking_data: Dict) -> tuple:
@@ -168,9 +346,11 @@ class StorageManager:
         """Мастер предлагает перенос записи"""
         return self.reschedule_manager.offer_reschedule(original_booking_id, new_date, new_time)
     
-    def accept_reschedule(self, reschedule_booking_id: str, accepted_by: str) -> tuple:
+    def accept_reschedule(self, reschedule_booking_id: str, accepted_by: str,
+                          expected_version: int = None) -> tuple:
         """Принимает перенос"""
-        return self.reschedule_manager.accept_reschedule(reschedule_booking_id, accepted_by)
+        return self.reschedule_manager.accept_reschedule(reschedule_booking_id, accepted_by,
+                                                         expected_version)
     
     def reject_reschedule(self, reschedule_booking_id: str, rejected_by: str, reason: str = "") -> tuple:
         """Отклоняет перенос"""
@@ -182,68 +362,90 @@ class StorageManager:
     
     def get_reschedule_info(self, booking_id: str) -> Optional[Dict]:
         """Получает информацию о переносе"""
+        self._check_generation()
         return self.reschedule_manager.get_reschedule_info(booking_id)
     
+    def get_related_booking_ids(self, booking_id: str) -> List[str]:
+        """ID записей, связанных переносом (для блокировок обработчиков)"""
+        return self.reschedule_manager.get_related_ids(booking_id)
+    
     def get_reschedule_requests(self) -> List[Dict]:
         """Получает все активные запросы на перенос"""
+        self._check_generation()
         return self.reschedule_manager.get_active_reschedules('client_requested')
     
     def get_reschedule_offers(self) -> List[Dict]:
         """Получает все активные предложения переноса"""
+        self._check_generation()
         return self.reschedule_manager.get_active_reschedules('master_offered')
     
     def get_reschedule_requests_count(self) -> int:
         """Получает количество запросы на перенос"""
-        return len(self.get_reschedule_requests())
+        self._check_generation()
+        return self.reschedule_manager.count_active_reschedules('client_requested')
+    
+    def get_reschedule_offers_count(self) -> int:
+        """Получает количество активных предложений переноса"""
+        self._check_generation()
+        return self.reschedule_manager.count_active_reschedules('master_offered')
     
     # === Методы для пользователей ===
     
     def save_user_phone(self, telegram_id: str, phone: str):
-        """Сохраняет телефон пользователя"""
-        users = self._load_users()
-        
-        users[str(telegram_id)] = {
-            'phone': phone,
-            'last_updated': datetime.now().isoformat()
-        }
-        
-        self._save_users(users)
-        print(f"✅ Телефон сохранен для пользователя {telegram_id}")
+        """Сохраняет телефон пользователя (если он изменился)"""
+        self._check_generation()
+        if self.users.set_phone(telegram_id, phone):
+            print(f"✅ Телефон сохранен для пользователя {telegram_id}")
     
     def get_user_phone(self, telegram_id: str) -> Optional[str]:
         """Получает телефон пользователя"""
-        users = self._load_users()
-        user_data = users.get(str(telegram_id))
-        return user_data.get('phone') if user_data else None
+        self._check_generation()
+        return self.users.get_phone(telegram_id)
+    
+    def get_user_profile(self, telegram_id: str) -> Optional[Dict]:
+        """Профиль клиента: телефон, last_seen, последняя запись"""
+        self._check_generation()
+        return self.users.get(telegram_id)
+    
+    def touch_user(self, telegram_id: str):
+        """Отмечает обращение клиента к боту"""
+        self._check_generation()
+        self.users.touch(telegram_id)
     
     # === Методы для мастера ===
     
-    def get_bookings_by_status(self, status: str) -> List[Dict]:
+    def get_bookings_by_status(self, status: str) -> List[Booking]:
         """Получает записи по статусу"""
-        bookings = self._load_bookings()
-        
-        result = []
-        for booking_id, booking in bookings.items():
-            if booking.get('status') == status:
-                result.append({
-                    'booking_id': booking_id,
-                    **booking
-                })
-        
-        # Сортировка по дате
-        result.sort(key=lambda x: (
-            x.get('date', ''),
-            x.get('time', '')
-        ))
+        return self._find_bookings(statuses=[status])
+    
+    def get_slot_booking(self, date: str, time: str) -> Optional[str]:
+        """ID активной записи на это время или None (поиск по индексу занятого времени)"""
+        return self.backend.slot_booking(date, time)
+    
+    def get_occupied_times(self, date: str) -> List[str]:
+        """Время, занятое активными записями на дату"""
+        return self.backend.occupied_times(date)
+    
+    def get_bookings_between(self, start: datetime, end: datetime,
+                             statuses: List[str] = None) -> List[Booking]:
+        """Получает записи с датой и временем от start до end включительно (по возрастанию)"""
+        start_key, end_key = datetime_key(start), datetime_key(end)
+        result = self.backend.find_bookings_between(start_key, end_key, statuses)
+        
+        if statuses is None or any(status in FINISHED_STATUSES for status in statuses):
+            archived = self.archive.find_between(start_key, end_key, statuses)
+            if archived:
+                result.extend(Booking(booking) for booking in archived)
+                result.sort(key=booking_datetime_key)
         
         return result
     
     def get_statistics(self) -> Dict[str, int]:
-        """Возвращает статистику записей"""
-        bookings = self._load_bookings()
+        """Возвращает статистику записей (по счетчикам, без обхода записей)"""
+        counts = self._get_status_counts()
         
         stats = {
-            'total': len(bookings),
+            'total': sum(counts.values()),
             'ожидает': 0,
             'подтверждено': 0,
             'выполнено': 0,
@@ -253,53 +455,186 @@ class StorageManager:
             'отменено': 0
         }
         
-        for booking in bookings.values():
-            status = booking.get('status')
+        for status, count in counts.items():
             if status in stats:
-                stats[status] += 1
+                stats[status] += count
         
         return stats
     
-    # === Вспомогательные методы ===
+    def get_service_counts(self, statuses: List[str] = None) -> Dict[str, int]:
+        """Количество записей по услугам (вместе с архивом, как и get_statistics)"""
+        counts = self._get_columns().count_by_service(statuses)
+        for service, count in self.archive.count_by_service(statuses).items():
+            counts[service] = counts.get(service, 0) + count
+        return counts
     
-    def _load_bookings(self) -> Dict:
-        """Загружает записи из файла"""
-        if self._bookings_cache is not None:
-            return self._bookings_cache
-        
-        try:
-            with open(self.bookings_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            data = {}
+    def get_daily_occupancy(self, start: date, end: date) -> Dict[str, int]:
+        """Количество активных записей по дням в диапазоне [start, end]"""
+        return self._get_columns().occupancy_by_day(start, end, list(SLOT_STATUSES))
+    
+    def _get_columns(self) -> BookingColumns:
+        """Колоночное представление записей хранилища (строится один раз)"""
+        self._check_generation()
+        if self._columns is None:
+            self._columns = BookingColumns(self.backend.iter_bookings())
+        return self._columns
+    
+    def _columns_put(self, booking_id: str, booking: Dict):
+        """Обновляет строку записи в колоночном представлении, если оно построено"""
+        if self._columns is not None:
+            self._columns.put(booking_id, booking)
+    
+    def _get_status_counts(self) -> Dict[str, int]:
+        """Счетчики по статусам (считаются по хранилищу один раз)"""
+        self._check_generation()
+        if self._status_counts is None:
+            counts = dict(self.backend.count_by_status())
+            for status, count in self.archive.count_by_status().items():
+                counts[status] = counts.get(status, 0) + count
+            self._status_counts = counts
+        return self._status_counts
+    
+    def _check_generation(self):
+        """Сбрасывает счетчики и кеши, если хранилище изменили извне"""
+        generation = self.backend.generation()
+        if generation != self._generation:
+            self._generation = generation
+            self._status_counts = None
+            self._columns = None
+            self.reschedule_manager.reset_index()
+            self.users.reset()
+    
+    def _count_status(self, old_status: Optional[str], new_status: str):
+        """Переносит запись из счетчика старого статуса в счетчик нового"""
+        if self._status_counts is None:
+            return
         
-        self._bookings_cache = data
-        return data
+        if old_status is not None:
+            self._status_counts[old_status] = self._status_counts.get(old_status, 0) - 1
+            if self._status_counts[old_status] <= 0:
+                del self._status_counts[old_status]
+        self._status_counts[new_status] = self._status_counts.get(new_status, 0) + 1
+    
+    # === Архив ===
     
-    def _save_bookings(self, data: Dict):
-        """Сохраняет записи в файл"""
-        with open(self.bookings_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    def archive_finished_bookings(self, older_than_days: int) -> int:
+        """Переносит завершенные записи старше older_than_days дней в архив"""
+        self._archived_on = datetime.now().date()
+        cutoff = self._archived_on - timedelta(days=older_than_days)
+        
+        to_archive = {}
+        for booking in self.backend.find_bookings(statuses=FINISHED_STATUSES):
+            try:
+                booking_date = datetime.strptime(booking.get('date', ''), '%d.%m.%Y').date()
+            except ValueError:
+                continue
+            if booking_date < cutoff:
+                booking = booking.to_dict()
+                booking_id = booking.pop('booking_id')
+                to_archive[booking_id] = booking
+        
+        if not to_archive:
+            return 0
         
-        self._bookings_cache = data
+        archived = self.archive.archive(to_archive)
+        
+        # Удаляем одной транзакцией: после сбоя здесь записи остаются в хранилище
+        # целиком, и следующий перенос (раз в день) перезапишет их в архиве и удалит
+        with self.backend.transaction():
+            for booking_id in to_archive:
+                self.backend.delete_booking(booking_id)
+        if self._columns is not None:
+            for booking_id in to_archive:
+                self._columns.remove(booking_id)
+        
+        print(f"✅ В архив перенесено завершенных записей: {archived}")
+        return archived
+    
+    def _archive_if_due(self):
+        """
+        Раз в день переносит устаревшие завершенные записи в архив,
+        чтобы хранилище не росло вместе с историей (только вне транзакции)
+        """
+        if ARCHIVE_AFTER_DAYS <= 0 or self._tx_sheets is not None:
+            return
+        if self._archived_on != datetime.now().date():
+            self.archive_finished_bookings(ARCHIVE_AFTER_DAYS)
     
-    def _load_users(self) -> Dict:
-        """Загружает данные пользователей"""
-        if self._users_cache is not None:
-            return self._users_cache
+    def _restore_from_archive(self, booking_id: str) -> Optional[Dict]:
+        """
+        Возвращает запись из архива в основное хранилище
+        Из архива запись удаляется только после того, как она сохранена в хранилище
+        (в транзакции - после ее фиксации): при сбое между этими шагами запись
+        есть в обоих местах, и чтение берет копию из хранилища
+        """
+        booking = self.archive.get(booking_id)
+        if booking is not None:
+            self.backend.put_booking(booking_id, booking)
+            self._columns_put(booking_id, booking)
+            if self._tx_restored is not None:
+                self._tx_restored.add(booking_id)
+            else:
+                self.archive.restore(booking_id)
+            print(f"✅ Запись {booking_id[-8:]}... возвращена из архива")
+        return booking
+    
+    def _find_bookings(self, telegram_id: str = None, statuses: List[str] = None,
+                       date: str = None) -> List[Booking]:
+        """Ищет записи в хранилище и, если нужны завершенные, в архиве"""
+        result = self.backend.find_bookings(telegram_id=telegram_id, statuses=statuses, date=date)
         
-        try:
-            with open(self.users_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            data = {}
+        if statuses is None or any(status in FINISHED_STATUSES for status in statuses):
+            archived = self.archive.find(telegram_id=telegram_id, statuses=statuses, date=date)
+            if archived:
+                # Запись, оставшаяся в архиве после сбоя при возврате, берется из хранилища
+                live_ids = {booking.get('booking_id') for booking in result}
+                result.extend(Booking(booking) for booking in archived
+                              if booking.get('booking_id') not in live_ids)
+                result.sort(key=booking_datetime_key)
         
-        self._users_cache = data
-        return data
+        return result
+    
+    def check_indexes(self) -> bool:
+        """Сверяет индексы хранилища с записями"""
+        problems = self.backend.check_indexes()
+        for problem in problems:
+            print(f"❌ Индекс хранилища: {problem}")
+        if not problems:
+            print("✅ Индексы хранилища согласованы с записями")
+        return not problems
+    
+    # === Служебные документы (доступность, связи переносов) ===
+    
+    def load_document(self, name: str) -> Dict:
+        """Загружает служебный документ из локального хранилища"""
+        return self.backend.load_document(name)
+    
+    def save_document(self, name: str, data: Dict):
+        """Сохраняет служебный документ в локальное хранилище"""
+        self.backend.save_document(name, data)
     
-    def _save_users(self, data: Dict):
-        """Сохраняет данные пользователей"""
-        with open(self.users_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    # === Обслуживание ===
+    
+    def compact(self):
+        """Уплотняет локальное хранилище"""
+        self.users.flush()
+        self.backend.compact()
+    
+    def close(self):
+        """Сбрасывает изменения на диск при остановке бота"""
+        # Неотправленные обновления таблицы останутся в очереди до следующего запуска
+        if self.sheets_outbox:
+            self.sheets_outbox.close()
+        
+        self.users.close()
+        self.backend.close()
         
-        self._users_cache = data
\ No newline at end of file
+        # Дописываем файлы, ожидающие групповой записи (в т.ч. настройки напоминаний)
+        get_writer().close()
+
+
+if __name__ == '__main__':
+    storage = StorageManager()
+    consistent = storage.check_indexes()
+    storage.close()
+    raise SystemExit(0 if consistent else 1)
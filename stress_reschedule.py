@@ -0,0 +1,158 @@
+"""
+Нагрузочная проверка блокировок переносов
+Создает переносы и одновременно запускает по каждому сотни конкурирующих
+принятий, отклонений и отмен, затем проверяет, что каждая пара записей
+пришла в одно из допустимых состояний.
+Вызовы хранилища и так выполняются по одному в его потоке, поэтому вторая
+часть держит booking_lock через несколько await (прочитать запись, уступить
+цикл событий, подтвердить по версии): без блокировки запись подтвердят
+несколько обработчиков сразу, и это видно по конфликтам версий.
+Запуск: python stress_reschedule.py [количество переносов] [повторов на перенос]
+По умолчанию: 100 переносов, по 3 повтора каждого вызова
+Работает во временной папке, данные бота не затрагивает.
+"""
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from async_storage import AsyncStorageManager
+from storage_manager import StorageManager
+
+# Допустимые итоги (исходная запись, запись-запрос): перенос принят, отклонен или отменен
+VALID_OUTCOMES = {
+    ('отменено', 'подтверждено'),
+    ('ожидает', 'отклонено'),
+    ('ожидает', 'отменено'),
+}
+
+
+async def create_reschedules(storage: AsyncStorageManager, count: int) -> list:
+    """Создает записи и запросы на их перенос (все слоты разные)"""
+    pairs = []
+    for i in range(count):
+        day, hour = i % 28 + 1, 10 + i // 28 % 10
+        year = 2030 + i // 280
+        original = {'name': f'Клиент {i}', 'phone': f'+7 900{i:07d}', 'telegram_id': 100000 + i,
+                    'service': '💅 Маникюр - 1500₽', 'date': f'{day:02d}.01.{year}', 'time': f'{hour}:00'}
+        booking_id = await storage.add_booking(original)
+        
+        requested = dict(original, date=f'{day:02d}.02.{year}')
+        success, request_id, message = await storage.request_reschedule(booking_id, requested)
+        if not success:
+            raise RuntimeError(f"Не удалось создать перенос: {message}")
+        pairs.append((booking_id, request_id))
+    return pairs
+
+
+async def stress(storage: AsyncStorageManager, pairs: list, repeat: int) -> dict:
+    """Запускает конкурирующие вызовы и проверяет итоговые статусы"""
+    calls = []
+    for booking_id, request_id in pairs:
+        for _ in range(repeat):
+            calls.append(storage.accept_reschedule(request_id, 'master'))
+            calls.append(storage.reject_reschedule(request_id, 'master'))
+            calls.append(storage.cancel_reschedule_request(booking_id))
+    random.shuffle(calls)
+    
+    start = time.perf_counter()
+    results = await asyncio.gather(*calls)
+    elapsed = time.perf_counter() - start
+    
+    inconsistent = []
+    for booking_id, request_id in pairs:
+        original = await storage.get_booking(booking_id)
+        request = await storage.get_booking(request_id)
+        outcome = (original['status'], request['status'])
+        if outcome not in VALID_OUTCOMES:
+            inconsistent.append((booking_id, request_id, outcome))
+    
+    return {
+        'calls': len(results),
+        'successful': sum(1 for result in results if result[0]),
+        'elapsed': elapsed,
+        'inconsistent': inconsistent,
+        'active': await storage.get_reschedule_requests_count(),
+        'locks_left': len(storage.locks),
+    }
+
+
+async def confirm_once(storage: AsyncStorageManager, booking_id: str) -> str:
+    """Подтверждает ожидающую запись: проверка и изменение под одной блокировкой"""
+    async with storage.booking_lock(booking_id):
+        booking = await storage.get_booking(booking_id)
+        if booking['status'] != 'ожидает':
+            return 'skipped'
+        
+        # Между проверкой и записью управление уходит другим обработчикам
+        await asyncio.sleep(0)
+        success, _ = await storage.compare_and_set_status(booking_id, booking['version'], 'подтверждено')
+        return 'confirmed' if success else 'conflict'
+
+
+async def stress_confirmations(storage: AsyncStorageManager, count: int, repeat: int) -> dict:
+    """Одновременно подтверждает каждую запись repeat раз, ровно одно подтверждение должно пройти"""
+    booking_ids = []
+    for i in range(count):
+        day, hour = i % 28 + 1, 10 + i // 28 % 10
+        booking_ids.append(await storage.add_booking({
+            'name': f'Клиент {i}', 'phone': f'+7 901{i:07d}', 'telegram_id': 200000 + i,
+            'service': '💅 Маникюр - 1500₽', 'date': f'{day:02d}.03.{2030 + i // 280}', 'time': f'{hour}:00'
+        }))
+    
+    calls = [confirm_once(storage, booking_id) for booking_id in booking_ids for _ in range(repeat)]
+    random.shuffle(calls)
+    
+    start = time.perf_counter()
+    results = await asyncio.gather(*calls)
+    elapsed = time.perf_counter() - start
+    
+    return {
+        'calls': len(results),
+        'confirmed': results.count('confirmed'),
+        'conflicts': results.count('conflict'),
+        'elapsed': elapsed,
+    }
+
+
+async def main(count: int, repeat: int) -> bool:
+    """Прогон на чистом хранилище, возвращает True если все переносы согласованы"""
+    storage = AsyncStorageManager(StorageManager())
+    try:
+        pairs = await create_reschedules(storage, count)
+        result = await stress(storage, pairs, repeat)
+        confirmations = await stress_confirmations(storage, count, repeat)
+    finally:
+        storage.close()
+        storage.sync.close()
+    
+    print(f"Вызовов: {result['calls']} за {result['elapsed']:.2f} с, успешных: {result['successful']}")
+    print(f"Активных переносов осталось: {result['active']}, замков осталось: {result['locks_left']}")
+    for booking_id, request_id, outcome in result['inconsistent'][:10]:
+        print(f"❌ {booking_id[-8:]} / {request_id[-8:]}: {outcome}")
+    
+    print(f"Подтверждений: {confirmations['calls']} за {confirmations['elapsed']:.2f} с, "
+          f"прошло: {confirmations['confirmed']}, конфликтов версий: {confirmations['conflicts']}")
+    
+    ok = (not result['inconsistent'] and result['successful'] == len(pairs)
+          and result['active'] == 0 and result['locks_left'] == 0)
+    print("✅ Все переносы согласованы" if ok else "❌ Найдены несогласованные переносы")
+    
+    confirmed_once = confirmations['confirmed'] == count and confirmations['conflicts'] == 0
+    print("✅ Каждая запись подтверждена один раз" if confirmed_once
+          else "❌ Записи подтверждались одновременно несколькими обработчиками")
+    return ok and confirmed_once
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    
+    # StorageManager пишет в ./data - уходим во временную папку
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        ok = asyncio.run(main(count, repeat))
+    sys.exit(0 if ok else 1)
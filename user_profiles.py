@@ -0,0 +1,221 @@
+"""
+Профили клиентов с отложенной записью
+Изменения копятся в памяти и пишутся в хранилище пачкой через
+USERS_FLUSH_DELAY_MS после первого изменения. Запись, которая ничего
+не меняет (тот же телефон, тот же визит в ту же минуту), пропускается.
+Кроме телефона профиль хранит last_seen и последнюю запись клиента,
+поэтому их можно узнать без обхода записей.
+Изменения внутри транзакции хранилища пишутся вместе с ней (commit),
+а при откате транзакции профили возвращаются к прежнему виду (rollback).
+Для незаписанных профилей помнятся измененные поля: если хранилище
+изменили извне (reset), профиль перечитывается и поля накладываются заново.
+"""
+
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, Union
+
+# Точность last_seen: обращения в пределах минуты не считаются изменением
+SEEN_FORMAT = '%Y-%m-%dT%H:%M'
+
+
+class UserProfileStore:
+    """Кеш профилей клиентов поверх хранилища с отложенной пакетной записью"""
+    
+    def __init__(self, backend, flush_delay: float = 2.0):
+        self.backend = backend
+        self.flush_delay = flush_delay
+        
+        # telegram_id (int) -> профиль; None - профиля нет в хранилище
+        self._profiles = {}
+        self._dirty = {}  # telegram_id -> поля, измененные после последней записи
+        self._dirty_since = None
+        
+        # Открытая транзакция: ключ -> (профиль до транзакции, его незаписанные поля или None)
+        self._tx_snapshot = None
+        
+        # Запуск сброса в потоке хранилища (устанавливает AsyncStorageManager)
+        self.submit = None
+        self._timer = None
+        self._timer_lock = threading.Lock()
+        
+        self.writes = 0
+        self.skipped = 0
+    
+    # === Чтение ===
+    
+    def get(self, telegram_id: Union[int, str]) -> Optional[Dict]:
+        """Профиль клиента (копия) или None"""
+        profile = self._load(self._key(telegram_id))
+        return dict(profile) if profile is not None else None
+    
+    def get_phone(self, telegram_id: Union[int, str]) -> Optional[str]:
+        """Телефон клиента"""
+        profile = self._load(self._key(telegram_id))
+        return profile.get('phone') if profile else None
+    
+    # === Изменения ===
+    
+    def set_phone(self, telegram_id: Union[int, str], phone: str) -> bool:
+        """Сохраняет телефон, возвращает False если он не изменился"""
+        now = datetime.now()
+        fields = {'last_seen': now.strftime(SEEN_FORMAT)}
+        if self.get_phone(telegram_id) != phone:
+            fields['phone'] = phone
+            fields['last_updated'] = now.isoformat()
+        
+        self._update(telegram_id, fields)
+        return 'phone' in fields
+    
+    def record_booking(self, telegram_id: Union[int, str], booking: Dict):
+        """Запоминает последнюю запись клиента"""
+        self._update(telegram_id, {
+            'last_booking_id': booking.get('booking_id'),
+            'last_booking_at': f"{booking.get('date', '')} {booking.get('time', '')}",
+            'last_seen': datetime.now().strftime(SEEN_FORMAT),
+        })
+    
+    def touch(self, telegram_id: Union[int, str]):
+        """Отмечает обращение клиента к боту"""
+        self._update(telegram_id, {'last_seen': datetime.now().strftime(SEEN_FORMAT)})
+    
+    def _update(self, telegram_id: Union[int, str], fields: Dict) -> bool:
+        """Меняет поля профиля в памяти, возвращает True если что-то изменилось"""
+        key = self._key(telegram_id)
+        profile = self._load(key)
+        if profile is not None and all(profile.get(field) == value for field, value in fields.items()):
+            self.skipped += 1
+            return False
+        
+        if self._tx_snapshot is not None and key not in self._tx_snapshot:
+            pending = self._dirty.get(key)
+            self._tx_snapshot[key] = (dict(profile) if profile is not None else None,
+                                      dict(pending) if pending is not None else None)
+        
+        if profile is None:
+            profile = self._profiles[key] = {}
+        profile.update(fields)
+        self._mark_dirty(key, fields)
+        return True
+    
+    # === Запись в хранилище ===
+    
+    def flush(self) -> int:
+        """Пишет измененные профили в хранилище одной транзакцией"""
+        with self._timer_lock:
+            self._timer = None
+        
+        if not self._dirty:
+            return 0
+        
+        # Очередь очищаем только после записи: при ошибке профили запишутся в следующий раз
+        dirty = list(self._dirty)
+        with self.backend.transaction():
+            for key in dirty:
+                self.backend.put_user(str(key), dict(self._profiles[key]))
+        
+        for key in dirty:
+            self._dirty.pop(key, None)
+        if not self._dirty:
+            self._dirty_since = None
+        self.writes += len(dirty)
+        return len(dirty)
+    
+    # === Транзакции ===
+    
+    def begin(self):
+        """Начинает транзакцию: запоминает профили до первого изменения"""
+        self._tx_snapshot = {}
+    
+    def commit(self):
+        """
+        Пишет профили, измененные в транзакции (вызывается внутри транзакции хранилища)
+        Снимок остается до end(): если транзакция хранилища не зафиксируется, rollback() его вернет
+        """
+        for key in self._tx_snapshot or {}:
+            if key in self._dirty:
+                self.backend.put_user(str(key), dict(self._profiles[key]))
+                self._dirty.pop(key)
+                self.writes += 1
+        if not self._dirty:
+            self._dirty_since = None
+    
+    def end(self):
+        """Транзакция хранилища зафиксирована - снимок больше не нужен"""
+        self._tx_snapshot = None
+    
+    def rollback(self):
+        """Возвращает профили, измененные в отмененной транзакции"""
+        changed, self._tx_snapshot = self._tx_snapshot or {}, None
+        for key, (profile, pending) in changed.items():
+            self._profiles[key] = profile
+            if pending is not None:
+                self._dirty[key] = pending
+            else:
+                self._dirty.pop(key, None)
+        self.reset()
+    
+    def reset(self):
+        """
+        Забывает прочитанные профили (хранилище могли изменить извне)
+        Незаписанные профили перечитываются, и их измененные поля накладываются заново
+        """
+        profiles = {}
+        for key, fields in self._dirty.items():
+            user = self.backend.get_user(str(key))
+            profiles[key] = dict(user or {}, **fields)
+        self._profiles = profiles
+    
+    def close(self):
+        """Останавливает таймер и пишет накопленные изменения"""
+        with self._timer_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        self.flush()
+    
+    def _mark_dirty(self, key: Union[int, str], fields: Dict):
+        """Ставит профиль в очередь на запись"""
+        self._dirty.setdefault(key, {}).update(fields)
+        if self._dirty_since is None:
+            self._dirty_since = time.monotonic()
+        
+        if self.submit is None:
+            # Без потока хранилища пишем при следующем изменении после задержки
+            # (внутри транзакции не пишем - профили уйдут вместе с ней)
+            if self._tx_snapshot is None and time.monotonic() - self._dirty_since >= self.flush_delay:
+                self.flush()
+            return
+        
+        with self._timer_lock:
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_delay, self._submit_flush)
+                self._timer.daemon = True
+                self._timer.start()
+    
+    def _submit_flush(self):
+        """Передает сброс в поток хранилища"""
+        try:
+            self.submit(self.flush)
+        except RuntimeError:
+            # Поток хранилища уже остановлен - изменения запишет close()
+            with self._timer_lock:
+                self._timer = None
+    
+    # === Вспомогательные методы ===
+    
+    def _load(self, key: Union[int, str]) -> Optional[Dict]:
+        """Профиль из кеша или из хранилища"""
+        if key not in self._profiles:
+            user = self.backend.get_user(str(key))
+            self._profiles[key] = dict(user) if user is not None else None
+        return self._profiles[key]
+    
+    @staticmethod
+    def _key(telegram_id: Union[int, str]) -> Union[int, str]:
+        """Ключ профиля: числовой telegram_id хранится как int"""
+        try:
+            return int(telegram_id)
+        except (TypeError, ValueError):
+            return str(telegram_id)